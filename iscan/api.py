@@ -9,7 +9,6 @@ from uuid import uuid1
 import django
 from django.core.exceptions import ValidationError
 from django.conf import settings
-from django.http.response import FileResponse, HttpResponse
 from django.db.models import Q
 from django.contrib.auth.models import User
 from django.contrib.auth import password_validation
@@ -20,17 +19,63 @@ from rest_framework.decorators import action
 from neo4j import exceptions as neo4j_exceptions
 
 
-from polyglotdb import CorpusContext
 from polyglotdb.query.base.func import Count
 
 from . import models
 from . import serializers
+from . import responses
+from . import columnar
+from .pipeline import build_graph
+from .hierarchy import hierarchy_etag
+from .connections import CorpusContext
+from .catalog import catalog_value, catalog_etag, property_values_entry, frequencies_key, FREQUENCY_TYPES
+from .autocomplete import prefix_index
+from .pyramids import discourse_pyramid, waveform_points
+from .renderers import ACOUSTIC_RENDERERS
+from .audio import utterance_audio, available_codecs, CODECS, FILE_TYPES
+from .detail import detail_window, claim_prefetch, DETAIL_BEFORE, DETAIL_AFTER
+from .results import InvalidOrdering
 from .utils import get_used_ports
-from .tasks import import_corpus_task, run_query_task, run_enrichment_task, reset_enrichment_task, delete_enrichment_task, run_query_export_task, run_query_generate_subset_task, run_spade_script_task
+from .tasks import start_database_task, stop_database_task, import_corpus_task, run_query_task, update_query_tracks_task, run_enrichment_task, run_enrichment_pipeline_task, reset_enrichment_task, delete_enrichment_task, run_query_export_task, run_query_generate_subset_task, prefetch_detail_task, run_spade_script_task
 
 import logging
 log = logging.getLogger('polyglot_server')
 
+# Seconds clients can reuse waveforms and spectrograms without checking whether the audio has changed
+PYRAMID_MAX_AGE = getattr(settings, 'POLYGLOT_PYRAMID_MAX_AGE', 3600)
+# Seconds clients can reuse utterance audio, which doesn't change for an utterance ID
+AUDIO_MAX_AGE = getattr(settings, 'POLYGLOT_AUDIO_MAX_AGE', 86400)
+# Largest number of results on either side of the current one that can be asked for in a detail window
+MAX_DETAIL_WINDOW = 20
+
+
+def utterance_extents(corpus_context, utterance_id):
+    """
+    Look up the discourse, begin and end of an utterance
+    """
+    c = corpus_context
+    q = c.query_graph(c.utterance).filter(c.utterance.id == utterance_id)
+    q = q.columns(c.utterance.discourse.name.column_name('discourse'),
+                  c.utterance.begin.column_name('begin'),
+                  c.utterance.end.column_name('end'))
+    return q.all()
+
+
+def catalog_response(request, corpus, key, build=None, select=None):
+    """
+    Respond with an entry from the corpus's metadata catalog, which clients can cache until the corpus data changes
+
+    :param select: callable, optional
+        Function to pick the part of the entry to respond with
+    """
+    etag = catalog_etag(corpus)
+    if responses.etag_matches(request, etag):
+        return responses.not_modified(etag)
+    value = catalog_value(corpus, key, build)
+    if select is not None:
+        value = select(value)
+    return responses.revalidate(Response(value), etag)
+
 
 class UserViewSet(viewsets.ModelViewSet):
     model = User
@@ -275,11 +320,16 @@ class DatabaseViewSet(viewsets.ModelViewSet):
                                                                   can_access_database=True).all()
             if not len(permissions):
                 return Response(status=status.HTTP_401_UNAUTHORIZED)
-        try:
-            success = database.start()
-        except Exception as e:
-            return Response(data=str(e), status=status.HTTP_423_LOCKED)
-        return Response(data=success)
+        # Claim the transition, so that concurrent requests don't start the database twice
+        claimed = models.Database.objects.filter(pk=database.pk, status__in=[models.Database.STOPPED,
+                                                                             models.Database.ERROR]) \
+            .update(status=models.Database.STARTING)
+        if not claimed:
+            return Response(data=False)
+        task_id = start_database_task.delay(database.pk)
+        response = Response(data=True, status=status.HTTP_202_ACCEPTED)
+        response["task"] = task_id.task_id
+        return response
 
     @action(detail=True, methods=['post'])
     def stop(self, request, pk=None):
@@ -291,11 +341,15 @@ class DatabaseViewSet(viewsets.ModelViewSet):
                                                                   can_access_database=True).all()
             if not len(permissions):
                 return Response(status=status.HTTP_401_UNAUTHORIZED)
-        try:
-            success = database.stop()
-        except Exception as e:
-            return Response(data=str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        return Response(data=success)
+        claimed = models.Database.objects.filter(pk=database.pk, status__in=[models.Database.RUNNING,
+                                                                             models.Database.ERROR]) \
+            .update(status=models.Database.STOPPING)
+        if not claimed:
+            return Response(data='Database is not running', status=status.HTTP_400_BAD_REQUEST)
+        task_id = stop_database_task.delay(database.pk)
+        response = Response(data=True, status=status.HTTP_202_ACCEPTED)
+        response["task"] = task_id.task_id
+        return response
 
     def destroy(self, request, pk=None):
         if isinstance(request.user, django.contrib.auth.models.AnonymousUser):
@@ -412,10 +466,8 @@ class CorpusViewSet(viewsets.ModelViewSet):
 
         prop = request.GET.get('prop', 'label')
         corpus = self.get_object()
-        with CorpusContext(corpus.config) as c:
-            ann = getattr(c, type)
-            resp = sorted(c.query_metadata(ann).levels(getattr(ann, prop)))
-        return Response(resp)
+        key, build = property_values_entry(type, prop)
+        return catalog_response(request, corpus, key, build)
 
     @action(detail=True, methods=['get'])
     def autocomplete(self, request, pk=None):
@@ -431,18 +483,12 @@ class CorpusViewSet(viewsets.ModelViewSet):
         if prefix is None:
             return Response("Please provide a prefix",
                     status=status.HTTP_400_BAD_REQUEST)
-
-        for x in ['\'', '\"']:
-            #Escape characters
-            prefix = prefix.replace(x, '\\{}'.format(x))
+        if not category.isidentifier() or not prop.isidentifier():
+            return Response("Invalid category or property",
+                    status=status.HTTP_400_BAD_REQUEST)
 
         corpus = self.get_object()
-        with CorpusContext(corpus.config) as c:
-            statement = """MATCH (n:{category}:{corpus_name})
-                         WHERE n.{prop} =~ '(?i){prefix}.*'
-                         RETURN DISTINCT n.{prop}
-                         LIMIT 10""".format(corpus_name=c.cypher_safe_name, category=category, prop=prop, prefix=prefix)
-            resp = c.execute_cypher(statement).value()
+        resp = prefix_index(corpus, category, prop).lookup(prefix)
         return Response(resp)
 
     @action(detail=True, methods=['get'])
@@ -454,10 +500,7 @@ class CorpusViewSet(viewsets.ModelViewSet):
         if not len(permissions):
             return Response(status=status.HTTP_401_UNAUTHORIZED)
 
-        with CorpusContext(corpus.config) as c:
-            speakers = c.speakers
-
-        return Response(speakers)
+        return catalog_response(request, corpus, 'speakers')
 
     @action(detail=True, methods=['get'])
     def words(self, request, pk=None):
@@ -472,16 +515,31 @@ class CorpusViewSet(viewsets.ModelViewSet):
             return Response(
                 'There must be a requested number of words',
                 status=status.HTTP_400_BAD_REQUEST)
-        with CorpusContext(corpus.config) as c:
-            statement = '''MATCH (n:{}:word)
-            WITH n.label as label, count(n.label) as c
-            ORDER BY c DESC, label
-            with label
-            LIMIT {}
-            return label'''.format(c.cypher_safe_name, count)
-            results = c.execute_cypher(statement)
-            results = [x['label'] for x in results]
-        return Response(results)
+        count = int(count)
+        return catalog_response(request, corpus, frequencies_key('word'),
+                                select=lambda x: [label for label, c in x[:count]])
+
+    @action(detail=True, methods=['get'])
+    def frequencies(self, request, pk=None):
+        if isinstance(request.user, django.contrib.auth.models.AnonymousUser):
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        annotation_type = request.GET.get('type', 'word')
+        count = request.GET.get('count', None)
+        corpus = self.get_object()
+        permissions = corpus.user_permissions.filter(user=request.user, can_query=True).all()
+        if not len(permissions):
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        if annotation_type not in FREQUENCY_TYPES:
+            return Response(
+                'Frequencies are only available for {}'.format(', '.join(FREQUENCY_TYPES)),
+                status=status.HTTP_400_BAD_REQUEST)
+        if count is not None and not count.isdigit():
+            return Response(
+                'The number of labels must be a number',
+                status=status.HTTP_400_BAD_REQUEST)
+        if count is not None:
+            count = int(count)
+        return catalog_response(request, corpus, frequencies_key(annotation_type), select=lambda x: x[:count])
 
     @action(detail=True,methods=['get'])
     def default_subsets(self, request, pk=None):
@@ -529,14 +587,7 @@ class CorpusViewSet(viewsets.ModelViewSet):
         if not len(permissions):
             return Response(status=status.HTTP_401_UNAUTHORIZED)
 
-        with CorpusContext(corpus.config) as c:
-            q = c.query_lexicon(c.lexicon_phone).columns(c.lexicon_phone.label.column_name('label'))
-            phones = q.all()
-
-            # Remove duplicates to get phone set
-            phones = sorted(x['label'] for x in phones)
-
-        return Response(phones)
+        return catalog_response(request, corpus, 'phone_set')
 
     @action(detail=True, methods=['get'])
     def word_set(self, request, pk=None):
@@ -547,13 +598,7 @@ class CorpusViewSet(viewsets.ModelViewSet):
         if not len(permissions):
             return Response(status=status.HTTP_401_UNAUTHORIZED)
 
-        with CorpusContext(corpus.config) as c:
-            q = c.query_lexicon(c.lexicon_word).columns(c.lexicon_word.label.column_name('label'))
-            words = q.all()
-
-            # Remove duplicates to get phone set
-            words = sorted(set(x['label'] for x in words))
-        return Response(words)
+        return catalog_response(request, corpus, 'word_set')
 
     @action(detail=True, methods=['get'])
     def hierarchy(self, request, pk=None):
@@ -565,19 +610,20 @@ class CorpusViewSet(viewsets.ModelViewSet):
         permissions = corpus.user_permissions.filter(user=request.user, can_query=True).all()
         if not len(permissions):
             return Response(status=status.HTTP_401_UNAUTHORIZED)
+        etag = hierarchy_etag(corpus)
+        if responses.etag_matches(request, etag):
+            return responses.not_modified(etag)
         try:
-            with CorpusContext(corpus.config) as c:
-                hierarchy = c.hierarchy
-                data = serializers.HierarchySerializer(hierarchy).data
+            data = serializers.HierarchySerializer(corpus.get_hierarchy()).data
         except neo4j_exceptions.ServiceUnavailable:
             corpus.database.status = 'S'
             corpus.database.neo4j_pid = None
             corpus.database.influxdb_pid = None
             corpus.database.save()
             return Response('Database is not running', status=status.HTTP_400_BAD_REQUEST)
-        return Response(data)
+        return responses.revalidate(Response(data), etag)
 
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], renderer_classes=ACOUSTIC_RENDERERS)
     def utterance_pitch_track(self, request, pk=None):
         if isinstance(request.user, django.contrib.auth.models.AnonymousUser):
             return Response(status=status.HTTP_401_UNAUTHORIZED)
@@ -611,6 +657,7 @@ class CorpusViewSet(viewsets.ModelViewSet):
         track = request.data['track']
         with CorpusContext(corpus.config) as c:
             time_stamp = c.update_utterance_pitch_track(id, track)
+        corpus.bump_data_version()
         return Response({'success': True, 'time_stamp': time_stamp})
 
 
@@ -623,6 +670,29 @@ class SourceChoiceViewSet(viewsets.ViewSet):
 
 
 class DiscourseViewSet(viewsets.ViewSet):
+    def _pyramid(self, request, corpus):
+        discourse = request.query_params.get('discourse', None)
+        if not discourse:
+            return None, Response('Please provide a discourse', status=status.HTTP_400_BAD_REQUEST)
+        try:
+            with CorpusContext(corpus.config) as c:
+                if discourse not in catalog_value(corpus, 'discourses'):
+                    return None, Response('Could not find discourse {}'.format(discourse),
+                                          status=status.HTTP_404_NOT_FOUND)
+                return discourse_pyramid(corpus, c, discourse), None
+        except neo4j_exceptions.ServiceUnavailable:
+            return None, Response(None, status=status.HTTP_423_LOCKED)
+
+    def _time_range(self, request):
+        try:
+            begin = float(request.query_params.get('begin', 0))
+            end = float(request.query_params['end']) if 'end' in request.query_params else float('inf')
+        except ValueError:
+            return None
+        if end < begin:
+            return None
+        return begin, end
+
     def list(self, request, corpus_pk=None):
         if isinstance(request.user, django.contrib.auth.models.AnonymousUser):
             return Response(status=status.HTTP_401_UNAUTHORIZED)
@@ -630,10 +700,7 @@ class DiscourseViewSet(viewsets.ViewSet):
         permissions = corpus.user_permissions.filter(user=request.user, can_query=True).all()
         if not len(permissions):
             return Response(status=status.HTTP_401_UNAUTHORIZED)
-        with CorpusContext(corpus.config) as c:
-            discourses = c.discourses
-
-        return Response(discourses)
+        return catalog_response(request, corpus, 'discourses')
 
     @action(detail=False, methods=['get'])
     def properties(self, request, corpus_pk=None):
@@ -644,13 +711,54 @@ class DiscourseViewSet(viewsets.ViewSet):
         if not len(permissions):
             return Response(status=status.HTTP_401_UNAUTHORIZED)
 
-        with CorpusContext(corpus.config) as c:
-            props = c.query_metadata(c.discourse).grouping_factors()
-            data = []
-            data.append({'name':'name', 'options': c.discourses})
-            for p in props:
-                data.append({'name': p, 'options': c.query_metadata(c.discourse).levels(getattr(c.discourse, p))})
-        return Response(data)
+        return catalog_response(request, corpus, 'discourse_properties')
+
+    @action(detail=False, methods=['get'], renderer_classes=ACOUSTIC_RENDERERS)
+    def waveform(self, request, corpus_pk=None):
+        if isinstance(request.user, django.contrib.auth.models.AnonymousUser):
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        corpus = models.Corpus.objects.get(pk=corpus_pk)
+        permissions = corpus.user_permissions.filter(user=request.user, can_query=True, can_view_detail=True).all()
+        if not len(permissions):
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        time_range = self._time_range(request)
+        points = request.query_params.get('points', None)
+        if time_range is None or (points is not None and not points.isdigit()):
+            return Response('Invalid time range or number of points', status=status.HTTP_400_BAD_REQUEST)
+        pyramid, error = self._pyramid(request, corpus)
+        if error is not None:
+            return error
+        if responses.etag_matches(request, pyramid.etag):
+            return responses.not_modified(pyramid.etag)
+        data = pyramid.waveform(*time_range, max_points=int(points) if points else None)
+        return responses.cacheable(Response(data), pyramid.etag, PYRAMID_MAX_AGE)
+
+    @action(detail=False, methods=['get'], renderer_classes=ACOUSTIC_RENDERERS)
+    def spectrogram(self, request, corpus_pk=None):
+        if isinstance(request.user, django.contrib.auth.models.AnonymousUser):
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        corpus = models.Corpus.objects.get(pk=corpus_pk)
+        permissions = corpus.user_permissions.filter(user=request.user, can_query=True, can_view_detail=True).all()
+        if not len(permissions):
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        time_range = self._time_range(request)
+        level = request.query_params.get('level', '0')
+        tile = request.query_params.get('tile', None)
+        if not level.isdigit() or (tile is not None and not tile.isdigit()) or (tile is None and time_range is None):
+            return Response('Invalid time range, level or tile', status=status.HTTP_400_BAD_REQUEST)
+        pyramid, error = self._pyramid(request, corpus)
+        if error is not None:
+            return error
+        if responses.etag_matches(request, pyramid.etag):
+            return responses.not_modified(pyramid.etag)
+        if tile is not None:
+            try:
+                data = pyramid.spectrogram_tile(int(level), int(tile))
+            except IndexError:
+                return Response('No such tile', status=status.HTTP_404_NOT_FOUND)
+        else:
+            data = pyramid.spectrogram(*time_range, level=int(level))
+        return responses.cacheable(Response(data), pyramid.etag, PYRAMID_MAX_AGE)
 
 
 class SpeakerViewSet(viewsets.ViewSet):
@@ -662,10 +770,7 @@ class SpeakerViewSet(viewsets.ViewSet):
         if not len(permissions):
             return Response(status=status.HTTP_401_UNAUTHORIZED)
 
-        with CorpusContext(corpus.config) as c:
-            speakers = c.speakers
-
-        return Response(speakers)
+        return catalog_response(request, corpus, 'speakers')
 
     @action(detail=False, methods=['get'])
     def properties(self, request, corpus_pk=None):
@@ -675,13 +780,7 @@ class SpeakerViewSet(viewsets.ViewSet):
         permissions = corpus.user_permissions.filter(user=request.user, can_query=True).all()
         if not len(permissions):
             return Response(status=status.HTTP_401_UNAUTHORIZED)
-        with CorpusContext(corpus.config) as c:
-            props = c.query_metadata(c.speaker).grouping_factors()
-            data = []
-            data.append({'name':'name', 'options': c.speakers})
-            for p in props:
-                data.append({'name': p, 'options': c.query_metadata(c.speaker).levels(getattr(c.speaker, p))})
-        return Response(data)
+        return catalog_response(request, corpus, 'speaker_properties')
 
 
 class SubannotationViewSet(viewsets.ViewSet):
@@ -701,9 +800,9 @@ class SubannotationViewSet(viewsets.ViewSet):
             q = c.query_graph(att).filter(getattr(att, 'id') == a_id)
             res = q.all()[0]
             res.add_subannotation(s_type, **data)
-            data = serializers.serializer_factory(c.hierarchy, a_type, top_level=True, with_subannotations=True)(
-                res).data
+            data = serializers.compile_serializer(c.hierarchy, a_type, top_level=True, with_subannotations=True)(res)
             data = data[a_type][s_type][-1]
+        corpus.bump_data_version()
         return Response(data)
 
     def update(self, request, pk=None, corpus_pk=None):
@@ -735,6 +834,7 @@ class SubannotationViewSet(viewsets.ViewSet):
             statement = '''MATCH (s:{corpus_name}) WHERE s.id = {{s_id}}
             SET {set_props}'''.format(corpus_name=c.cypher_safe_name, set_props=set_props)
             c.execute_cypher(statement, s_id=s_id, **data)
+        corpus.bump_data_version()
         return Response(None)
 
     def destroy(self, request, pk=None, corpus_pk=None):
@@ -748,6 +848,7 @@ class SubannotationViewSet(viewsets.ViewSet):
             statement = '''MATCH (s:{corpus_name}) WHERE s.id = {{s_id}}
             DETACH DELETE s'''.format(corpus_name=c.cypher_safe_name)
             c.execute_cypher(statement, s_id=pk)
+        corpus.bump_data_version()
         return Response(None)
 
 
@@ -760,10 +861,21 @@ class AnnotationViewSet(viewsets.ViewSet):
         permissions = corpus.user_permissions.filter(user=request.user, can_query=True, can_listen=True).all()
         if not len(permissions):
            return Response(status=status.HTTP_401_UNAUTHORIZED)
-        with CorpusContext(corpus.config) as c:
-            fname = c.utterance_sound_file(pk, 'consonant')
-
-        response = FileResponse(open(fname, "rb"), content_type='audio/wav')
+        file_type = request.query_params.get('type', 'consonant')
+        codec = request.query_params.get('codec', getattr(settings, 'POLYGLOT_AUDIO_CODEC', 'wav'))
+        if file_type not in FILE_TYPES or codec not in CODECS:
+            return Response('Invalid file type or codec', status=status.HTTP_400_BAD_REQUEST)
+        if codec not in available_codecs():
+            codec = 'wav'
+        try:
+            with CorpusContext(corpus.config) as c:
+                fname, codec = utterance_audio(corpus, c, pk, file_type, codec)
+        except ValueError:
+            return Response('Invalid utterance', status=status.HTTP_400_BAD_REQUEST)
+        except neo4j_exceptions.ServiceUnavailable:
+            return Response(None, status=status.HTTP_423_LOCKED)
+        response = responses.ranged_file_response(request, fname, CODECS[codec][1])
+        response['Cache-Control'] = 'private, max-age={}'.format(AUDIO_MAX_AGE)
         return response
 
 
@@ -781,7 +893,7 @@ class EnrichmentViewSet(viewsets.ModelViewSet):
         permissions = corpus.user_permissions.filter(user=request.user, can_query=True, can_enrich=True).all()
         if not len(permissions):
             return Response(status=status.HTTP_401_UNAUTHORIZED)
-        enrichments = models.Enrichment.objects.filter(corpus=corpus).all()
+        enrichments = models.Enrichment.objects.filter(corpus=corpus).select_related('corpus', 'corpus__database').all()
         return Response(serializers.EnrichmentSerializer(enrichments, many=True).data)
 
     def create(self, request, corpus_pk=None, *args, **kwargs):
@@ -815,12 +927,12 @@ class EnrichmentViewSet(viewsets.ModelViewSet):
                 return Response(
                     'The subset cannot be empty.',
                     status=status.HTTP_400_BAD_REQUEST)
-            with CorpusContext(corpus.config) as c:
-                if c.hierarchy.has_token_subset(data.get('annotation_type', ''), data.get('subset_label', '')) or \
-                        c.hierarchy.has_type_subset(data.get('annotation_type', ''), data.get('subset_label', '')):
-                    return Response(
-                            "The {} subset already exists".format(data.get('subset_label', '')),
-                            status=status.HTTP_400_BAD_REQUEST)
+            hierarchy = corpus.get_hierarchy()
+            if hierarchy.has_token_subset(data.get('annotation_type', ''), data.get('subset_label', '')) or \
+                    hierarchy.has_type_subset(data.get('annotation_type', ''), data.get('subset_label', '')):
+                return Response(
+                        "The {} subset already exists".format(data.get('subset_label', '')),
+                        status=status.HTTP_400_BAD_REQUEST)
             name = 'Encode {} subset'.format(label)
 
         #Stress pattern validation
@@ -849,8 +961,7 @@ class EnrichmentViewSet(viewsets.ModelViewSet):
                 return Response(
                     'Lower annotation must be specified.',
                     status=status.HTTP_400_BAD_REQUEST)
-            with CorpusContext(corpus.config) as c:
-                annotation_types = c.hierarchy.highest_to_lowest
+            annotation_types = corpus.get_hierarchy().highest_to_lowest
             if higher not in annotation_types:
                 return Response(
                     'Must specify a higher annotation that has been encoded.',
@@ -995,6 +1106,32 @@ class EnrichmentViewSet(viewsets.ModelViewSet):
         time.sleep(1)
         return response
 
+    @action(detail=False, methods=['post'])
+    def run_pipeline(self, request, corpus_pk=None):
+        if isinstance(request.user, django.contrib.auth.models.AnonymousUser):
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        corpus = models.Corpus.objects.get(pk=corpus_pk)
+        permissions = corpus.user_permissions.filter(user=request.user, can_query=True, can_enrich=True).all()
+        if not len(permissions):
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        enrichment_ids = request.data.get('enrichments', [])
+        enrichments = models.Enrichment.objects.filter(pk__in=enrichment_ids, corpus=corpus).all()
+        if not len(enrichments) or len(enrichments) != len(set(enrichment_ids)):
+            return Response("Must choose enrichments from this corpus",
+                    status=status.HTTP_400_BAD_REQUEST)
+        try:
+            build_graph({x.pk: x.config for x in enrichments})
+        except ValueError as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+        if not corpus.database.is_running:
+            return Response("Database is not running, cannot run enrichment",
+                    status=status.HTTP_400_BAD_REQUEST)
+        response = Response(True)
+        task_id = run_enrichment_pipeline_task.delay(corpus.pk, [x.pk for x in enrichments])
+        response["task"] = task_id.task_id
+        time.sleep(1)
+        return response
+
     @action(detail=True, methods=['post'])
     def reset(self, request, pk=None, corpus_pk=None):
         if isinstance(request.user, django.contrib.auth.models.AnonymousUser):
@@ -1105,13 +1242,20 @@ class QueryViewSet(viewsets.ModelViewSet):
         do_run = refresh or query.config['filters'] != request.data['filters'] or \
                  query.config['positions'] != request.data['positions']
         c = query.config
+        old_tracks = query.requested_tracks(c)
         c.update(request.data)
         query.config = c
+        # Changing only the columns or acoustic tracks reuses the annotations already matched
+        do_update_tracks = not do_run and query.requested_tracks(c) != old_tracks
         response = Response(serializers.QuerySerializer(query).data)
         if do_run:
             task_id = run_query_task.delay(query.pk)
             response["task"] = task_id.task_id
             time.sleep(1)
+        elif do_update_tracks:
+            task_id = update_query_tracks_task.delay(query.pk)
+            response["task"] = task_id.task_id
+            time.sleep(1)
         return response
 
     @action(detail=False, methods=['GET'])
@@ -1187,13 +1331,16 @@ class QueryViewSet(viewsets.ModelViewSet):
         query = models.Query.objects.filter(pk=pk, corpus=corpus).get()
         if query is None:
             return Response(None, status=status.HTTP_400_BAD_REQUEST)
-        if query.running:
-            return Response(None)
         ordering = request.query_params.get('ordering', '')
         offset = int(request.query_params.get('offset', 0))
         limit = int(request.query_params.get('limit', 100))
-        results = query.get_results(ordering, limit, offset)
-        resp = {'data': results, 'count': query.result_count}
+        try:
+            results = query.get_results(ordering, limit, offset)
+        except InvalidOrdering as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+        if results is None:
+            return Response(None)
+        resp = {'data': results, 'count': query.result_count, 'running': query.running}
         return Response(resp)
 
     @action(detail=True, methods=['put'])
@@ -1209,12 +1356,15 @@ class QueryViewSet(viewsets.ModelViewSet):
             return Response(None, status=status.HTTP_400_BAD_REQUEST)
         config = query.config
         config['ordering'] = request.data.get('ordering')
-        query.resort(config['ordering'])
+        try:
+            query.resort(config['ordering'])
+        except InvalidOrdering as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
         query.config = config
 
         return Response(serializers.QuerySerializer(query).data)
 
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], renderer_classes=ACOUSTIC_RENDERERS)
     def result(self, request, pk=None, corpus_pk=None, index=None):
         if isinstance(request.user, django.contrib.auth.models.AnonymousUser):
             return Response(status=status.HTTP_401_UNAUTHORIZED)
@@ -1229,60 +1379,55 @@ class QueryViewSet(viewsets.ModelViewSet):
             return Response(None)
         ordering = request.query_params.get('ordering', '')
         index = int(request.query_params.get('index', '0'))
-        limit = 1
-        offset = index
+        with_subannotations = bool(strtobool(request.query_params.get('with_subannotations', 'True')))
+        try:
+            with CorpusContext(corpus.config) as c:
+                window = detail_window(query, c, index, ordering, with_subannotations, before=0, after=0)
+        except InvalidOrdering as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+        except neo4j_exceptions.ServiceUnavailable:
+            return Response(None, status=status.HTTP_423_LOCKED)
+        if not window:
+            return Response(None)
+        if window[0]['utterance'] is None:
+            return Response('The utterance IDs in this query look to be outdated. '
+                            'Please refresh the query.', status=status.HTTP_400_BAD_REQUEST)
+        return Response({'result': window[0]['result'], 'utterance': window[0]['utterance']})
 
+    @action(detail=True, methods=['get'], renderer_classes=ACOUSTIC_RENDERERS)
+    def details(self, request, pk=None, corpus_pk=None):
+        if isinstance(request.user, django.contrib.auth.models.AnonymousUser):
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        corpus = models.Corpus.objects.get(pk=corpus_pk)
+        permissions = corpus.user_permissions.filter(user=request.user, can_query=True, can_view_detail=True).all()
+        if not len(permissions):
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        query = models.Query.objects.filter(pk=pk, corpus=corpus).get()
+        if query is None:
+            return Response(None, status=status.HTTP_400_BAD_REQUEST)
+        if query.running:
+            return Response(None)
+        ordering = request.query_params.get('ordering', '')
+        index = int(request.query_params.get('index', '0'))
+        before = min(int(request.query_params.get('before', DETAIL_BEFORE)), MAX_DETAIL_WINDOW)
+        after = min(int(request.query_params.get('after', DETAIL_AFTER)), MAX_DETAIL_WINDOW)
         with_subannotations = bool(strtobool(request.query_params.get('with_subannotations', 'True')))
-        result = query.get_results(ordering, limit, offset)[0]
-        utterance_id = result['utterance']['current']['id']
-        data = {'result': result}
         try:
             with CorpusContext(corpus.config) as c:
-                q = c.query_graph(c.utterance)
-                q = q.filter(c.utterance.id == utterance_id)
-                q = q.preload(c.utterance.word)
-                q = q.preload(c.utterance.syllable)
-                q = q.preload(c.utterance.phone)
-                q = q.preload(c.utterance.speaker)
-                q = q.preload(c.utterance.discourse)
-                if with_subannotations:
-                    for t in c.hierarchy.annotation_types:
-                        if t in c.hierarchy.subannotations:
-                            for s in c.hierarchy.subannotations[t]:
-                                if t == 'utterance':
-                                    q = q.preload(getattr(c.utterance, s))
-                                else:
-                                    q = q.preload(getattr(getattr(c.utterance, t), s))
-                acoustic_columns = c.hierarchy.acoustics
-                acoustic_column_names = []
-                for a_column in acoustic_columns:
-                    acoustic = getattr(c.utterance, a_column)
-                    acoustic.relative = True
-                    acoustic = acoustic.track
-                    q = q.preload_acoustics(acoustic)
-                    acoustic_column_names.append(a_column)
-
-                utterances = q.all()
-                if utterances is None:
-                    data['utterance'] = None
-                elif not len(utterances):
-                    return Response('The utterance IDs in this query look to be outdated. '
-                                    'Please refresh the query.', status=status.HTTP_400_BAD_REQUEST)
-                else:
-                    serializer = serializers.serializer_factory(c.hierarchy, 'utterance',
-                                                                acoustic_columns=acoustic_columns,
-                                                                with_waveform=False,
-                                                                with_spectrogram=False,
-                                                                top_level=True,
-                                                                with_lower_annotations=True, detail=True,
-                                                                with_subannotations=True)
-                    utt = utterances[0]
-                    data['utterance'] = serializer(utt).data
+                window = detail_window(query, c, index, ordering, with_subannotations, before=before, after=after)
+        except InvalidOrdering as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
         except neo4j_exceptions.ServiceUnavailable:
             return Response(None, status=status.HTTP_423_LOCKED)
-        return Response(data)
+        if window is None:
+            return Response(None)
+        response = Response({'index': index, 'count': query.result_count, 'window': window})
+        if index + after + 1 < (query.result_count or 0) and claim_prefetch(query, index, ordering,
+                                                                             with_subannotations):
+            prefetch_detail_task.delay(query.pk, index, ordering, with_subannotations)
+        return response
 
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], renderer_classes=ACOUSTIC_RENDERERS)
     def get_spectrogram(self, request, pk=None, corpus_pk=None, index=None):
         if isinstance(request.user, django.contrib.auth.models.AnonymousUser):
             return Response(status=status.HTTP_401_UNAUTHORIZED)
@@ -1299,26 +1444,29 @@ class QueryViewSet(viewsets.ModelViewSet):
         index = int(request.query_params.get('index', '0'))
         limit = 1
         offset = index
-        result = query.get_results(ordering, limit, offset)[0]
+        try:
+            result = query.get_results(ordering, limit, offset)[0]
+        except InvalidOrdering as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
         utterance_id = result['utterance']['current']['id']
         data = {'result': result}
         try:
             with CorpusContext(corpus.config) as c:
-                q = c.query_graph(c.utterance)
-                q = q.filter(c.utterance.id == utterance_id)
-                utterances = q.all()
+                utterances = utterance_extents(c, utterance_id)
                 if utterances is None:
                     data['spectogram'] = None
                 elif not len(utterances):
                     return Response('The utterance IDs in this query look to be outdated. '
                                     'Please refresh the query.', status=status.HTTP_400_BAD_REQUEST)
                 else:
-                    data['spectrogram'] = utterances[0].spectrogram_fast
+                    u = utterances[0]
+                    pyramid = discourse_pyramid(corpus, c, u['discourse'])
+                    data['spectrogram'] = pyramid.spectrogram(u['begin'], u['end'])
         except neo4j_exceptions.ServiceUnavailable:
             return Response(None, status=status.HTTP_423_LOCKED)
         return Response(data)
 
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], renderer_classes=ACOUSTIC_RENDERERS)
     def get_waveform(self, request, pk=None, corpus_pk=None, index=None):
         if isinstance(request.user, django.contrib.auth.models.AnonymousUser):
             return Response(status=status.HTTP_401_UNAUTHORIZED)
@@ -1335,21 +1483,24 @@ class QueryViewSet(viewsets.ModelViewSet):
         index = int(request.query_params.get('index', '0'))
         limit = 1
         offset = index
-        result = query.get_results(ordering, limit, offset)[0]
+        try:
+            result = query.get_results(ordering, limit, offset)[0]
+        except InvalidOrdering as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
         utterance_id = result['utterance']['current']['id']
         data = {'result': result}
         try:
             with CorpusContext(corpus.config) as c:
-                q = c.query_graph(c.utterance)
-                q = q.filter(c.utterance.id == utterance_id)
-                utterances = q.all()
+                utterances = utterance_extents(c, utterance_id)
                 if utterances is None:
                     data['waveform'] = None
                 elif not len(utterances):
                     return Response('The utterance IDs in this query look to be outdated. '
                                     'Please refresh the query.', status=status.HTTP_400_BAD_REQUEST)
                 else:
-                    data['waveform'] = utterances[0].waveform
+                    u = utterances[0]
+                    pyramid = discourse_pyramid(corpus, c, u['discourse'])
+                    data['waveform'] = waveform_points(pyramid.waveform(u['begin'], u['end']))
         except neo4j_exceptions.ServiceUnavailable:
             return Response(None, status=status.HTTP_423_LOCKED)
         return Response(data)
@@ -1409,6 +1560,7 @@ class QueryViewSet(viewsets.ModelViewSet):
                     SET n += d.props
                     """.format(subannotation=subannotation, corpus_name=c.cypher_safe_name)
                     resp = c.execute_cypher(statement, data=data).value()
+        corpus.bump_data_version()
         return Response(resp)
 
     @action(detail=True, methods=['post'])
@@ -1426,11 +1578,11 @@ class QueryViewSet(viewsets.ModelViewSet):
         if not corpus.database.is_running:
             return Response("Database is not running, cannot generate subset",
                     status=status.HTTP_400_BAD_REQUEST)
-        with CorpusContext(corpus.config) as g:
-            if g.hierarchy.has_token_subset(request.data.get('annotation_type', ''), request.data.get('subset_name', '')) or \
-                    g.hierarchy.has_type_subset(request.data.get('annotation_type', ''), request.data.get('subset_name', '')):
-                return Response("There is already a subset with the name, {}".format(request.data.get('subset_name', '')), 
-                        status=status.HTTP_400_BAD_REQUEST)
+        hierarchy = corpus.get_hierarchy()
+        if hierarchy.has_token_subset(request.data.get('annotation_type', ''), request.data.get('subset_name', '')) or \
+                hierarchy.has_type_subset(request.data.get('annotation_type', ''), request.data.get('subset_name', '')):
+            return Response("There is already a subset with the name, {}".format(request.data.get('subset_name', '')),
+                    status=status.HTTP_400_BAD_REQUEST)
         query = models.Query.objects.filter(pk=pk, corpus=corpus).get()
         if query is None:
             return Response(None, status=status.HTTP_400_BAD_REQUEST)
@@ -1462,6 +1614,18 @@ class QueryViewSet(viewsets.ModelViewSet):
             return Response(None, status=status.HTTP_400_BAD_REQUEST)
         if query.running:
             return Response(None, status=status.HTTP_423_LOCKED)
+        export_format = request.data.get('export_format', 'csv')
+        if export_format not in columnar.EXPORT_FORMATS:
+            return Response("{} is not a valid export format".format(export_format),
+                    status=status.HTTP_400_BAD_REQUEST)
+        if request.data.get('export_shard_by', 'speaker') not in ('speaker', 'discourse'):
+            return Response("Exports can only be split by speaker or discourse",
+                    status=status.HTTP_400_BAD_REQUEST)
+        if export_format == 'parquet':
+            try:
+                columnar.check_available()
+            except columnar.ColumnarExportError as e:
+                return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
         c = query.config
         c.update(request.data)
         query.config = c
@@ -1487,12 +1651,35 @@ class QueryViewSet(viewsets.ModelViewSet):
             return Response(None, status=status.HTTP_400_BAD_REQUEST)
         if query.running:
             return Response(None, status=status.HTTP_423_LOCKED)
+        live = strtobool(request.query_params.get('live', 'false'))
+        compress = request.query_params.get('compress', '') == 'gzip'
+        filename = os.path.basename(query.export_path)
+        if live:
+            # Stream straight from the database without generating the export file first
+            return responses.streaming_csv_response(query.stream_export(), filename, compress=compress)
         if os.path.exists(query.export_path):
-            with open(query.export_path, 'rb') as fh:
-                response = HttpResponse(fh.read(), content_type='text/csv')
-                response['Content-Disposition'] = 'attachment; filename="{}"'.format(
-                    os.path.basename(query.export_path))
-                return response
+            if compress:
+                return responses.streaming_csv_response(responses.file_chunks(query.export_path), filename,
+                                                        compress=True)
+            return responses.ranged_file_response(request, query.export_path, 'text/csv', filename=filename)
+        return Response(None, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=True, methods=['get'])
+    def get_export_parquet(self, request, pk=None, corpus_pk=None):
+        if isinstance(request.user, django.contrib.auth.models.AnonymousUser):
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        corpus = models.Corpus.objects.get(pk=corpus_pk)
+        permissions = corpus.user_permissions.filter(user=request.user, can_query=True).all()
+        if not len(permissions):
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        query = models.Query.objects.filter(pk=pk, corpus=corpus).get()
+        if query is None:
+            return Response(None, status=status.HTTP_400_BAD_REQUEST)
+        if query.running:
+            return Response(None, status=status.HTTP_423_LOCKED)
+        if os.path.exists(query.export_parquet_path):
+            return responses.ranged_file_response(request, query.export_parquet_path, columnar.PARQUET_CONTENT_TYPE,
+                                                  filename=os.path.basename(query.export_parquet_path))
         return Response(None, status=status.HTTP_400_BAD_REQUEST)
 
 class SpadeScriptViewSet(viewsets.ViewSet):
@@ -1556,11 +1743,8 @@ class SpadeScriptViewSet(viewsets.ViewSet):
             return Response("{} is not a valid file".format(csv_file), 
                     status=status.HTTP_400_BAD_REQUEST)
         path = os.path.join(settings.SPADE_SCRIPT_DIRECTORY, target, csv_file)
-        with open(path, 'rb') as fh:
-            response = HttpResponse(fh.read(), content_type='text/csv')
-            response['Content-Disposition'] = 'attachment; filename="{}"'.format(
-                csv_file)
-            return response
+        if os.path.exists(path):
+            return responses.ranged_file_response(request, path, 'text/csv', filename=csv_file)
         return Response("That CSV file does not exist", status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=True, methods=['get'])
@@ -1606,6 +1790,13 @@ class TaskViewSet(viewsets.ViewSet):
         task = models.BackgroundTask.objects.get(pk=pk)
         return Response(task.status())
 
+    @action(detail=True, methods=['get'])
+    def progress(self, request, pk=None):
+        if isinstance(request.user, django.contrib.auth.models.AnonymousUser):
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        task = models.BackgroundTask.objects.get(pk=pk)
+        return Response(task.progress_summary())
+
     @action(detail=True, methods=['get'])
     def failed(self, request, pk=None):
         if isinstance(request.user, django.contrib.auth.models.AnonymousUser):
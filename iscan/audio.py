@@ -0,0 +1,227 @@
+import os
+import re
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+
+from django.conf import settings
+
+from .locks import TaskLock
+
+log = logging.getLogger(__name__)
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+FILE_TYPES = ['consonant', 'vowel', 'low_freq']
+
+# Extension, content type and libsndfile format and subtype of each codec segments can be sent in
+CODECS = {
+    'wav': ('wav', 'audio/wav', None, None),
+    'flac': ('flac', 'audio/flac', 'FLAC', 'PCM_16'),
+    'opus': ('opus', 'audio/ogg; codecs=opus', 'OGG', 'OPUS'),
+}
+
+ENTRY_RE = re.compile(r'^[\w-]+$')
+
+# Segments being cut share this many lock files, rather than each having their own
+LOCK_STRIPES = 64
+
+
+def available_codecs():
+    """
+    Get the codecs that segments can be encoded in, which depends on the libsndfile that soundfile was built with
+    """
+    codecs = ['wav']
+    if soundfile is None:
+        return codecs
+    for codec, (extension, content_type, audio_format, subtype) in CODECS.items():
+        if audio_format is not None and subtype in soundfile.available_subtypes(audio_format):
+            codecs.append(codec)
+    return codecs
+
+
+def encode_segment(source, target, codec):
+    """
+    Write a WAV segment to a file in a codec
+
+    :raises RuntimeError: if the segment can't be encoded, i.e. Opus doesn't support its sample rate
+    """
+    extension, content_type, audio_format, subtype = CODECS[codec]
+    if audio_format is None:
+        shutil.copyfile(source, target)
+        return
+    if soundfile is None:
+        raise RuntimeError('soundfile is required to encode {}'.format(codec))
+    data, sr = soundfile.read(source, always_2d=True)
+    soundfile.write(target, data, sr, format=audio_format, subtype=subtype)
+
+
+class AudioSegmentCache(object):
+    """
+    Utterance audio cut from discourse sound files, kept on disk up to a total size, least recently used first out
+
+    Entries are single files under a directory per corpus, named by utterance ID, file type (sampling rate) and codec.
+    Use is tracked through the files' access times, so that modification times (and the ETags and Last-Modified
+    headers built from them) only change when an entry is rewritten.
+    """
+
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+
+    def entry_path(self, corpus_pk, utterance_id, file_type, codec):
+        if not ENTRY_RE.match(utterance_id) or file_type not in FILE_TYPES or codec not in CODECS:
+            raise ValueError('Invalid audio segment: {} {} {}'.format(utterance_id, file_type, codec))
+        return os.path.join(self.directory, str(corpus_pk),
+                            '{}_{}.{}'.format(utterance_id, file_type, CODECS[codec][0]))
+
+    def lock(self, corpus_pk, utterance_id, file_type, codec):
+        """
+        Get the lock to hold while cutting a segment.  Segments are spread over a fixed set of lock files in the
+        cache's ``.locks`` directory, so that lock files don't pile up as segments are added and evicted.
+
+        :return: :class:`~iscan.locks.TaskLock`
+        """
+        path = self.entry_path(corpus_pk, utterance_id, file_type, codec)
+        stripe = int(hashlib.sha1(path.encode('utf8')).hexdigest(), 16) % LOCK_STRIPES
+        directory = os.path.join(self.directory, '.locks')
+        os.makedirs(directory, exist_ok=True)
+        return TaskLock(os.path.join(directory, '{}.lock'.format(stripe)))
+
+    def get(self, corpus_pk, utterance_id, file_type, codec):
+        """
+        Get the path of a cached segment, or None if it is not cached
+        """
+        path = self.entry_path(corpus_pk, utterance_id, file_type, codec)
+        try:
+            stat = os.stat(path)
+            os.utime(path, (time.time(), stat.st_mtime))
+        except FileNotFoundError:
+            return None
+        return path
+
+    def add(self, corpus_pk, utterance_id, file_type, codec, source):
+        """
+        Add a segment cut by PolyglotDB to the cache.  The source file is moved into the cache, so that it is counted
+        against the cache's budget rather than left in the corpus's audio directory.
+
+        :return: str
+            Path of the cached segment
+        """
+        path = self.entry_path(corpus_pk, utterance_id, file_type, codec)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = os.path.join(os.path.dirname(path), '.{}-{}'.format(uuid.uuid4().hex, os.path.basename(path)))
+        try:
+            if codec == 'wav':
+                shutil.move(source, temp_path)
+            else:
+                encode_segment(source, temp_path, codec)
+                os.remove(source)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self.evict()
+        return path
+
+    def entries(self):
+        """
+        Get the paths, sizes and last use of the cached segments, least recently used first
+
+        :return: list of (str, int, float)
+        """
+        entries = []
+        if not os.path.exists(self.directory):
+            return entries
+        for corpus_directory in os.listdir(self.directory):
+            if corpus_directory.startswith('.'):
+                continue
+            corpus_directory = os.path.join(self.directory, corpus_directory)
+            if not os.path.isdir(corpus_directory):
+                continue
+            for name in os.listdir(corpus_directory):
+                if name.startswith('.') or name.endswith('.lock') or name.endswith('.owner'):
+                    continue
+                path = os.path.join(corpus_directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_atime))
+        entries.sort(key=lambda x: x[2])
+        return entries
+
+    def evict(self):
+        if self.max_size is None:
+            return
+        entries = self.entries()
+        total_size = sum(x[1] for x in entries)
+        while entries and total_size > self.max_size:
+            path, size, last_used = entries.pop(0)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def invalidate(self, corpus_pk):
+        """
+        Remove all segments for a corpus, i.e. when it is deleted
+        """
+        shutil.rmtree(os.path.join(self.directory, str(corpus_pk)), ignore_errors=True)
+
+
+def get_audio_cache():
+    """
+    Get the audio segment cache configured in the settings, or None if caching is disabled
+    (POLYGLOT_AUDIO_CACHE_SIZE = 0)
+    """
+    max_size = getattr(settings, 'POLYGLOT_AUDIO_CACHE_SIZE', 2 * 1024 ** 3)
+    if not max_size:
+        return None
+    directory = getattr(settings, 'POLYGLOT_AUDIO_CACHE_DIRECTORY', None)
+    if directory is None:
+        directory = os.path.join(settings.POLYGLOT_DATA_DIRECTORY, 'audio_cache')
+    return AudioSegmentCache(directory, max_size=max_size)
+
+
+def utterance_audio(corpus, corpus_context, utterance_id, file_type='consonant', codec='wav'):
+    """
+    Get the path to an utterance's audio, cutting it from the discourse's sound file only if it isn't cached
+
+    Codecs that can't encode the segment (i.e., Opus at sampling rates it doesn't support) fall back to WAV.
+
+    :param corpus: :class:`~iscan.models.Corpus`
+    :param corpus_context: :class:`~iscan.connections.CorpusContext`
+    :param utterance_id: str
+    :param file_type: str
+        One of ``consonant``, ``vowel`` or ``low_freq``
+    :param codec: str
+        One of ``wav``, ``flac`` or ``opus``
+    :return: tuple
+        Path and codec of the segment
+    """
+    cache = get_audio_cache()
+    if cache is None:
+        return corpus_context.utterance_sound_file(utterance_id, file_type), 'wav'
+    path = cache.get(corpus.pk, utterance_id, file_type, codec)
+    if path is not None:
+        return path, codec
+    with cache.lock(corpus.pk, utterance_id, file_type, codec):
+        # Another request may have cut it while this one was waiting
+        cached = cache.get(corpus.pk, utterance_id, file_type, codec)
+        if cached is not None:
+            return cached, codec
+        source = corpus_context.utterance_sound_file(utterance_id, file_type)
+        try:
+            return cache.add(corpus.pk, utterance_id, file_type, codec, source), codec
+        except RuntimeError:
+            if codec == 'wav':
+                raise
+            log.warning('Could not encode {} as {}, sending WAV instead'.format(utterance_id, codec))
+    return utterance_audio(corpus, corpus_context, utterance_id, file_type, 'wav')
@@ -0,0 +1,88 @@
+import bisect
+import threading
+import collections
+
+from .catalog import catalog_value, node_values_entry
+
+# Number of suggestions returned for a prefix
+SUGGESTION_LIMIT = 10
+# Number of prefixes whose suggestions are remembered for each index
+RESULT_CACHE_SIZE = 1000
+
+# Indexes built in this process, keyed by corpus, data version, node label and property
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class PrefixIndex(object):
+    """
+    Case-insensitive prefix lookup over the distinct values of a property, kept as a sorted array of case-folded keys
+    """
+
+    def __init__(self, values):
+        pairs = sorted(set((v.casefold(), v) for v in values if isinstance(v, str)))
+        self.keys = [k for k, v in pairs]
+        self.values = [v for k, v in pairs]
+        self.results = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, prefix, limit=SUGGESTION_LIMIT):
+        """
+        Get the values starting with a prefix, ignoring case
+
+        :param prefix: str
+        :param limit: int
+        :return: list
+        """
+        prefix = prefix.casefold()
+        key = (prefix, limit)
+        with self.lock:
+            if key in self.results:
+                self.results.move_to_end(key)
+                return self.results[key]
+        found = []
+        index = bisect.bisect_left(self.keys, prefix)
+        while index < len(self.keys) and len(found) < limit and self.keys[index].startswith(prefix):
+            value = self.values[index]
+            if value not in found:
+                found.append(value)
+            index += 1
+        with self.lock:
+            self.results[key] = found
+            if len(self.results) > RESULT_CACHE_SIZE:
+                self.results.popitem(last=False)
+        return found
+
+
+def prefix_index(corpus, label, prop):
+    """
+    Get the prefix index for a property of word, phone or syllable types, speakers or discourses, built from the
+    corpus's metadata catalog
+
+    :param corpus: :class:`~iscan.models.Corpus`
+    :param label: str
+        Node label, i.e. ``word_type``, ``Speaker`` or ``Discourse``
+    :param prop: str
+    :return: :class:`PrefixIndex`
+    """
+    key = (corpus.pk, corpus.data_version, label, prop)
+    with _indexes_lock:
+        index = _indexes.get(key)
+    if index is not None:
+        return index
+    if label == 'Speaker' and prop == 'name':
+        values = catalog_value(corpus, 'speakers')
+    elif label == 'Discourse' and prop == 'name':
+        values = catalog_value(corpus, 'discourses')
+    else:
+        values = catalog_value(corpus, *node_values_entry(label, prop))
+    index = PrefixIndex(values)
+    with _indexes_lock:
+        # Indexes for older versions of the corpus data won't be used again
+        for k in [k for k in _indexes if k[0] == corpus.pk and k[1] != corpus.data_version]:
+            del _indexes[k]
+        _indexes[key] = index
+    return index
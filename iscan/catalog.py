@@ -0,0 +1,201 @@
+import os
+import json
+import logging
+import threading
+import functools
+
+from django.utils.http import quote_etag
+
+from .connections import CorpusContext
+
+log = logging.getLogger(__name__)
+
+# Catalogs loaded in this process, keyed by corpus
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def _metadata_properties(c, node, names):
+    query = c.query_metadata(node)
+    data = [{'name': 'name', 'options': names}]
+    for p in query.grouping_factors():
+        data.append({'name': p, 'options': query.levels(getattr(node, p))})
+    return data
+
+
+def _labels(c, lexicon_node):
+    q = c.query_lexicon(lexicon_node).columns(lexicon_node.label.column_name('label'))
+    return sorted(set(x['label'] for x in q.all()))
+
+
+def node_values_entry(label, prop):
+    """
+    Get the catalog key and builder for the distinct values of a property of nodes with a label (i.e., word types)
+    """
+
+    def build(c):
+        statement = '''MATCH (n:{label}:{corpus_name})
+                    RETURN DISTINCT n.{prop} as value'''.format(label=label, corpus_name=c.cypher_safe_name, prop=prop)
+        return [x['value'] for x in c.execute_cypher(statement)]
+
+    return 'node_values:{}:{}'.format(label, prop), build
+
+
+def _frequencies(c, annotation_type):
+    if annotation_type not in c.hierarchy.annotation_types:
+        return []
+    statement = '''MATCH (n:{corpus_name}:{annotation_type})
+    WITH n.label as label, count(n.label) as c
+    ORDER BY c DESC, label
+    RETURN label, c'''.format(corpus_name=c.cypher_safe_name, annotation_type=annotation_type)
+    return [[x['label'], x['c']] for x in c.execute_cypher(statement)]
+
+
+# Annotation types with frequency tables in the catalog
+FREQUENCY_TYPES = ['word', 'phone', 'syllable']
+
+
+def frequencies_key(annotation_type):
+    return 'frequencies:{}'.format(annotation_type)
+
+
+# Word labels, for autocompleting words in the query builder
+WORD_LABELS_ENTRY = node_values_entry('word_type', 'label')
+
+# Entries built whenever the catalog is materialized, other entries (i.e., values of arbitrary properties) are added
+# the first time they are asked for
+CATALOG_ENTRIES = {
+    'speakers': lambda c: c.speakers,
+    'discourses': lambda c: c.discourses,
+    'phone_set': lambda c: _labels(c, c.lexicon_phone),
+    'word_set': lambda c: _labels(c, c.lexicon_word),
+    'speaker_properties': lambda c: _metadata_properties(c, c.speaker, c.speakers),
+    'discourse_properties': lambda c: _metadata_properties(c, c.discourse, c.discourses),
+    WORD_LABELS_ENTRY[0]: WORD_LABELS_ENTRY[1],
+}
+# Labels with their token counts, most frequent first
+CATALOG_ENTRIES.update({frequencies_key(t): functools.partial(_frequencies, annotation_type=t) for t in FREQUENCY_TYPES})
+
+
+
+def property_values_entry(annotation_type, prop):
+    """
+    Get the catalog key and builder for the values of an annotation property
+    """
+
+    def build(c):
+        ann = getattr(c, annotation_type)
+        return sorted(c.query_metadata(ann).levels(getattr(ann, prop)))
+
+    return 'property_values:{}:{}'.format(annotation_type, prop), build
+
+
+class CorpusCatalog(object):
+    """
+    Metadata about a corpus (speakers, discourses, phone and word sets, property values) computed from the graph
+    database for one version of the corpus data, and saved to disk so that other processes can use it
+    """
+
+    def __init__(self, path, version, entries=None):
+        self.path = path
+        self.version = version
+        self.entries = entries if entries is not None else {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, version):
+        """
+        Load a saved catalog, or start an empty one if there is none for the version
+        """
+        try:
+            with open(path, 'r', encoding='utf8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        if data.get('version') != version:
+            return cls(path, version)
+        return cls(path, version, data.get('entries', {}))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = '{}.{}.tmp'.format(self.path, threading.get_ident())
+        with self.lock:
+            data = {'version': self.version, 'entries': dict(self.entries)}
+        with open(temp_path, 'w', encoding='utf8') as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.path)
+
+    def update(self, corpus_context, builders):
+        """
+        Build entries from the graph database and save them
+
+        :param corpus_context: :class:`~iscan.connections.CorpusContext`
+        :param builders: dict
+            Functions taking a corpus context, keyed by entry
+        """
+        values = {k: f(corpus_context) for k, f in builders.items()}
+        with self.lock:
+            self.entries.update(values)
+        self.save()
+        return values
+
+
+def get_catalog(corpus):
+    """
+    Get the catalog for the current version of a corpus's data
+
+    :param corpus: :class:`~iscan.models.Corpus`
+    :return: :class:`CorpusCatalog`
+    """
+    version = corpus.data_version
+    with _catalogs_lock:
+        catalog = _catalogs.get(corpus.pk)
+        if catalog is None or catalog.version != version:
+            catalog = CorpusCatalog.load(corpus.catalog_path, version)
+            _catalogs[corpus.pk] = catalog
+    return catalog
+
+
+def catalog_value(corpus, key, build=None):
+    """
+    Get an entry of a corpus's catalog, building it from the graph database if it is not already in the catalog
+
+    :param corpus: :class:`~iscan.models.Corpus`
+    :param key: str
+        One of :data:`CATALOG_ENTRIES`, or a key from :func:`property_values_entry` with its builder
+    :param build: callable, optional
+    """
+    catalog = get_catalog(corpus)
+    with catalog.lock:
+        if key in catalog.entries:
+            return catalog.entries[key]
+    if build is None:
+        build = CATALOG_ENTRIES[key]
+    with CorpusContext(corpus.config) as c:
+        return catalog.update(c, {key: build})[key]
+
+
+def materialize_catalog(corpus):
+    """
+    Build the catalog for the current version of a corpus's data, i.e. after an import or enrichment, so that requests
+    don't have to wait for it.  Failures are logged, the entries will be built when they are first requested instead.
+    """
+    catalog = get_catalog(corpus)
+    try:
+        with CorpusContext(corpus.config) as c:
+            catalog.update(c, CATALOG_ENTRIES)
+    except Exception:
+        log.exception('Could not build the metadata catalog for {}'.format(corpus.name))
+
+
+def invalidate_catalog(corpus):
+    with _catalogs_lock:
+        _catalogs.pop(corpus.pk, None)
+    try:
+        os.remove(corpus.catalog_path)
+    except FileNotFoundError:
+        pass
+
+
+def catalog_etag(corpus):
+    return quote_etag('catalog-{}-{}'.format(corpus.pk, corpus.data_version))
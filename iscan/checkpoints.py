@@ -0,0 +1,167 @@
+import os
+import json
+import hashlib
+import datetime
+import logging
+
+from conch import analyze_segments
+
+from polyglotdb.acoustics.segments import generate_utterance_segments
+from polyglotdb.acoustics.utils import PADDING
+from polyglotdb.exceptions import SpeakerAttributeError
+
+log = logging.getLogger(__name__)
+
+# Acoustic measures that can be analyzed one speaker at a time, with the properties they add to the hierarchy
+CHECKPOINTED_ENRICHMENTS = {
+    'pitch': [('F0', float)],
+    'formants': [('F1', float), ('F2', float), ('F3', float)],
+    'intensity': [('Intensity', float)],
+}
+
+
+class EnrichmentCheckpoint(object):
+    """
+    Record of the units (speakers) an acoustic enrichment has finished, so that a rerun after a failure can skip them
+
+    The checkpoint is tied to the enrichment's config, so changing the config starts the enrichment over.  The unit
+    being analyzed is recorded before any of its measurements are saved, so that its partial measurements can be
+    removed before it is analyzed again.
+    """
+
+    def __init__(self, path, config):
+        self.path = path
+        self.key = hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf8')).hexdigest()
+        self.completed = []
+        self.started = None
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('key') != self.key:
+            return
+        self.completed = data.get('completed', [])
+        self.started = data.get('started', None)
+
+    def _save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'key': self.key, 'completed': self.completed, 'started': self.started}, f)
+        os.replace(temp_path, self.path)
+
+    def is_completed(self, unit):
+        return unit in self.completed
+
+    def start(self, unit):
+        self.started = unit
+        self._save()
+
+    def complete(self, unit):
+        if unit not in self.completed:
+            self.completed.append(unit)
+        self.started = None
+        self._save()
+
+    def clear(self):
+        self.completed = []
+        self.started = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _analysis_function(corpus_context, acoustic_name, config, speaker):
+    source = config.get('source', 'praat')
+    if acoustic_name == 'pitch':
+        from polyglotdb.acoustics.pitch.helper import generate_pitch_function
+        if source == 'reaper':
+            path = corpus_context.config.reaper_path
+        else:
+            path = corpus_context.config.praat_path
+        return generate_pitch_function(source, 50, 500, path=path)
+    elif acoustic_name == 'formants':
+        from polyglotdb.acoustics.formants.helper import generate_base_formants_function
+        gender = None
+        try:
+            q = corpus_context.query_speakers().filter(corpus_context.speaker.name == speaker)
+            q = q.columns(corpus_context.speaker.gender.column_name('Gender'))
+            gender = q.all()[0]['Gender']
+        except SpeakerAttributeError:
+            pass
+        if gender is not None:
+            return generate_base_formants_function(corpus_context, gender=gender, source=source)
+        return generate_base_formants_function(corpus_context, source=source)
+    elif acoustic_name == 'intensity':
+        from polyglotdb.acoustics.intensity import generate_base_intensity_function
+        return generate_base_intensity_function(corpus_context)
+    raise ValueError('{} cannot be analyzed by speaker'.format(acoustic_name))
+
+
+def remove_speaker_measurements(corpus_context, acoustic_name, speaker):
+    """
+    Remove a speaker's measurements for an acoustic measure, i.e. ones partially saved before a failure
+    """
+    speaker = speaker.replace('\\', '\\\\').replace("'", "\\'")
+    corpus_context.execute_influxdb('''DELETE FROM "{}" WHERE "speaker" = '{}';'''.format(acoustic_name, speaker))
+
+
+def analyze_by_speaker(corpus_context, acoustic_name, config, checkpoint, task=None, multiprocessing=False, jobs=None):
+    """
+    Analyze an acoustic measure one speaker at a time, like PolyglotDB's ``analyze_pitch``,
+    ``analyze_formant_tracks`` and ``analyze_intensity``, skipping speakers the checkpoint has recorded as completed
+
+    :param corpus_context: :class:`~polyglotdb.CorpusContext`
+    :param acoustic_name: str
+        One of :data:`CHECKPOINTED_ENRICHMENTS`
+    :param config: dict
+        Enrichment config
+    :param checkpoint: :class:`EnrichmentCheckpoint`
+    :param task: :class:`~iscan.models.BackgroundTask`, optional
+        Task to report each speaker's progress to
+    :param multiprocessing: bool
+    :param jobs: int, optional
+        Number of segments to analyze at once, conch's default if not given
+    """
+    if acoustic_name == 'pitch' and 'utterance' not in corpus_context.hierarchy:
+        raise Exception('Must encode utterances before pitch can be analyzed')
+    kwargs = {'file_type': 'consonant'} if acoustic_name == 'intensity' else {}
+    segment_mapping = generate_utterance_segments(corpus_context, padding=PADDING, **kwargs).grouped_mapping('speaker')
+    if acoustic_name not in corpus_context.hierarchy.acoustics:
+        corpus_context.hierarchy.add_acoustic_properties(corpus_context, acoustic_name,
+                                                         CHECKPOINTED_ENRICHMENTS[acoustic_name])
+        corpus_context.encode_hierarchy()
+    speakers = [speaker for (speaker,), v in segment_mapping.items()]
+    if task is not None:
+        task.set_progress(speakers)
+        for speaker in speakers:
+            if checkpoint.is_completed(speaker):
+                task.update_progress(speaker, 'done', skipped=True)
+    if checkpoint.started is not None:
+        log.info('Removing partial {} measurements for {}'.format(acoustic_name, checkpoint.started))
+        remove_speaker_measurements(corpus_context, acoustic_name, checkpoint.started)
+    for (speaker,), v in segment_mapping.items():
+        if checkpoint.is_completed(speaker):
+            continue
+        if task is not None:
+            task.update_progress(speaker, 'running')
+        checkpoint.start(speaker)
+        try:
+            function = _analysis_function(corpus_context, acoustic_name, config, speaker)
+            output = analyze_segments(v, function, num_jobs=jobs, multiprocessing=multiprocessing)
+            corpus_context.save_acoustic_tracks(acoustic_name, output, speaker)
+        except Exception:
+            if task is not None:
+                task.update_progress(speaker, 'failed')
+            raise
+        checkpoint.complete(speaker)
+        if task is not None:
+            task.update_progress(speaker, 'done')
+    if acoustic_name == 'pitch':
+        corpus_context.query_graph(corpus_context.utterance).set_properties(
+            pitch_last_edited=datetime.datetime.utcnow().timestamp())
+        corpus_context.encode_hierarchy()
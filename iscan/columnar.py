@@ -0,0 +1,159 @@
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is only needed for Parquet exports
+    pa = None
+    pq = None
+
+EXPORT_FORMATS = ('csv', 'parquet')
+
+PARQUET_CONTENT_TYPE = 'application/vnd.apache.parquet'
+
+
+class ColumnarExportError(Exception):
+    pass
+
+
+def check_available():
+    if pa is None:
+        raise ColumnarExportError('Parquet exports require pyarrow to be installed')
+
+
+def _to_array(values):
+    try:
+        array = pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed types, i.e. numbers and strings in the same property
+        array = pa.array([None if x is None else str(x) for x in values], type=pa.string())
+    if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+        # Labels and other factors repeat a lot, so store each value once per row group
+        array = array.dictionary_encode()
+    return array
+
+
+def results_to_table(results):
+    """
+    Convert a batch of query results to an Arrow table, with one row per annotation.  Acoustic tracks are stored as list
+    columns of the track's time points and values rather than as one row per point like in CSV exports.
+
+    :param results: :class:`~polyglotdb.query.annotations.results.QueryResults`
+    :return: :class:`pyarrow.Table`
+    """
+    check_available()
+    track_columns = list(getattr(results, 'track_columns', []))
+    columns = [x for x in results.columns if x not in track_columns]
+    values = {x: [] for x in columns}
+    times = []
+    tracks = {x: [] for x in track_columns}
+    for line in results:
+        for k in columns:
+            values[k].append(line[k])
+        if track_columns:
+            points = [(round(p.time, 4), p.select_values(track_columns)) for p in line.track]
+            times.append([t for t, v in points])
+            for k in track_columns:
+                tracks[k].append([v[k] for t, v in points])
+    arrays = [_to_array(values[k]) for k in columns]
+    names = list(columns)
+    if track_columns:
+        arrays.append(pa.array(times, type=pa.list_(pa.float64())))
+        names.append('time')
+        for k in track_columns:
+            arrays.append(pa.array(tracks[k], type=pa.list_(pa.float64())))
+            names.append(k)
+    return pa.Table.from_arrays(arrays, names=names)
+
+
+def _conform(table, schema):
+    """
+    Cast a table to the schema of the first batch written, which may have had no values in some columns
+    """
+    arrays = []
+    for field in schema:
+        column = table.column(field.name) if field.name in table.column_names else pa.nulls(table.num_rows)
+        if column.type != field.type:
+            if pa.types.is_dictionary(field.type) and not pa.types.is_dictionary(column.type):
+                column = column.cast(field.type.value_type).dictionary_encode()
+            else:
+                column = column.cast(field.type)
+        arrays.append(column)
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def _first_schema(table):
+    # Columns with no values in the first batch are assumed to hold strings, and integers are widened so that later
+    # batches with fractional values still fit
+    fields = []
+    for field in table.schema:
+        if pa.types.is_null(field.type):
+            field = field.with_type(pa.dictionary(pa.int32(), pa.string()))
+        elif pa.types.is_integer(field.type):
+            field = field.with_type(pa.float64())
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def write_tables(tables, sink):
+    """
+    Write Arrow tables to a Parquet file as row groups, conforming each to the schema of the first
+
+    :param tables: iterable of :class:`pyarrow.Table`
+    :param sink: str or file object
+    :return: int
+        Number of rows written
+    """
+    check_available()
+    writer = None
+    count = 0
+    try:
+        for table in tables:
+            if writer is None:
+                schema = _first_schema(table)
+                writer = pq.ParquetWriter(sink, schema, compression='zstd')
+            writer.write_table(_conform(table, schema))
+            count += table.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        pq.write_table(pa.table({}), sink)
+    return count
+
+
+def write_parquet(batches, sink):
+    """
+    Write batches of query results to a Parquet file, one row group per batch
+
+    :param batches: iterable of query results
+    :param sink: str or file object
+    :return: int
+        Number of rows written
+    """
+    return write_tables((results_to_table(x) for x in batches), sink)
+
+
+def merge_parquet(paths, sink):
+    """
+    Concatenate Parquet files in order into a single file, skipping empty ones
+
+    :param paths: list of str
+    :param sink: str or file object
+    :return: int
+        Number of rows written
+    """
+    check_available()
+    tables = (pq.read_table(x) for x in paths)
+    return write_tables((x for x in tables if x.num_columns), sink)
+
+
+def parquet_bytes(batches):
+    """
+    Write batches of query results to an in-memory Parquet file
+
+    :param batches: iterable of query results
+    :return: bytes
+    """
+    check_available()
+    sink = pa.BufferOutputStream()
+    write_parquet(batches, sink)
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,224 @@
+import os
+import time
+import socket
+import logging
+import threading
+import functools
+
+from django.conf import settings
+
+from neo4j import GraphDatabase
+from influxdb import InfluxDBClient
+
+import polyglotdb
+import polyglotdb.corpus.base as polyglotdb_base
+from polyglotdb.config import CorpusConfig
+
+log = logging.getLogger(__name__)
+
+DEFAULT_GRAPH_POOL_SIZE = 50
+DEFAULT_ACOUSTIC_POOL_SIZE = 10
+# Seconds a pooled connection can go unused before it is checked again
+DEFAULT_HEALTH_CHECK_INTERVAL = 30
+# Seconds a pooled Bolt connection is kept before being replaced
+DEFAULT_CONNECTION_LIFETIME = 3600
+
+
+@functools.lru_cache(maxsize=None)
+def connection_host():
+    """
+    Host the databases are reachable at from this process.  With Docker, the app container puts the databases up on
+    all interfaces and other containers connect through the app container.
+    """
+    if settings.DOCKER:
+        if socket.gethostname() == 'app':
+            return '0.0.0.0'
+        return 'app'
+    return 'localhost'
+
+
+class ConnectionManager(object):
+    """
+    Long-lived Bolt drivers and InfluxDB clients shared by every :class:`CorpusContext` in the process, keyed by the
+    database ports they connect to
+
+    Connections that have been idle longer than POLYGLOT_CONNECTION_CHECK_INTERVAL seconds are checked before being
+    handed out, and replaced if the database has gone away.  Pools are not carried across a fork, so Celery's worker
+    processes each open their own.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.pid = os.getpid()
+        self.graph_drivers = {}
+        self.acoustic_clients = {}
+        self.acoustic_databases = {}
+        self.last_checked = {}
+
+    def _check_process(self):
+        if os.getpid() != self.pid:
+            # Sockets opened by the parent process can't be shared, so start over without closing them
+            self.pid = os.getpid()
+            self.graph_drivers = {}
+            self.acoustic_clients = {}
+            self.acoustic_databases = {}
+            self.last_checked = {}
+
+    def _needs_check(self, key):
+        interval = getattr(settings, 'POLYGLOT_CONNECTION_CHECK_INTERVAL', DEFAULT_HEALTH_CHECK_INTERVAL)
+        return time.time() - self.last_checked.get(key, 0) > interval
+
+    def graph_driver(self, host, bolt_port):
+        """
+        Get the pooled Bolt driver for a Neo4j database
+
+        :param host: str
+        :param bolt_port: int
+        :return: :class:`neo4j.Driver`
+        """
+        key = ('graph', host, bolt_port)
+        with self.lock:
+            self._check_process()
+            driver = self.graph_drivers.get(key)
+            if driver is not None and self._needs_check(key):
+                try:
+                    with driver.session() as session:
+                        session.run('RETURN 1').consume()
+                except Exception:
+                    log.warning('Discarding unhealthy connection to Neo4j at {}:{}'.format(host, bolt_port))
+                    self._close_driver(driver)
+                    driver = None
+                    del self.graph_drivers[key]
+            if driver is None:
+                driver = GraphDatabase.driver(
+                    'bolt://{}:{}'.format(host, bolt_port),
+                    max_connection_pool_size=getattr(settings, 'POLYGLOT_NEO4J_POOL_SIZE', DEFAULT_GRAPH_POOL_SIZE),
+                    max_connection_lifetime=getattr(settings, 'POLYGLOT_NEO4J_CONNECTION_LIFETIME',
+                                                    DEFAULT_CONNECTION_LIFETIME))
+                self.graph_drivers[key] = driver
+            self.last_checked[key] = time.time()
+            return driver
+
+    def acoustic_client(self, host, http_port, database, **kwargs):
+        """
+        Get the pooled InfluxDB client for a corpus, creating the corpus's InfluxDB database the first time
+
+        :param host: str
+        :param http_port: int
+        :param database: str
+            InfluxDB database (i.e., corpus name)
+        :return: :class:`influxdb.InfluxDBClient`
+        """
+        key = ('acoustic', host, http_port, database)
+        with self.lock:
+            self._check_process()
+            client = self.acoustic_clients.get(key)
+            if client is not None and self._needs_check(key):
+                try:
+                    client.ping()
+                except Exception:
+                    log.warning('Discarding unhealthy connection to InfluxDB at {}:{}'.format(host, http_port))
+                    client.close()
+                    client = None
+                    del self.acoustic_clients[key]
+                    self.acoustic_databases.pop(key, None)
+            if client is None:
+                client = InfluxDBClient(host=host, port=http_port, database=database,
+                                        pool_size=getattr(settings, 'POLYGLOT_INFLUXDB_POOL_SIZE',
+                                                          DEFAULT_ACOUSTIC_POOL_SIZE),
+                                        **kwargs)
+                self.acoustic_clients[key] = client
+            if key not in self.acoustic_databases:
+                if database not in [x['name'] for x in client.get_list_database()]:
+                    client.create_database(database)
+                self.acoustic_databases[key] = True
+            self.last_checked[key] = time.time()
+            return client
+
+    def forget_acoustic_database(self, host, http_port, database):
+        """
+        Record that a corpus's InfluxDB database has been dropped, so it is created again on next use
+        """
+        with self.lock:
+            self.acoustic_databases.pop(('acoustic', host, http_port, database), None)
+
+    @staticmethod
+    def _close_driver(driver):
+        try:
+            driver.close()
+        except Exception:
+            pass
+
+    def close(self, host, bolt_port, http_port):
+        """
+        Close the pooled connections to a database's Neo4j and InfluxDB, i.e. when the database is stopped
+        """
+        with self.lock:
+            self._check_process()
+            key = ('graph', host, bolt_port)
+            driver = self.graph_drivers.pop(key, None)
+            self.last_checked.pop(key, None)
+            if driver is not None:
+                self._close_driver(driver)
+            for key in [x for x in self.acoustic_clients if x[1:3] == (host, http_port)]:
+                self.acoustic_clients.pop(key).close()
+                self.acoustic_databases.pop(key, None)
+                self.last_checked.pop(key, None)
+
+
+connections = ConnectionManager()
+
+
+def close_connections(database):
+    """
+    Close the pooled connections to a :class:`~iscan.models.Database`
+    """
+    connections.close(connection_host(), database.neo4j_bolt_port, database.influxdb_http_port)
+
+
+class _PooledGraphDatabase(object):
+    """
+    Stand-in for :class:`neo4j.GraphDatabase` in PolyglotDB's BaseContext, which opens a driver of its own in its
+    constructor.  While a :class:`CorpusContext` is being set up in the calling thread, the pooled driver for its
+    database is handed out instead, and otherwise a new driver is opened as before.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def driver(self, *args, **kwargs):
+        config = getattr(self.local, 'config', None)
+        if config is None:
+            return GraphDatabase.driver(*args, **kwargs)
+        return connections.graph_driver(config.host, config.graph_bolt_port)
+
+
+_pooled_graph_database = _PooledGraphDatabase()
+polyglotdb_base.GraphDatabase = _pooled_graph_database
+
+
+class CorpusContext(polyglotdb.CorpusContext):
+    """
+    PolyglotDB corpus context that uses the process's pooled connections rather than opening (and closing) its own
+    driver and clients
+    """
+
+    def __init__(self, *args, **kwargs):
+        config = args[0] if args and isinstance(args[0], CorpusConfig) else CorpusConfig(*args, **kwargs)
+        _pooled_graph_database.local.config = config
+        try:
+            super(CorpusContext, self).__init__(config)
+        finally:
+            _pooled_graph_database.local.config = None
+
+    def __exit__(self, exc_type, exc, exc_tb):
+        # The driver stays open for the next context
+        return exc_type is None
+
+    def acoustic_client(self):
+        kwargs = self.config.acoustic_connection_kwargs
+        return connections.acoustic_client(kwargs.pop('host'), kwargs.pop('port'), kwargs.pop('database'), **kwargs)
+
+    def reset_acoustics(self):
+        super(CorpusContext, self).reset_acoustics()
+        connections.forget_acoustic_database(self.config.host, self.config.acoustic_http_port, self.corpus_name)
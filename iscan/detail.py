@@ -0,0 +1,239 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import shutil
+import logging
+
+from django.conf import settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from .serializers import compile_serializer
+from .pyramids import discourse_pyramid
+from .audio import utterance_audio
+
+log = logging.getLogger(__name__)
+
+# Results before and after the current one that are sent along with it, so that stepping through tokens doesn't
+# need another request
+DETAIL_BEFORE = 2
+DETAIL_AFTER = 5
+
+# Seconds a prefetch of a window counts as queued, during which requests for the same window don't queue another
+PREFETCH_MARKER_AGE = 60
+
+
+def load_utterance_details(corpus_context, utterance_ids, with_subannotations=True):
+    """
+    Look up utterances with their words, syllables, phones, subannotations and acoustic tracks in one query
+
+    :param corpus_context: :class:`~iscan.connections.CorpusContext`
+    :param utterance_ids: list
+    :param with_subannotations: bool
+    :return: dict
+        Serialized utterances keyed by ID, utterances that no longer exist are left out
+    """
+    c = corpus_context
+    if not utterance_ids:
+        return {}
+    q = c.query_graph(c.utterance)
+    if len(utterance_ids) == 1:
+        q = q.filter(c.utterance.id == utterance_ids[0])
+    else:
+        q = q.filter(c.utterance.id.in_(list(utterance_ids)))
+    q = q.preload(c.utterance.word)
+    q = q.preload(c.utterance.syllable)
+    q = q.preload(c.utterance.phone)
+    q = q.preload(c.utterance.speaker)
+    q = q.preload(c.utterance.discourse)
+    if with_subannotations:
+        for t in c.hierarchy.annotation_types:
+            if t in c.hierarchy.subannotations:
+                for s in c.hierarchy.subannotations[t]:
+                    if t == 'utterance':
+                        q = q.preload(getattr(c.utterance, s))
+                    else:
+                        q = q.preload(getattr(getattr(c.utterance, t), s))
+    acoustic_columns = c.hierarchy.acoustics
+    for a_column in acoustic_columns:
+        acoustic = getattr(c.utterance, a_column)
+        acoustic.relative = True
+        q = q.preload_acoustics(acoustic.track)
+    utterances = q.all()
+    if not utterances:
+        return {}
+    serialize = compile_serializer(c.hierarchy, 'utterance',
+                                   acoustic_columns=acoustic_columns,
+                                   with_waveform=False,
+                                   with_spectrogram=False,
+                                   top_level=True,
+                                   with_lower_annotations=True, detail=True,
+                                   with_subannotations=True)
+    return {u.id: serialize(u) for u in utterances}
+
+
+class UtteranceDetailCache(object):
+    """
+    Serialized utterance details for one version of a corpus's data, saved as a JSON file per utterance so that
+    details prefetched by a worker can be served by the web server
+
+    Details for older versions of the data are removed when details for a newer version are added.  Past
+    POLYGLOT_DETAIL_CACHE_ENTRIES utterances, the least recently added are removed.
+    """
+
+    def __init__(self, corpus, with_subannotations=True):
+        self.root = os.path.join(corpus.data_directory, 'detail', corpus.name)
+        self.version = str(corpus.data_version)
+        self.directory = os.path.join(self.root, self.version, 'full' if with_subannotations else 'basic')
+        self.max_entries = getattr(settings, 'POLYGLOT_DETAIL_CACHE_ENTRIES', 5000)
+
+    def _path(self, utterance_id):
+        return os.path.join(self.directory, '{}.json'.format(utterance_id))
+
+    def get(self, utterance_ids):
+        """
+        Get the cached details of utterances
+
+        :return: dict
+            Serialized utterances keyed by ID, for the ones that are cached
+        """
+        found = {}
+        for utterance_id in utterance_ids:
+            try:
+                with open(self._path(utterance_id), 'r', encoding='utf8') as f:
+                    found[utterance_id] = json.load(f)
+            except (OSError, ValueError):
+                continue
+        return found
+
+    def add(self, details):
+        if not self.max_entries:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for utterance_id, detail in details.items():
+            temp_path = os.path.join(self.directory, '.{}.tmp'.format(uuid.uuid4().hex))
+            with open(temp_path, 'w', encoding='utf8') as f:
+                json.dump(detail, f, cls=JSONEncoder)
+            os.replace(temp_path, self._path(utterance_id))
+        self.evict()
+
+    def evict(self):
+        for name in os.listdir(self.root):
+            if name != self.version:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+        names = [x for x in os.listdir(self.directory) if not x.startswith('.')]
+        if len(names) <= self.max_entries:
+            return
+        paths = sorted((os.path.join(self.directory, x) for x in names), key=os.path.getmtime)
+        for path in paths[:len(paths) - self.max_entries]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def media_reference(utterance):
+    """
+    Where the client can get an utterance's waveform and spectrogram from the discourse's pyramid
+    """
+    return {'discourse': utterance['discourse']['name'], 'begin': utterance['begin'], 'end': utterance['end']}
+
+
+def detail_window(query, corpus_context, index, ordering='', with_subannotations=True, before=DETAIL_BEFORE,
+                  after=DETAIL_AFTER):
+    """
+    Get the detail of the results around an index: the result row, the utterance it is in and a reference to the
+    utterance's waveform and spectrogram.  Results are looked up once for the whole window, and utterances come from
+    the detail cache where possible, with the rest looked up in a single query.
+
+    :param query: :class:`~iscan.models.Query`
+    :param corpus_context: :class:`~iscan.connections.CorpusContext`
+    :param index: int
+    :return: list or None
+        Detail of each result in the window in order, or None if there are no results yet
+    """
+    offset = max(index - before, 0)
+    results = query.get_results(ordering, index + after + 1 - offset, offset)
+    if results is None:
+        return None
+    utterance_ids = list(dict.fromkeys(r['utterance']['current']['id'] for r in results))
+    cache = UtteranceDetailCache(query.corpus, with_subannotations)
+    details = cache.get(utterance_ids)
+    missing = [x for x in utterance_ids if x not in details]
+    if missing:
+        loaded = load_utterance_details(corpus_context, missing, with_subannotations)
+        cache.add(loaded)
+        details.update(loaded)
+    window = []
+    for r in results:
+        utterance = details.get(r['utterance']['current']['id'], None)
+        window.append({'index': r['index'], 'result': r, 'utterance': utterance,
+                       'media': media_reference(utterance) if utterance is not None else None})
+    return window
+
+
+def prefetch_index(index):
+    """
+    Get the index the window prefetched for the window around an index is centred on
+    """
+    return index + DETAIL_AFTER + DETAIL_BEFORE + 1
+
+
+def claim_prefetch(query, index, ordering='', with_subannotations=True, max_age=PREFETCH_MARKER_AGE):
+    """
+    Check whether the window after the one around an index still needs prefetching, and if so mark it as queued, so
+    that requests while stepping through results don't each queue a task for the same window
+
+    :return: bool
+        False if the window's utterance details are already cached or a prefetch of it was queued within max_age
+        seconds
+    """
+    prefetched = prefetch_index(index)
+    offset = max(prefetched - DETAIL_BEFORE, 0)
+    results = query.get_results(ordering, prefetched + DETAIL_AFTER + 1 - offset, offset)
+    if not results:
+        return False
+    utterance_ids = list(dict.fromkeys(r['utterance']['current']['id'] for r in results))
+    if len(UtteranceDetailCache(query.corpus, with_subannotations).get(utterance_ids)) == len(utterance_ids):
+        return False
+    key = '{}|{}|{}'.format(prefetched, ordering, with_subannotations)
+    directory = os.path.join(query.directory, 'prefetch')
+    os.makedirs(directory, exist_ok=True)
+    marker = os.path.join(directory, hashlib.sha1(key.encode('utf8')).hexdigest())
+    now = time.time()
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+    try:
+        os.close(os.open(marker, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+    except FileExistsError:
+        return False
+    return True
+
+
+def prefetch_detail_window(query, corpus_context, index, ordering='', with_subannotations=True, codec='wav'):
+    """
+    Warm everything the detail view needs for the window starting after the one around an index: utterance details,
+    the discourses' waveform and spectrogram pyramids and the utterances' audio
+    """
+    corpus = query.corpus
+    window = detail_window(query, corpus_context, prefetch_index(index), ordering, with_subannotations)
+    if not window:
+        return
+    for discourse in dict.fromkeys(x['media']['discourse'] for x in window if x['media'] is not None):
+        try:
+            discourse_pyramid(corpus, corpus_context, discourse)
+        except Exception:
+            log.exception('Could not build the pyramid for {}'.format(discourse))
+    for x in window:
+        if x['utterance'] is None:
+            continue
+        try:
+            utterance_audio(corpus, corpus_context, x['utterance']['id'], codec=codec)
+        except Exception:
+            log.exception('Could not cut the audio for {}'.format(x['utterance']['id']))
@@ -0,0 +1,89 @@
+import os
+import json
+import threading
+
+from django.utils.http import quote_etag
+
+from polyglotdb.structure import Hierarchy
+
+from .connections import CorpusContext
+
+
+# Hierarchies loaded in this process, keyed by corpus, along with the data version they were loaded for
+_hierarchies = {}
+_hierarchies_lock = threading.Lock()
+
+
+def load_snapshot(path, version):
+    """
+    Load a hierarchy snapshot saved for a version of the corpus data
+
+    :param path: str
+    :param version: int
+    :return: :class:`~polyglotdb.structure.Hierarchy` or None
+        None if there is no snapshot or it was saved for a different version
+    """
+    try:
+        with open(path, 'r', encoding='utf8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get('version') != version:
+        return None
+    hierarchy = Hierarchy(corpus_name=data['hierarchy'].get('corpus_name'))
+    hierarchy.from_json(data['hierarchy'])
+    return hierarchy
+
+
+def save_snapshot(path, version, hierarchy):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf8') as f:
+        json.dump({'version': version, 'hierarchy': hierarchy.to_json()}, f)
+    os.replace(temp_path, path)
+
+
+def corpus_hierarchy(corpus):
+    """
+    Get a corpus's hierarchy, only connecting to the graph database if the corpus data has changed since the hierarchy
+    was last loaded
+
+    Hierarchies are kept in memory for the process and backed by a snapshot on disk, both stamped with the corpus's
+    data version, so any change that bumps the data version (enrichments, subsets, subannotation edits) replaces them.
+    The returned hierarchy is shared between threads and must not be modified.
+
+    :param corpus: :class:`~iscan.models.Corpus`
+    :return: :class:`~polyglotdb.structure.Hierarchy`
+    """
+    version = corpus.data_version
+    with _hierarchies_lock:
+        cached = _hierarchies.get(corpus.pk)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    path = corpus.hierarchy_snapshot_path
+    hierarchy = load_snapshot(path, version)
+    if hierarchy is None:
+        with CorpusContext(corpus.config) as c:
+            hierarchy = c.hierarchy
+        save_snapshot(path, version, hierarchy)
+    with _hierarchies_lock:
+        cached = _hierarchies.get(corpus.pk)
+        if cached is None or cached[0] <= version:
+            _hierarchies[corpus.pk] = (version, hierarchy)
+    return hierarchy
+
+
+def invalidate_hierarchy(corpus):
+    """
+    Drop a corpus's cached hierarchy, i.e. when its database is reset
+    """
+    with _hierarchies_lock:
+        _hierarchies.pop(corpus.pk, None)
+    try:
+        os.remove(corpus.hierarchy_snapshot_path)
+    except FileNotFoundError:
+        pass
+
+
+def hierarchy_etag(corpus):
+    return quote_etag('hierarchy-{}-{}'.format(corpus.pk, corpus.data_version))
@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+
+class LockTimeout(Exception):
+    pass
+
+
+def pid_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class TaskLock(object):
+    """
+    Cross-process lock on a file, for serializing background tasks that operate on the same data (i.e., runs, exports
+    and subset generation for a query).
+
+    Waiting tasks sleep with an increasing interval rather than spinning, and give up with :class:`LockTimeout` after
+    ``timeout`` seconds.  The holder records its task ID, host and process ID next to the lock.  Where ``flock`` is
+    available, the kernel releases the lock when the holder's process dies, so locks are never broken.  Otherwise the
+    lock is a file created exclusively, with the owner written in it, and a lock whose process on this host has died
+    is broken rather than waited on forever.
+
+    If ``queue_path`` is given, runs are coalesced: each task registers itself as the latest queued run before waiting,
+    and once it acquires the lock, :meth:`acquire` returns False without holding the lock if a newer run was queued in
+    the meantime, as that run will produce the same result.
+    """
+
+    def __init__(self, path, task_id=None, timeout=None, queue_path=None, poll_interval=0.1, max_poll_interval=2.0):
+        self.path = path
+        self.task_id = str(task_id) if task_id is not None else None
+        self.timeout = timeout
+        self.queue_path = queue_path
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.token = self.task_id if self.task_id is not None else uuid.uuid4().hex
+        self._fd = None
+
+    @property
+    def owner_path(self):
+        return self.path + '.owner'
+
+    @property
+    def locked(self):
+        return self._fd is not None
+
+    def read_owner(self, path=None):
+        if path is None:
+            path = self.owner_path if fcntl is not None else self.path
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def owner_is_stale(self, owner):
+        """
+        Check whether an owner of a lock created without ``flock`` is a process on this host that no longer exists
+        """
+        if not owner:
+            return False
+        return owner.get('host') == socket.gethostname() and bool(owner.get('pid')) and not pid_exists(owner['pid'])
+
+    def _owner(self):
+        return {'task_id': self.task_id, 'token': self.token, 'host': socket.gethostname(), 'pid': os.getpid(),
+                'acquired_at': time.time()}
+
+    def _write_owner(self):
+        temp_path = self.owner_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self._owner(), f)
+        os.replace(temp_path, self.owner_path)
+
+    def _try_acquire(self):
+        if fcntl is None:
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_EXCL)
+            except FileExistsError:
+                return False
+            os.write(fd, json.dumps(self._owner()).encode('utf8'))
+            self._fd = fd
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def _break(self, owner):
+        """
+        Remove a lock created without ``flock`` whose owner has died.  The lock file is moved aside first, so that a
+        lock another waiter took after breaking it too is put back rather than removed.
+        """
+        broken_path = '{}.{}.broken'.format(self.path, self.token)
+        try:
+            os.rename(self.path, broken_path)
+        except FileNotFoundError:
+            return
+        if self.read_owner(broken_path) == owner:
+            log.warning('Breaking stale lock {} held by {}'.format(self.path, owner))
+            os.remove(broken_path)
+            return
+        try:
+            os.rename(broken_path, self.path)
+        except OSError:
+            log.warning('Could not restore lock {}, which was taken while breaking it'.format(self.path))
+
+    def _enqueue(self):
+        temp_path = self.queue_path + '.' + self.token
+        with open(temp_path, 'w') as f:
+            f.write(self.token)
+        os.replace(temp_path, self.queue_path)
+
+    def queued_run(self):
+        """
+        Get the token of the latest run waiting on the lock, if any
+        """
+        if self.queue_path is None:
+            return None
+        try:
+            with open(self.queue_path, 'r') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def has_pending(self):
+        """
+        Check whether another run has been queued since this one acquired the lock
+        """
+        return self.queued_run() not in (None, self.token)
+
+    def acquire(self):
+        """
+        Block until the lock is acquired
+
+        :return: bool
+            False if a newer run was queued while waiting, in which case the lock is not held
+        """
+        if self.queue_path is not None:
+            self._enqueue()
+        begin = time.time()
+        interval = self.poll_interval
+        while not self._try_acquire():
+            if self.timeout is not None and time.time() - begin > self.timeout:
+                raise LockTimeout('Could not acquire {} within {} seconds'.format(self.path, self.timeout))
+            if fcntl is None:
+                owner = self.read_owner()
+                if self.owner_is_stale(owner):
+                    self._break(owner)
+                    continue
+            time.sleep(interval)
+            interval = min(interval * 2, self.max_poll_interval)
+        if self.queue_path is not None and self.queued_run() != self.token:
+            log.info('Skipping {}, superseded by a newer queued run'.format(self.token))
+            self.release()
+            return False
+        if fcntl is not None:
+            self._write_owner()
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        if fcntl is None:
+            os.close(self._fd)
+            # Only remove the lock file if it is still this lock's, rather than one put back after breaking it
+            owner = self.read_owner()
+            if owner is not None and owner.get('token') == self.token:
+                os.remove(self.path)
+        else:
+            try:
+                os.remove(self.owner_path)
+            except FileNotFoundError:
+                pass
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.2 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iscan', '0005_backgroundtask_spadescript'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='query',
+            name='estimated_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
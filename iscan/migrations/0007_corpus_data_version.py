@@ -0,0 +1,18 @@
+# Generated by Django 2.2.2 on 2026-10-17 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iscan', '0006_query_estimated_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='corpus',
+            name='data_version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
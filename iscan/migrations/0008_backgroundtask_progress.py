@@ -0,0 +1,18 @@
+# Generated by Django 2.2.2 on 2026-10-17 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iscan', '0007_corpus_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backgroundtask',
+            name='progress',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
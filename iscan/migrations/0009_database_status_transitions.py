@@ -0,0 +1,18 @@
+# Generated by Django 2.2.2 on 2026-10-17 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iscan', '0008_backgroundtask_progress'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='database',
+            name='status',
+            field=models.CharField(choices=[('S', 'Stopped'), ('R', 'Running'), ('E', 'Error'), ('T', 'Starting'), ('P', 'Stopping')], default='S', max_length=1),
+        ),
+    ]
@@ -1,16 +1,19 @@
 import os
+import io
+import copy
 import sys
 import subprocess
 import traceback
-import signal
 import json
 import time
 import logging
 import csv
-import socket
 import yaml
 import shutil
 import datetime
+import hashlib
+import threading
+import concurrent.futures
 
 from django.db import models
 from django.conf import settings
@@ -23,19 +26,33 @@ from celery.result import AsyncResult
 # Comment out once PolyglotDB docker compatibility is merged
 sys.path.insert(0, '/site/proj/PolyglotDB')
 
-from polyglotdb import CorpusContext
 import polyglotdb.io as pgio
 from polyglotdb \
     .config import CorpusConfig
 from polyglotdb.utils import get_corpora_list
 
-from .utils import download_influxdb, download_neo4j, extract_influxdb, extract_neo4j, make_influxdb_safe, get_pids, \
-    get_used_ports, is_port_in_use, run_spade_script
+from .utils import download_influxdb, download_neo4j, extract_influxdb, extract_neo4j, make_influxdb_safe, \
+    get_used_ports, run_spade_script, hierarchy_fingerprint
+from .results import QueryResultStore, MISSING, get_result_cache
+from .locks import TaskLock, LockTimeout
+from .columnar import write_parquet, merge_parquet
+from .parallel import enrichment_jobs, use_multiprocessing, limit_jobs
+from .checkpoints import EnrichmentCheckpoint, CHECKPOINTED_ENRICHMENTS, analyze_by_speaker
+from .pipeline import requirements, is_satisfied
+from .hierarchy import corpus_hierarchy, invalidate_hierarchy
+from .connections import CorpusContext, connection_host, close_connections
+from .catalog import materialize_catalog, invalidate_catalog
+from .pyramids import build_pyramids
+from .audio import get_audio_cache
+from .supervisor import DatabaseSupervisor, DEFAULT_START_TIMEOUT, DEFAULT_STOP_TIMEOUT
 
 import logging
 
 log = logging.getLogger(__name__)
 
+# Hidden column that paged column queries return their annotations' IDs in
+KEYSET_COLUMN = 'keyset_id'
+
 
 # Create your models here.
 
@@ -127,10 +144,14 @@ class Database(models.Model):
     RUNNING = 'R'
     STOPPED = 'S'
     ERROR = 'E'
+    STARTING = 'T'
+    STOPPING = 'P'
     STATUS_CHOICES = (
         (STOPPED, 'Stopped'),
         (RUNNING, 'Running'),
         (ERROR, 'Error'),
+        (STARTING, 'Starting'),
+        (STOPPING, 'Stopping'),
     )
     name = models.CharField(max_length=100, unique=True)
     neo4j_http_port = models.SmallIntegerField(blank=True)
@@ -227,85 +248,39 @@ class Database(models.Model):
         """
         return os.path.join(self.directory, 'influxdb.log')
 
-    def start(self, timeout=120):
+    @property
+    def supervisor(self):
+        return DatabaseSupervisor(self)
+
+    def start(self, timeout=DEFAULT_START_TIMEOUT):
         """
         Function to start the components of a PolyglotDB database.  By the end both the Neo4j database and the InfluxDB
-        database will be connectable.  This function blocks until connections are made or until a timeout is reached.
+        database will be connectable.  This function blocks until connections are made or until a timeout is reached,
+        so it is run in a background task (see :func:`~iscan.tasks.start_database_task`).
 
-        :return:
+        :return: bool
+            False if the database was already running
+        :raises SupervisorError: if the databases could not be started, in which case the status is set to error
         """
-        if self.status in ['R']:
-            return False
-        if self.influxdb_pid is not None or self.neo4j_pid is not None:
+        if self.status == self.RUNNING:
             return False
-        for k, v in self.ports.items():
-            if is_port_in_use(v):
-                raise Exception('The port {} is currently in use on this machine.  Please stop any other process'
-                                ' using it so that the specified database can be run.'.format(v))
+        self.status = self.STARTING
+        self.save()
         try:
-            with open(self.influxdb_log_path, 'a') as logf:
-                influx_proc = subprocess.Popen([self.influxdb_exe_path, '-config', self.influxdb_conf_path],
-                                               stdout=logf,
-                                               stderr=logf,
-                                               stdin=subprocess.DEVNULL,
-                                               restore_signals=False,
-                                               start_new_session=True)
-                self.influxdb_pid = influx_proc.pid
-            existing_neo4js = []
-            if sys.platform.startswith('win'):
-                neo4j_finder = 'WMIC PROCESS get Processid,Caption,Commandline'
-            else:
-                neo4j_finder = 'ps aux'  # 'ps S'
-            proc = subprocess.Popen(neo4j_finder, shell=True,
-                                    stdout=subprocess.PIPE)
-            stdout, stderr = proc.communicate()
-            for line in stdout.decode('utf8').splitlines():
-                if 'neo4j' in line and 'java' in line:
-                    try:
-                        pid = int(line.strip().split()[0])
-                    except ValueError:
-                        pid = int(line.strip().split()[1])
-                    existing_neo4js.append(pid)
-
-            with open(self.neo4j_log_path, 'a') as logf:
-                neo4j_proc = subprocess.Popen([self.neo4j_exe_path, 'start'],
-                                              stdout=logf,
-                                              stderr=logf,
-                                              stdin=subprocess.DEVNULL)
-                neo4j_proc.communicate()
-
-                neo4j_pid = None
-                begin = time.time()
-                while neo4j_pid is None:
-                    time.sleep(1)
-                    if time.time() - begin > timeout:
-                        return False
-                    proc = subprocess.Popen(neo4j_finder, shell=True,
-                                            stdout=subprocess.PIPE)
-                    stdout, stderr = proc.communicate()
-                    for line in stdout.decode('utf8').splitlines():
-                        if 'neo4j' in line and 'java' in line:
-                            pid = int(line.strip().split()[1])
-                            if pid in existing_neo4js:
-                                continue
-                            neo4j_pid = pid
-                            break
-                self.neo4j_pid = neo4j_pid
-                begin = time.time()
-                while True:
-                    time.sleep(1)
-                    if time.time() - begin > timeout:
-                        raise Exception(
-                            'Connection to the Neo4j database could not be established in the specified timeout.')
-                    if self.is_running:
-                        break
-                self.status = 'R'
-                self.save()
-        except Exception as e:
+            pids = self.supervisor.start(timeout)
+        except Exception:
             with open(self.log_path, 'a') as f:
                 exc_type, exc_value, exc_traceback = sys.exc_info()
                 traceback.print_exception(exc_type, exc_value, exc_traceback, file=f)
-            return False
+            self.neo4j_pid = None
+            self.influxdb_pid = None
+            self.status = self.ERROR
+            self.save()
+            raise
+        self.neo4j_pid = pids['neo4j']
+        self.influxdb_pid = pids['influxdb']
+        self.status = self.RUNNING
+        self.save()
         return True
 
     @property
@@ -323,15 +298,7 @@ class Database(models.Model):
         c = CorpusConfig('')
         c.acoustic_user = None
         c.acoustic_password = None
-        # Dockerization: if accessing from the app container, put it up on all interfaces
-        # so other containers can connect to it from the app container's IP
-        if settings.DOCKER:
-            if socket.gethostname() == 'app':
-                c.host = '0.0.0.0'
-            else:
-                c.host = 'app'
-        else:
-            c.host = 'localhost'
+        c.host = connection_host()
         c.acoustic_http_port = self.influxdb_http_port
         c.graph_user = None
         c.graph_password = None
@@ -344,56 +311,32 @@ class Database(models.Model):
             print(e)
             return False
 
-    def stop(self):
+    def stop(self, timeout=DEFAULT_STOP_TIMEOUT):
         """
-        Function to stop a PolyglotDB's databases.  This is done through using Neo4j's stop utility and sending an interrupt
-        signal to InfluxDB.  This function blocks until both databases are detected to have closed successfully.
+        Function to stop a PolyglotDB's databases.  Neo4j and InfluxDB are signalled to shut down and killed if they
+        haven't within the timeout.  This function blocks until both have exited, so it is run in a background task
+        (see :func:`~iscan.tasks.stop_database_task`).
 
-        :return:
+        :return: bool
         """
-        if self.neo4j_pid is None:
-            raise Exception('Neo4j PID is None')
-        if self.status in ['S', 'E']:
+        if self.status == self.STOPPED:
             raise Exception('Database is already stopped')
+        self.status = self.STOPPING
+        self.save()
+        close_connections(self)
         try:
-            os.kill(self.influxdb_pid, signal.SIGINT)
-        except ProcessLookupError:
-            if os.path.exists(self.log_path):
-                with open(self.log_path, 'a') as f:
-                    f.write('Could not find influxdb running with PID {}\n'.format(self.influxdb_pid))
-        except Exception as e:
-            if os.path.exists(self.log_path):
-                with open(self.log_path, 'a') as f:
-                    exc_type, exc_value, exc_traceback = sys.exc_info()
-                    traceback.print_tb(exc_traceback, limit=1, file=f)
-        if not os.path.exists(self.neo4j_exe_path):
-            pass
-        elif os.path.exists(self.neo4j_log_path):
-            with open(self.neo4j_log_path, 'a') as logf:
-                neo4j_proc = subprocess.Popen([self.neo4j_exe_path, 'stop'],
-                                              stdout=logf,
-                                              stderr=logf,
-                                              stdin=subprocess.DEVNULL)
-                neo4j_proc.communicate()
-
-            while True:
-                pids = get_pids()
-                if self.influxdb_pid not in pids and self.neo4j_pid not in pids:
-                    break
-        else:
-            neo4j_proc = subprocess.Popen([self.neo4j_exe_path, 'stop'],
-                                          stdout=subprocess.DEVNULL,
-                                          stderr=subprocess.DEVNULL,
-                                          stdin=subprocess.DEVNULL)
-            neo4j_proc.communicate()
-
-            while True:
-                pids = get_pids()
-                if self.influxdb_pid not in pids and self.neo4j_pid not in pids:
-                    break
+            # Databases started before pidfiles were kept are found through the PIDs stored here
+            self.supervisor.stop(timeout, fallback_pids={'neo4j': self.neo4j_pid, 'influxdb': self.influxdb_pid})
+        except Exception:
+            with open(self.log_path, 'a') as f:
+                exc_type, exc_value, exc_traceback = sys.exc_info()
+                traceback.print_exception(exc_type, exc_value, exc_traceback, file=f)
+            self.status = self.ERROR
+            self.save()
+            raise
         self.influxdb_pid = None
         self.neo4j_pid = None
-        self.status = 'S'
+        self.status = self.STOPPED
         self.save()
         return True
 
@@ -486,7 +429,7 @@ class Database(models.Model):
         Overwrites the default delete method to ensure the database is stopped and cleaned up from the disc before the
          object is deleted.
         """
-        if self.status == 'R':
+        if self.status in (self.RUNNING, self.ERROR):
             self.stop()
         shutil.rmtree(self.directory, ignore_errors=True)
         super(Database, self).delete()
@@ -536,12 +479,40 @@ class Corpus(models.Model):
     imported = models.BooleanField(default=False)
     busy = models.BooleanField(default=False)
     current_task_id = models.CharField(max_length=250, blank=True, null=True)
+    data_version = models.IntegerField(default=0)
 
     users = models.ManyToManyField(User, through='CorpusPermissions')
 
     def __str__(self):
         return self.name
 
+    def bump_data_version(self):
+        """
+        Mark the corpus data as changed (i.e., by an enrichment or an edit), so that anything computed from the previous
+        version of the data is no longer used
+        """
+        Corpus.objects.filter(pk=self.pk).update(data_version=models.F('data_version') + 1)
+        self.refresh_from_db(fields=['data_version'])
+        cache = get_result_cache()
+        if cache is not None:
+            cache.invalidate(self.pk)
+
+    @property
+    def hierarchy_snapshot_path(self):
+        return os.path.join(self.data_directory, 'hierarchy', '{}.json'.format(self.name))
+
+    @property
+    def catalog_path(self):
+        return os.path.join(self.data_directory, 'catalog', '{}.json'.format(self.name))
+
+    def get_hierarchy(self):
+        """
+        Get the corpus's hierarchy, from a snapshot saved for the current version of the corpus data if there is one
+
+        :return: :class:`~polyglotdb.structure.Hierarchy`
+        """
+        return corpus_hierarchy(self)
+
     @property
     def config_path(self):
         possible_configs = [os.path.join(self.source_directory, 'config'),
@@ -616,15 +587,7 @@ class Corpus(models.Model):
         c = CorpusConfig(str(self), data_dir=self.data_directory)
         c.acoustic_user = None
         c.acoustic_password = None
-        # Dockerization: if accessing from the app container, put it up on all interfaces
-        # so other containers can connect to it from the app container's IP
-        if settings.DOCKER:
-            if socket.gethostname() == 'app':
-                c.host = '0.0.0.0'
-            else:
-                c.host = 'app'
-        else:
-            c.host = 'localhost'
+        c.host = connection_host()
         c.acoustic_http_port = self.database.influxdb_http_port
         c.graph_user = None
         c.graph_password = None
@@ -632,6 +595,18 @@ class Corpus(models.Model):
         c.graph_bolt_port = self.database.neo4j_bolt_port
         return c
 
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        """
+        Overwrites the default save method so that saving an existing corpus doesn't write back the data version it
+        was loaded with, which would undo a :meth:`bump_data_version` made since then (i.e., by an enrichment run in
+        another task).  The data version is only saved if it is named in ``update_fields``.
+        """
+        if update_fields is None and not force_insert and not self._state.adding:
+            update_fields = [f.name for f in self._meta.concrete_fields
+                             if not f.primary_key and f.name != 'data_version']
+        super(Corpus, self).save(force_insert, force_update, using, update_fields)
+
     def delete(self, *args, **kwargs):
         """
         Overwrites the default delete method to ensure that corpus information is removed from the PolyglotDB database
@@ -640,6 +615,12 @@ class Corpus(models.Model):
         """
         with CorpusContext(self.config) as c:
             c.reset()
+        invalidate_hierarchy(self)
+        invalidate_catalog(self)
+        shutil.rmtree(os.path.join(self.data_directory, 'pyramids', self.name), ignore_errors=True)
+        audio_cache = get_audio_cache()
+        if audio_cache is not None:
+            audio_cache.invalidate(self.pk)
         super(Corpus, self).delete()
 
     def import_corpus(self):
@@ -669,11 +650,21 @@ class Corpus(models.Model):
             else:
                 return False
             c.load(parser, self.source_directory)
+        self.bump_data_version()
+        materialize_catalog(self)
         self.imported = True
         self.busy = False
         self.save()
 
 
+    def build_pyramids(self, task=None):
+        """
+        Precompute the waveforms and spectrograms of every discourse, so that viewing utterances doesn't require
+        processing audio
+        """
+        with CorpusContext(self.config) as c:
+            build_pyramids(self, c, task)
+
     @property
     def has_pauses(self):
         """
@@ -820,14 +811,22 @@ class Enrichment(models.Model):
 
     @property
     def config(self):
-        with open(self.config_path, 'r') as f:
-            config = json.load(f)
-        return config
+        # Cached on the instance, as serializing an enrichment reads its config several times
+        if not hasattr(self, '_config'):
+            with open(self.config_path, 'r') as f:
+                self._config = json.load(f)
+        return copy.deepcopy(self._config)
 
     @config.setter
     def config(self, new_config):
         with open(self.config_path, 'w') as f:
             json.dump(new_config, f)
+        self._config = copy.deepcopy(new_config)
+
+    def refresh_from_db(self, using=None, fields=None):
+        super(Enrichment, self).refresh_from_db(using, fields)
+        if hasattr(self, '_config'):
+            del self._config
 
     @property
     def directory(self):
@@ -843,45 +842,50 @@ class Enrichment(models.Model):
     def results_path(self):
         return os.path.join(self.directory, 'results.txt')
 
+    @property
+    def results_directory(self):
+        return os.path.join(self.directory, 'results')
+
+    @property
+    def result_store(self):
+        if not hasattr(self, '_result_store'):
+            self._result_store = QueryResultStore(self.results_directory)
+        return self._result_store
+
+    @property
+    def checkpoint_path(self):
+        return os.path.join(self.directory, 'checkpoint.json')
+
+    @property
+    def checkpoint(self):
+        """
+        Units of the enrichment completed by previous runs with the current config, which a rerun can skip
+        """
+        config = self.config
+        config.pop('num_jobs', None)
+        return EnrichmentCheckpoint(self.checkpoint_path, config)
+
     @property
     def runnable(self):
         config = self.config
         enrichment_type = config.get('enrichment_type')
-        with CorpusContext(self.corpus.config) as c:
-            if enrichment_type == 'subset':
-                annotation_type = config.get('annotation_type')
-                if not (annotation_type in c.hierarchy.annotation_types):
-                    return 'Must encode {}'.format(annotation_type)
-                if c.hierarchy.has_token_subset(annotation_type, config.get('subset_label', '')) or \
-                        c.hierarchy.has_type_subset(annotation_type, config.get('subset_label', '')):
-                    return "The {} subset already exists".format(config.get('subset_label', ''))
-            elif enrichment_type == 'syllables':
-                if not (c.hierarchy.has_type_subset('phone', config.get('phone_class', 'syllabic'))):
-                    return 'Must encode {}'.format(config.get('phone_class', 'syllabic'))
-            elif enrichment_type == 'refined_formant_points':
-                if not (c.hierarchy.has_type_subset('phone', config.get('phone_class', 'vowel'))):
-                    return 'Must encode {}'.format(config.get('phone_class', 'vowel'))
-            elif enrichment_type == 'utterances':
-                if not (c.hierarchy.has_token_subset('word', 'pause')):
-                    return 'Must encode pauses'
-            elif enrichment_type == 'vot':
-                #Check if utterances
-                if not "utterance" in c.hierarchy.annotation_types:
-                    return 'Must encode utterances'
-            elif 'csv' in enrichment_type:
-                if config.get('path') is None:
-                    return 'Must attach a file'
-                if enrichment_type == "importcsv":
-                    if not config.get("id_column", ''):
-                        return "One of the columns must have an ID"
-                    elif not config.get("annotation_type") in ["phone", "utterance", "syllable", "word"]:
-                        return "{} is not an annotation type".format(config.get('annotation_type'))
-            elif enrichment_type == 'hierarchical_property':
-                higher_annotation = config.get('higher_annotation')
-                lower_annotation = config.get('lower_annotation')
-                if not (
-                        higher_annotation in c.hierarchy.annotation_types and lower_annotation in c.hierarchy.annotation_types):
-                    return 'Must encode {} and {}'.format(higher_annotation, lower_annotation)
+        hierarchy = self.corpus.get_hierarchy()
+        for requirement in requirements(config):
+            if not is_satisfied(requirement, hierarchy):
+                return requirement.message
+        if enrichment_type == 'subset':
+            annotation_type = config.get('annotation_type')
+            if hierarchy.has_token_subset(annotation_type, config.get('subset_label', '')) or \
+                    hierarchy.has_type_subset(annotation_type, config.get('subset_label', '')):
+                return "The {} subset already exists".format(config.get('subset_label', ''))
+        elif 'csv' in enrichment_type:
+            if config.get('path') is None:
+                return 'Must attach a file'
+            if enrichment_type == "importcsv":
+                if not config.get("id_column", ''):
+                    return "One of the columns must have an ID"
+                elif not config.get("annotation_type") in ["phone", "utterance", "syllable", "word"]:
+                    return "{} is not an annotation type".format(config.get('annotation_type'))
         return 'runnable'
 
     def reset_enrichment(self):
@@ -960,25 +964,31 @@ class Enrichment(models.Model):
                     q = c.query_graph(getattr(c, annotation_type)) \
                             .filter(getattr(c, annotation_type).config.get.subset == config.get('subset'))
                     q.set_properties(**{x: None for x in props})
+            self.checkpoint.clear()
             self.running = False
             self.completed = False
             self.last_run = None
             self.save()
+            self.corpus.bump_data_version()
             self.corpus.busy = False
             self.corpus.save()
         except Exception:
+            self.corpus.bump_data_version()
             self.corpus.busy = False  # If it fails, don't stay busy and block everything
             self.corpus.save()
             self.running = False
             print(traceback.format_exc())
 
-    def run_enrichment(self):
+    def run_enrichment(self, task=None, keep_busy=False):
         self.running = True
         self.save()
         self.corpus.busy = True
         self.corpus.save()
         config = self.config
         enrichment_type = config.get('enrichment_type')
+        checkpoint = self.checkpoint
+        jobs = enrichment_jobs(config.get('num_jobs'))
+        multiprocessing = use_multiprocessing(jobs)
         try:
             with CorpusContext(self.corpus.config) as c:
                 if enrichment_type == 'subset':
@@ -1019,10 +1029,9 @@ class Enrichment(models.Model):
                     c.enrich_speakers_from_csv(config.get('path'))
                 elif enrichment_type == 'lexicon_csv':
                     c.enrich_lexicon_from_csv(config.get('path'))
-                elif enrichment_type == 'pitch':
-                    c.analyze_pitch(source=config.get('source', 'praat'), multiprocessing=False)
-                elif enrichment_type == 'formants':
-                    c.analyze_formant_tracks(source=config.get('source', 'praat'), multiprocessing=False)
+                elif enrichment_type in CHECKPOINTED_ENRICHMENTS:
+                    analyze_by_speaker(c, enrichment_type, config, checkpoint, task=task,
+                                       multiprocessing=multiprocessing, jobs=jobs)
                 elif enrichment_type == 'refined_formant_points':
                     from polyglotdb.acoustics.formants.refined import analyze_formant_points_refinement
                     duration_threshold = float(config.get('duration_threshold', 0.0)) / 1000
@@ -1030,15 +1039,14 @@ class Enrichment(models.Model):
                     vowel_prototypes_path = config.get('path', None)
                     output_tracks = config.get('output_tracks', False)
                     vowel_label = config.get('phone_class', 'vowel')
-                    metadata = analyze_formant_points_refinement(c, duration_threshold=duration_threshold,
-                                                                 num_iterations=nIterations,
-                                                                 vowel_label=vowel_label,
-                                                                 vowel_prototypes_path=vowel_prototypes_path,
-                                                                 output_tracks=output_tracks,
-                                                                 multiprocessing=False
-                                                                 )
-                elif enrichment_type == 'intensity':
-                    c.analyze_intensity(source=config.get('source', 'praat'), multiprocessing=False)
+                    with limit_jobs(jobs):
+                        metadata = analyze_formant_points_refinement(c, duration_threshold=duration_threshold,
+                                                                     num_iterations=nIterations,
+                                                                     vowel_label=vowel_label,
+                                                                     vowel_prototypes_path=vowel_prototypes_path,
+                                                                     output_tracks=output_tracks,
+                                                                     multiprocessing=multiprocessing
+                                                                     )
                 elif enrichment_type == 'relativize_property':
                     annotation_type = config.get('annotation_type')
                     property_name = config.get('property_name')
@@ -1051,10 +1059,11 @@ class Enrichment(models.Model):
                 elif enrichment_type == 'relativize_formants':
                     c.relativize_formants(by_speaker=config.get('by_speaker', True), by_phone=config.get('by_phone', True))
                 elif enrichment_type == 'praat_script':
-                    properties = c.analyze_script(annotation_type=config.get('annotation_type', 'phone'),
-                                                      subset=config.get('subset'), 
+                    with limit_jobs(jobs):
+                        properties = c.analyze_script(annotation_type=config.get('annotation_type', 'phone'),
+                                                      subset=config.get('subset'),
                                                       script_path=config.get('path'),
-                                                      multiprocessing=False)
+                                                      multiprocessing=multiprocessing)
                     config['properties'] = properties
                     self.config = config
                 elif enrichment_type == 'patterned_stress':
@@ -1064,24 +1073,30 @@ class Enrichment(models.Model):
                     c.enrich_tokens_with_csv(config.get('path'), config.get('annotation_type'), 
                             config.get('id_column'), properties=[x['name'] for x in columns if x['included']])
                 elif enrichment_type == 'vot':
-                    c.analyze_vot(stop_label=config.get('stop_label'),
-                            classifier=config.get('classifier', '/site/proj/PolyglotDB/tests/data/classifier/sotc_classifiers/sotc_voiceless.classifier'),
-                            vot_min=int(config.get('vot_min')),
-                            vot_max=int(config.get('vot_max')),
-                            overwrite_edited=config.get('overwrite_edited'),
-                            window_min=int(config.get('window_min')),
-                            window_max=int(config.get('window_max')))
+                    with limit_jobs(jobs):
+                        c.analyze_vot(stop_label=config.get('stop_label'),
+                                classifier=config.get('classifier', '/site/proj/PolyglotDB/tests/data/classifier/sotc_classifiers/sotc_voiceless.classifier'),
+                                vot_min=int(config.get('vot_min')),
+                                vot_max=int(config.get('vot_max')),
+                                overwrite_edited=config.get('overwrite_edited'),
+                                window_min=int(config.get('window_min')),
+                                window_max=int(config.get('window_max')))
+            checkpoint.clear()
             self.running = False
             self.completed = True
             self.last_run = datetime.datetime.now()
             self.save()
-            self.corpus.busy = False
+            self.corpus.bump_data_version()
+            materialize_catalog(self.corpus)
+            self.corpus.busy = keep_busy
             self.corpus.save()
         except Exception:
-            self.corpus.busy = False  # If it fails, don't stay busy and block everything
+            self.corpus.bump_data_version()
+            self.corpus.busy = keep_busy  # If it fails, don't stay busy and block everything
             self.corpus.save()
             self.running = False
             self.completed = False
+            self.save()
             print(traceback.format_exc())
 
 class BackgroundTask(models.Model):
@@ -1094,6 +1109,7 @@ class BackgroundTask(models.Model):
     failed = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     finished_at = models.DateTimeField(null=True, blank=True)
+    progress = models.TextField(blank=True, default='')
 
     class Meta:
         verbose_name_plural = 'Background Tasks'
@@ -1102,6 +1118,31 @@ class BackgroundTask(models.Model):
         result = AsyncResult(self.task_id)
         return result.result
 
+    def get_progress(self):
+        """
+        Get the state of each unit of work (i.e., export shards) that the task has reported
+        """
+        if not self.progress:
+            return {}
+        return json.loads(self.progress)
+
+    def set_progress(self, units, state='pending'):
+        self.progress = json.dumps({x: {'state': state} for x in units})
+        self.save(update_fields=['progress'])
+
+    def update_progress(self, unit, state, **kwargs):
+        progress = self.get_progress()
+        progress[unit] = dict(kwargs, state=state)
+        self.progress = json.dumps(progress)
+        self.save(update_fields=['progress'])
+
+    def progress_summary(self):
+        units = self.get_progress()
+        return {'total': len(units),
+                'completed': len([x for x in units.values() if x['state'] == 'done']),
+                'failed': len([x for x in units.values() if x['state'] == 'failed']),
+                'units': units}
+
     def status(self):
         return AsyncResult(self.task_id).status()
 
@@ -1138,6 +1179,7 @@ class Query(models.Model):
     corpus = models.ForeignKey(Corpus, on_delete=models.CASCADE)
     running = models.BooleanField(default=False)
     result_count = models.IntegerField(null=True, blank=True)
+    estimated_count = models.IntegerField(null=True, blank=True)
 
     class Meta:
         verbose_name_plural = 'Queries'
@@ -1156,76 +1198,61 @@ class Query(models.Model):
         with open(self.config_path, 'w') as f:
             json.dump(new_config, f)
 
+    def _load_results(self):
+        """
+        Make sure the result store is populated, converting results saved by older versions as a single JSON file
+        """
+        store = self.result_store
+        if store.exists:
+            return store
+        if os.path.exists(self.results_path):
+            with open(self.results_path, 'r') as f:
+                results = json.load(f)
+            store.write(results)
+            os.remove(self.results_path)
+        else:
+            self.run_query()
+            store.refresh()
+        if not store.exists:
+            return None
+        return store
+
     def resort(self, ordering):
-        if not hasattr(self, '_results'):
-            self._results = None
-            self._count = 0
-            if os.path.exists(self.results_path):
-                with open(self.results_path, 'r') as f:
-                    self._results = json.load(f)
-                self._count = len(self._results)
-            else:
-                self.run_query()
-        self._ordering = self.config.get('ordering', None)
-        if ordering != self._ordering and ordering:
-            ordering = ordering.replace(self.annotation_type.lower() + '.', '')
-            self._ordering = ordering
-
-            def order_function(input):
-                ordering = self._ordering.replace('-', '').split('.')
-                item = input
-                for o in ordering:
-                    item = item[o]
-                return item
-
-            self._results.sort(key=order_function, reverse=self._ordering.startswith('-'))
-            with open(self.results_path, 'w') as f:
-                json.dump(self._results, f)
+        if self.running:
+            # The running task applies the saved ordering once the results are complete
+            return
+        store = self._load_results()
+        if store is None or not ordering:
+            return
+        # Computes and caches the permutation for the new ordering ahead of the next page request
+        store.permutation(ordering)
 
     def get_results(self, ordering, limit, offset):
         if self.running:
+            # Serve the rows streamed so far in the order they were found, orderings apply once the query finishes
+            store = self.result_store
+            store.refresh()
+            if not store.exists:
+                return None
+            ordering = None
+        else:
+            store = self._load_results()
+        if store is None:
             return None
-        if not hasattr(self, '_results'):
-            self._results = None
-            self._count = 0
-            if os.path.exists(self.results_path):
-                with open(self.results_path, 'r') as f:
-                    self._results = json.load(f)
-                self._count = len(self._results)
-            else:
-                self.run_query()
-        if self._results is None:
-            return None
-        self._ordering = self.config.get('ordering', None)
-        if ordering != self._ordering and ordering:
-            with CorpusContext(self.corpus.config) as c:
-                self._ordering = ordering
-                ordering = self._ordering.replace('-', '').split('.')
-                att = None
-                for o in ordering:
-                    if att is None:
-                        att = getattr(c, o)
-                    else:
-                        att = getattr(att, o)
-
-                def order_function(input):
-                    item = input
-                    for o in ordering:
-                        if isinstance(item, list):
-                            if len(item):
-                                item = item[0]
-                            else:
-                                return att.value_type()()
-                        item = item[o]
-                        if item is None:
-                            return att.value_type()()
-                    return item
-
-                self._results.sort(key=order_function, reverse=self._ordering.startswith('-'))
+        if not ordering:
+            ordering = self.config.get('ordering', None)
+            # An ordering saved before the query was rerun may not be one of its columns any more
+            if ordering and not store.is_sortable(ordering.lstrip('-')):
+                ordering = None
+        if ordering and not self.running:
+            indices = store.permutation(ordering)
+        else:
+            indices = range(store.count)
         if limit is None or limit == 0:
-            res = self._results[offset:]
+            indices = indices[offset:]
         else:
-            res = self._results[offset:offset + limit]
+            indices = indices[offset:offset + limit]
+        res = store.get_rows(indices)
         ind = offset
         for r in res:
             r['index'] = ind
@@ -1253,7 +1280,7 @@ class Query(models.Model):
             raise Exception('Invalid operator "{}"'.format(operator))
         return filter
 
-    def generate_query_for_export(self, corpus_context):
+    def generate_query_for_export(self, corpus_context, ids=None):
         a_type = self.get_annotation_type_display().lower()
         config = self.config
         a = getattr(corpus_context, a_type)
@@ -1261,7 +1288,10 @@ class Query(models.Model):
         acoustic_tracks = config.get('acoustic_tracks', {})
         columns = config.get('columns', {})
         column_names = config.get('column_names', {})
-        q = self.generate_base_query(corpus_context)
+        if ids is None:
+            q = self.generate_base_query(corpus_context)
+        else:
+            q = corpus_context.query_graph(a).filter(a.id.in_(ids))
         for f_a_type, position_columns in columns.items():
             for position, a_columns in position_columns.items():
                 if not a_columns:
@@ -1481,154 +1511,492 @@ class Query(models.Model):
                         q = q.filter(getattr(ann, 'end') == getattr(getattr(current_ann, right_aligned_filter), 'end'))
         return q
 
-    def run_query(self):
+    def _result_batches(self, q, a):
+        """
+        Generate batches of results for a query, one split query (i.e., speaker) at a time and paged by
+        POLYGLOT_QUERY_BATCH_SIZE rows, so that only a single batch needs to be held in memory
+
+        Pages are keyed on annotation IDs: each batch is the next rows with IDs after the last one seen, so Neo4j
+        doesn't match and skip all the earlier rows again for every batch.
+        """
+        batch_size = getattr(settings, 'POLYGLOT_QUERY_BATCH_SIZE', 5000)
+        if not batch_size:
+            yield q.all()
+            return
+        for split_q in q.split_queries():
+            split_q = split_q.order_by(a.id).limit(batch_size)
+            if split_q._columns:
+                # Rows of column queries only have the columns asked for, so the ID is returned without being exported
+                split_q._hidden_columns.append(a.id.column_name(KEYSET_COLUMN))
+            after = None
+            while True:
+                res = split_q.all()
+                if not len(res):
+                    break
+                yield res
+                if len(res) < batch_size:
+                    break
+                last = res[len(res) - 1]
+                last_id = last[KEYSET_COLUMN] if split_q._columns else last.id
+                if after is None:
+                    after = a.id > last_id
+                    # Kept apart from the parameter of any filter on the ID already in the query
+                    after.value_alias_prefix = 'keyset_'
+                    split_q = split_q.filter(after)
+                else:
+                    after.value = last_id
+
+    def _estimate_count(self):
+        """
+        Count the query's results on a separate connection, so that an estimate is available while the results are
+        being fetched
+        """
+        from django.db import connection
+        try:
+            with CorpusContext(self.corpus.config) as c:
+                count = self.generate_base_query(c).count()
+            Query.objects.filter(pk=self.pk, running=True).update(estimated_count=count)
+        except Exception:
+            log.exception('Could not estimate the result count for query {}'.format(self.pk))
+        finally:
+            connection.close()
+
+    def requested_tracks(self, config=None):
+        """
+        Get the acoustic tracks to include in the results and how to generate them
+        """
+        if config is None:
+            config = self.config
+        tracks = {}
+        if not config.get('cache_acoustics', False):
+            return tracks
+        for a_column, props in config.get('acoustic_columns', {}).items():
+            if not props.get('include', False):
+                continue
+            tracks[a_column] = {'relative_time': props.get('relative_time', False),
+                                'relative_track': props.get('relative_track', False),
+                                'num_points': props.get('num_points', '')}
+        return tracks
+
+    @staticmethod
+    def _acoustic_track(a, a_column, props):
+        acoustic = getattr(a, a_column)
+        acoustic.relative_time = props['relative_time']
+        acoustic.relative = props['relative_track']
+        try:
+            num_points = int(props['num_points'])
+            acoustic = acoustic.interpolated_track
+            acoustic.num_points = num_points
+        except (TypeError, ValueError):
+            acoustic = acoustic.track
+        return acoustic
+
+    def _match_config(self, hierarchy):
+        config = self.config
+        return {'corpus': self.corpus.pk,
+                'data_version': self.corpus.data_version,
+                'hierarchy': hierarchy_fingerprint(hierarchy),
+                'annotation_type': self.annotation_type,
+                'filters': config['filters'],
+                'positions': config['positions']}
+
+    def match_key(self, hierarchy):
+        """
+        Key identifying the set of annotations matched by this query, which stays the same when only the columns or
+        acoustic tracks change
+        """
+        data = self._match_config(hierarchy)
+        return hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf8')).hexdigest()
+
+    def result_cache_key(self, hierarchy):
+        """
+        Key identifying this query's results in the result cache, based on the parts of the query config that determine
+        the results and the current versions of the corpus data and hierarchy
+        """
+        data = self._match_config(hierarchy)
+        data['tracks'] = self.requested_tracks()
+        return hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf8')).hexdigest()
+
+    def matched_ids(self, corpus_context):
+        """
+        Get the IDs of the annotations matched by the last run of the query, or None if the stored results are out of
+        date
+        """
+        store = self.result_store
+        store.refresh()
+        if self.running or not store.exists or store.meta.get('match_key') != self.match_key(corpus_context.hierarchy):
+            return None
+        a_type = self.get_annotation_type_display().lower()
+        return [x for x in store.column_values((a_type, 'current', 'id')) if x is not None]
+
+    def _materialize_results(self, c, store):
+        from .serializers import compile_serializer
+        a_type = self.get_annotation_type_display().lower()
+        config = self.config
+        a = getattr(c, a_type)
+        q = self.generate_base_query(c)
+        if getattr(settings, 'POLYGLOT_QUERY_ESTIMATE_COUNT', False):
+            threading.Thread(target=self._estimate_count, daemon=True).start()
+        q = q.preload(getattr(a, 'discourse'), getattr(a, 'speaker'))
+        acoustic_column_names = []
+        for a_column, props in self.requested_tracks(config).items():
+            q = q.preload_acoustics(self._acoustic_track(a, a_column, props))
+            acoustic_column_names.append(a_column)
+        for t in c.hierarchy.annotation_types:
+            if t in c.hierarchy.subannotations:
+                for s in c.hierarchy.subannotations[t]:
+                    if t == a_type:
+                        q = q.preload(getattr(a, s))
+                    else:
+                        q = q.preload(getattr(getattr(a, t), s))
+        for t in c.hierarchy.get_higher_types(a_type):
+            q = q.preload(getattr(a, t))
+        positions = config['positions']
+        for f_a_type, pos in positions.items():
+            for position in pos:
+                if position == 'current':
+                    continue
+                if f_a_type == a_type:
+                    ann = a
+                else:
+                    ann = getattr(a, f_a_type)
+                position = position.split('_')
+                for p in position:
+                    ann = getattr(ann, p)
+                q = q.preload(ann)
+        serialize = compile_serializer(c.hierarchy, a_type, positions=positions, top_level=True,
+                                       acoustic_columns=acoustic_column_names, detail=False,
+                                       with_higher_annotations=True,
+                                       with_subannotations=True)
+        for res in self._result_batches(q, a):
+            store.append([serialize(x) for x in res])
+            Query.objects.filter(pk=self.pk).update(result_count=store.count)
+
+    def run_query(self, task=None):
         self.running = True
         self.result_count = None
+        self.estimated_count = None
         self.save()
-        from .serializers import serializer_factory
-        while os.path.exists(self.lockfile_path):
-            pass
-        with open(self.lockfile_path, 'w') as f:
-            pass
-        if os.path.exists(self.results_path):
-            os.remove(self.results_path)
+        lock = self._acquire_lock(task, 'run')
+        if lock is None:
+            return
         try:
-            a_type = self.get_annotation_type_display().lower()
-            config = self.config
-            acoustic_columns = config.get('acoustic_columns', {})
-            cache_acoustics = config.get('cache_acoustics', False)
+            if os.path.exists(self.results_path):
+                os.remove(self.results_path)
+            store = self.result_store
+            store.reset()
+            result_cache = get_result_cache()
             with CorpusContext(self.corpus.config) as c:
-                a = getattr(c, a_type)
-                q = self.generate_base_query(c)
-                self._count = q.count()
-                q = q.preload(getattr(a, 'discourse'), getattr(a, 'speaker'))
-                acoustic_column_names = []
-                if cache_acoustics:
-                    for a_column, props in acoustic_columns.items():
-                        # track props
-                        include_track = props.pop('include', False)
-                        relative_time = props.pop('relative_time', False)
-                        relative_track = props.pop('relative_track', False)
-                        num_points = props.pop('num_points', '')
-                        if include_track:
-                            acoustic = getattr(a, a_column)
-                            acoustic.relative_time = relative_time
-                            acoustic.relative = relative_track
-                            try:
-                                num_points = int(num_points)
-                                acoustic = acoustic.interpolated_track
-                                acoustic.num_points = num_points
-                            except ValueError:
-                                acoustic = acoustic.track
-                            q = q.preload_acoustics(acoustic)
-                            acoustic_column_names.append(a_column)
-                for t in c.hierarchy.annotation_types:
-                    if t in c.hierarchy.subannotations:
-                        for s in c.hierarchy.subannotations[t]:
-                            if t == a_type:
-                                q = q.preload(getattr(a, s))
-                            else:
-                                q = q.preload(getattr(getattr(a, t), s))
-                for t in c.hierarchy.get_higher_types(a_type):
-                    q = q.preload(getattr(a, t))
-                positions = config['positions']
-                for f_a_type, pos in positions.items():
-                    for position in pos:
-                        if position == 'current':
-                            continue
-                        if f_a_type == a_type:
-                            ann = a
-                        else:
-                            ann = getattr(a, f_a_type)
-                        position = position.split('_')
-                        for p in position:
-                            ann = getattr(ann, p)
-                        q = q.preload(ann)
-                res = q.all()
-                serializer_class = serializer_factory(c.hierarchy, a_type, positions=positions, top_level=True,
-                                                      acoustic_columns=acoustic_column_names, detail=False,
-                                                      with_higher_annotations=True,
-                                                      with_subannotations=True)
-                serializer = serializer_class(res, many=True)
-
-                self._results = serializer.data
+                cache_key = self.result_cache_key(c.hierarchy)
+                if result_cache is None or not result_cache.restore(cache_key, store.directory):
+                    self._materialize_results(c, store)
+                    if result_cache is not None:
+                        result_cache.add(cache_key, store.directory, self.corpus.pk)
+                store.refresh()
+                store.update_meta(match_key=self.match_key(c.hierarchy), tracks=self.requested_tracks())
+                self.result_count = store.count
+                self.estimated_count = store.count
                 ordering = self.config.get('ordering', None)
-                if ordering:
-                    ordering = ordering.replace(self.annotation_type.lower() + '.', '')
-                    self._ordering = ordering
-
-                    def order_function(input):
-                        ordering = self._ordering.replace('-', '').split('.')
-                        item = input
-                        for o in ordering:
-                            if isinstance(item, list):
-                                item = item[0]
-                            item = item[o]
-                        return item
-
-                    self._results.sort(key=order_function, reverse=self._ordering.startswith('-'))
-                with open(self.results_path, 'w') as f:
-                    json.dump(self._results, f)
-
-                self.result_count = len(self._results)
+                if ordering and store.is_sortable(ordering.lstrip('-')):
+                    store.permutation(ordering)
         except:
             raise
         finally:
-            os.remove(self.lockfile_path)
-            self.running = False
+            lock.release()
+            self.running = lock.has_pending()
+            self.save()
+
+    def _update_tracks(self, c, store):
+        from .serializers import compile_serializer, ACOUSTIC_TRACK_FIELDS
+        a_type = self.get_annotation_type_display().lower()
+        a = getattr(c, a_type)
+        config = self.config
+        positions = config['positions'][a_type]
+        requested = self.requested_tracks(config)
+        current = store.meta.get('tracks', {})
+        changed = {k: v for k, v in requested.items() if current.get(k) != v}
+        for a_column in current:
+            if (a_column not in requested or a_column in changed) and a_column in ACOUSTIC_TRACK_FIELDS:
+                for position in positions:
+                    store.remove_columns((a_type, position, ACOUSTIC_TRACK_FIELDS[a_column]))
+        fields = [ACOUSTIC_TRACK_FIELDS[x] for x in changed if x in ACOUSTIC_TRACK_FIELDS]
+        if fields:
+            ids = {p: store.column_values((a_type, p, 'id')) for p in positions}
+            serialize = compile_serializer(c.hierarchy, a_type, acoustic_columns=list(changed))
+            batch_size = getattr(settings, 'POLYGLOT_QUERY_BATCH_SIZE', 5000) or store.count
+
+            def track_values():
+                for begin in range(0, store.count, batch_size):
+                    batch_ids = {p: ids[p][begin:begin + batch_size] for p in positions}
+                    wanted = set(x for v in batch_ids.values() for x in v if x is not None)
+                    found = {}
+                    if wanted:
+                        q = c.query_graph(a).filter(a.id.in_(sorted(wanted)))
+                        for a_column, props in changed.items():
+                            q = q.preload_acoustics(self._acoustic_track(a, a_column, props))
+                        for r in q.all():
+                            found[r.id] = serialize(r)
+                    for i in range(len(batch_ids[positions[0]])):
+                        row = []
+                        for field in fields:
+                            for p in positions:
+                                a_id = batch_ids[p][i]
+                                row.append(MISSING if a_id is None else found.get(a_id, {}).get(field, None))
+                        yield row
+
+            store.set_columns([(a_type, p, field) for field in fields for p in positions], track_values())
+        store.update_meta(tracks=requested)
+
+    def update_tracks(self, task=None):
+        """
+        Bring the acoustic tracks in the stored results in line with the query config, fetching only the newly requested
+        tracks for the previously matched annotations rather than re-running the query
+        """
+        self.running = True
+        self.save()
+        lock = self._acquire_lock(task, 'tracks')
+        if lock is None:
+            return
+        rerun = False
+        try:
+            store = self.result_store
+            store.refresh()
+            with CorpusContext(self.corpus.config) as c:
+                if not store.exists or store.meta.get('match_key') != self.match_key(c.hierarchy):
+                    rerun = True
+                else:
+                    self._update_tracks(c, store)
+                    result_cache = get_result_cache()
+                    if result_cache is not None:
+                        result_cache.add(self.result_cache_key(c.hierarchy), store.directory, self.corpus.pk)
+                    ordering = self.config.get('ordering', None)
+                    if ordering:
+                        store.permutation(ordering)
+        finally:
+            lock.release()
+            self.running = rerun or lock.has_pending()
             self.save()
+        if rerun:
+            self.run_query(task)
 
-    def generate_subset(self):
+    def generate_subset(self, task=None):
         self.running = True
         config = self.config
         config['subset_encoded'] = False
         self.config = config
         self.save()
-        while os.path.exists(self.lockfile_path):
-            pass
-        with open(self.lockfile_path, 'w') as f:
-            pass
+        subset_name = config["subset_name"]
+        # Only runs creating the same subset are coalesced, a run for another subset doesn't produce this one
+        queue = 'subset-{}'.format(hashlib.sha1(subset_name.encode('utf8')).hexdigest())
+        lock = self._acquire_lock(task, queue)
+        if lock is None:
+            return
         try:
             begin = time.time()
             with CorpusContext(self.corpus.config) as c:
                 q = self.generate_query_for_export(c)
-                q.create_subset(config["subset_name"])
+                q.create_subset(subset_name)
                 c.encode_hierarchy()
+            self.corpus.bump_data_version()
             config = self.config
             config['subset_encoded'] = True
             self.config = config
         except:
             raise
         finally:
-            os.remove(self.lockfile_path)
+            lock.release()
+            self.running = lock.has_pending()
+            self.save()
+
+    def lock(self, task=None, queue=None):
+        """
+        Get a lock for operations on this query's data, coalescing queued runs of the same operation if queue is
+        specified
+        """
+        queue_path = None
+        if queue is not None:
+            queue_path = os.path.join(self.directory, '{}.queue'.format(queue))
+        return TaskLock(self.lockfile_path, task_id=task.pk if task is not None else None,
+                        timeout=getattr(settings, 'POLYGLOT_QUERY_LOCK_TIMEOUT', None), queue_path=queue_path)
+
+    def _acquire_lock(self, task, queue):
+        lock = self.lock(task, queue)
+        try:
+            acquired = lock.acquire()
+        except LockTimeout:
             self.running = False
             self.save()
+            raise
+        if not acquired:
+            # A newer queued run will take care of it
+            return None
+        return lock
+
+    def _export_batches(self, c):
+        """
+        Generate batches of results for the export, from the annotations already matched by the query if the stored
+        results are up to date, otherwise by matching them again
+        """
+        ids = self.matched_ids(c)
+        if ids is not None:
+            batch_size = getattr(settings, 'POLYGLOT_QUERY_BATCH_SIZE', 5000) or max(len(ids), 1)
+            for begin in range(0, len(ids), batch_size):
+                yield self.generate_query_for_export(c, ids=ids[begin:begin + batch_size]).all()
+        else:
+            a = getattr(c, self.get_annotation_type_display().lower())
+            yield from self._result_batches(self.generate_query_for_export(c), a)
+
+    def _export_shards(self, c):
+        """
+        Split the export into shards that can be run independently, either batches of the annotations already matched
+        by the query, or one per speaker or discourse
+        """
+        ids = self.matched_ids(c)
+        if ids is not None:
+            batch_size = getattr(settings, 'POLYGLOT_QUERY_BATCH_SIZE', 5000) or max(len(ids), 1)
+            return [('rows {}-{}'.format(begin, min(begin + batch_size, len(ids)) - 1),
+                     {'ids': ids[begin:begin + batch_size]})
+                    for begin in range(0, len(ids), batch_size)]
+        shard_by = self.config.get('export_shard_by', getattr(settings, 'POLYGLOT_EXPORT_SHARD_BY', 'speaker'))
+        if shard_by == 'discourse':
+            names = c.discourses
+        else:
+            shard_by = 'speaker'
+            names = c.speakers
+        return [('{} {}'.format(shard_by, name), {shard_by: name}) for name in sorted(names)]
+
+    def _export_shard(self, shard, path, export_format):
+        """
+        Export a single shard to its own file, on its own connection to the database
+        """
+        with CorpusContext(self.corpus.config) as c:
+            a = getattr(c, self.get_annotation_type_display().lower())
+            if 'ids' in shard:
+                batches = [self.generate_query_for_export(c, ids=shard['ids']).all()]
+            else:
+                q = self.generate_query_for_export(c)
+                for shard_by, name in shard.items():
+                    q = q.filter(getattr(a, shard_by).name == name)
+                    # Split on the shard's own attribute, so the shard is a single query rather than one per speaker
+                    q.splitter = shard_by
+                batches = self._result_batches(q, a)
+            if export_format == 'parquet':
+                write_parquet(batches, path)
+            else:
+                with open(path, 'w', newline='', encoding='utf8') as f:
+                    writer = csv.writer(f)
+                    for i, res in enumerate(batches):
+                        res.to_csv(writer, mode='w' if i == 0 else 'a')
+        return path
 
-    def export_query(self):
+    def _export_parallel(self, c, export_format, workers, task=None):
+        """
+        Export shards of the query on a pool of workers, then merge the shard files in shard order
+        """
+        shards = self._export_shards(c)
+        shard_directory = os.path.join(self.directory, 'export_shards')
+        shutil.rmtree(shard_directory, ignore_errors=True)
+        os.makedirs(shard_directory)
+        extension = 'parquet' if export_format == 'parquet' else 'csv'
+        paths = [os.path.join(shard_directory, '{}.{}'.format(i, extension)) for i in range(len(shards))]
+        if task is not None:
+            task.set_progress([name for name, shard in shards])
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {}
+                for (name, shard), path in zip(shards, paths):
+                    futures[executor.submit(self._export_shard, shard, path, export_format)] = name
+                for future in concurrent.futures.as_completed(futures):
+                    name = futures[future]
+                    try:
+                        future.result()
+                    except Exception:
+                        if task is not None:
+                            task.update_progress(name, 'failed')
+                        for f in futures:
+                            f.cancel()
+                        raise
+                    if task is not None:
+                        task.update_progress(name, 'done')
+            if export_format == 'parquet':
+                temp_path = self.export_parquet_path + '.tmp'
+                merge_parquet(paths, temp_path)
+                os.replace(temp_path, self.export_parquet_path)
+            else:
+                with open(self.export_path, 'wb') as out:
+                    header_written = False
+                    for path in paths:
+                        with open(path, 'rb') as f:
+                            header = f.readline()
+                            if not header:
+                                continue
+                            if not header_written:
+                                out.write(header)
+                                header_written = True
+                            shutil.copyfileobj(f, out)
+        finally:
+            shutil.rmtree(shard_directory, ignore_errors=True)
+
+    def stream_export(self):
+        """
+        Generate the export CSV in chunks of text straight from the database, one batch of results at a time, without
+        writing it to disk first
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        with CorpusContext(self.corpus.config) as c:
+            for i, res in enumerate(self._export_batches(c)):
+                res.to_csv(writer, mode='w' if i == 0 else 'a')
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+    def export_query(self, task=None):
         self.running = True
         config = self.config
         config['export_available'] = False
         self.config = config
         self.save()
-        while os.path.exists(self.lockfile_path):
-            pass
-        with open(self.lockfile_path, 'w') as f:
-            pass
+        lock = self._acquire_lock(task, 'export')
+        if lock is None:
+            return
         try:
-            with CorpusContext(self.corpus.config) as c, open(self.export_path, 'w', newline='', encoding='utf8') as f:
-                q = self.generate_query_for_export(c)
-                writer = csv.writer(f)
-                q.to_csv(writer)
+            export_format = self.config.get('export_format', 'csv')
+            workers = getattr(settings, 'POLYGLOT_EXPORT_WORKERS', 1)
+            with CorpusContext(self.corpus.config) as c:
+                if workers > 1:
+                    self._export_parallel(c, export_format, workers, task)
+                elif export_format == 'parquet':
+                    temp_path = self.export_parquet_path + '.tmp'
+                    write_parquet(self._export_batches(c), temp_path)
+                    os.replace(temp_path, self.export_parquet_path)
+                else:
+                    with open(self.export_path, 'w', newline='', encoding='utf8') as f:
+                        writer = csv.writer(f)
+                        for i, res in enumerate(self._export_batches(c)):
+                            res.to_csv(writer, mode='w' if i == 0 else 'a')
             config = self.config
             config['export_available'] = True
             self.config = config
         except:
             raise
         finally:
-            os.remove(self.lockfile_path)
-            self.running = False
+            lock.release()
+            self.running = lock.has_pending()
             self.save()
 
+    def prefetch_detail(self, index, ordering='', with_subannotations=True):
+        """
+        Prepare the detail view for the results after the window around an index, so that stepping on to them doesn't
+        wait on the graph database or on audio processing
+        """
+        from .detail import prefetch_detail_window
+        if self.running:
+            return
+        with CorpusContext(self.corpus.config) as c:
+            prefetch_detail_window(self, c, index, ordering, with_subannotations,
+                                   codec=getattr(settings, 'POLYGLOT_AUDIO_CODEC', 'wav'))
+
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
         super(Query, self).save(force_insert, force_update, using, update_fields)
@@ -1656,6 +2024,20 @@ class Query(models.Model):
     def results_path(self):
         return os.path.join(self.directory, 'results.txt')
 
+    @property
+    def results_directory(self):
+        return os.path.join(self.directory, 'results')
+
+    @property
+    def result_store(self):
+        if not hasattr(self, '_result_store'):
+            self._result_store = QueryResultStore(self.results_directory)
+        return self._result_store
+
     @property
     def export_path(self):
         return os.path.join(self.directory, '{}_export.csv'.format(self.name))
+
+    @property
+    def export_parquet_path(self):
+        return os.path.join(self.directory, '{}_export.parquet'.format(self.name))
@@ -0,0 +1,133 @@
+import os
+import math
+import threading
+import contextlib
+import multiprocessing
+
+from django.conf import settings
+
+# Memory a single acoustic analysis job is assumed to need (audio segments plus a Praat/REAPER process)
+DEFAULT_JOB_MEMORY = 512 * 1024 * 1024
+
+# Core counts set by limit_jobs for each thread, and how many threads are using them
+_local = threading.local()
+_install_lock = threading.Lock()
+_limit_users = 0
+_original_cpu_count = None
+
+
+def available_memory():
+    """
+    Get the memory available for new processes in bytes, or None if it cannot be determined
+    """
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def worker_concurrency():
+    """
+    Number of Celery tasks that may be running on this server at once, all of which may be running enrichments
+
+    Taken from CELERY_WORKER_CONCURRENCY or the Celery app's configuration, and otherwise Celery's own default of one
+    worker process per core
+    """
+    concurrency = getattr(settings, 'CELERY_WORKER_CONCURRENCY', None)
+    if not concurrency:
+        from celery import current_app
+        concurrency = current_app.conf.worker_concurrency
+    if not concurrency:
+        concurrency = os.cpu_count()
+    return max(int(concurrency or 1), 1)
+
+
+def can_fork():
+    """
+    Check whether the current process can start a process pool.  Celery's prefork workers are daemonic, and daemonic
+    processes are not allowed to have children.
+    """
+    if multiprocessing.current_process().daemon:
+        return False
+    try:
+        import billiard
+    except ImportError:
+        return True
+    return not billiard.current_process().daemon
+
+
+def enrichment_jobs(requested=None):
+    """
+    Work out how many jobs an acoustic enrichment should run in parallel
+
+    The server's budget is POLYGLOT_ENRICHMENT_JOBS (three quarters of the cores by default), shared between all Celery
+    worker processes, and further limited so that every job fits in the available memory
+    (POLYGLOT_ENRICHMENT_JOB_MEMORY bytes each).  An enrichment can ask for fewer jobs but not more.
+
+    :param requested: int, optional
+        Number of jobs configured for the enrichment
+    :return: int
+    """
+    jobs = getattr(settings, 'POLYGLOT_ENRICHMENT_JOBS', None)
+    if not jobs:
+        jobs = int(0.75 * multiprocessing.cpu_count())
+    jobs = jobs // worker_concurrency()
+    try:
+        requested = int(requested)
+    except (TypeError, ValueError):
+        requested = None
+    if requested:
+        jobs = min(jobs, requested)
+    memory = available_memory()
+    if memory is not None:
+        jobs = min(jobs, memory // getattr(settings, 'POLYGLOT_ENRICHMENT_JOB_MEMORY', DEFAULT_JOB_MEMORY))
+    return max(int(jobs), 1)
+
+
+def use_multiprocessing(jobs):
+    """
+    Whether an enrichment with this many jobs should use a process pool rather than threads
+    """
+    return jobs > 1 and getattr(settings, 'POLYGLOT_ENRICHMENT_MULTIPROCESSING', True) and can_fork()
+
+
+def _limited_cpu_count():
+    cores = getattr(_local, 'cores', None)
+    if cores is None:
+        return _original_cpu_count()
+    return cores
+
+
+@contextlib.contextmanager
+def limit_jobs(jobs):
+    """
+    Limit the number of jobs PolyglotDB's acoustic analyses run at once in the current thread
+
+    Only needed for analyses that PolyglotDB runs itself, since it doesn't pass a job count through to conch, which
+    sizes its pool as three quarters of ``cpu_count()``.  While any thread is inside this context, conch's
+    ``cpu_count`` is replaced by one that returns the core count set for the calling thread (or the real one for
+    threads that haven't set any), so enrichments running at the same time each get their own limit and none of
+    them waits on another.
+    """
+    global _original_cpu_count, _limit_users
+    import conch.main
+    with _install_lock:
+        if _limit_users == 0:
+            _original_cpu_count = conch.main.cpu_count
+            conch.main.cpu_count = _limited_cpu_count
+        _limit_users += 1
+    previous = getattr(_local, 'cores', None)
+    _local.cores = int(math.ceil(jobs * 4 / 3))
+    try:
+        yield jobs
+    finally:
+        _local.cores = previous
+        with _install_lock:
+            _limit_users -= 1
+            if _limit_users == 0:
+                conch.main.cpu_count = _original_cpu_count
+                _original_cpu_count = None
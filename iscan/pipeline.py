@@ -0,0 +1,242 @@
+import collections
+import concurrent.futures
+import logging
+
+from django.db import connection
+
+log = logging.getLogger(__name__)
+
+Requirement = collections.namedtuple('Requirement', ['kind', 'annotation_type', 'label', 'message'])
+
+# Enrichments that analyze audio or work on InfluxDB measurements, which can run alongside enrichments that only
+# update the graph
+ACOUSTIC_ENRICHMENTS = {'pitch', 'formants', 'intensity', 'refined_formant_points', 'praat_script', 'vot',
+                        'relativize_pitch', 'relativize_intensity', 'relativize_formants'}
+
+
+def requirements(config):
+    """
+    Get what has to be encoded in a corpus before an enrichment can run, as checked by
+    :attr:`~iscan.models.Enrichment.runnable`
+
+    :param config: dict
+        Enrichment config
+    :return: list of :class:`Requirement`
+    """
+    enrichment_type = config.get('enrichment_type')
+    if enrichment_type == 'subset':
+        annotation_type = config.get('annotation_type')
+        return [Requirement('annotation', annotation_type, None, 'Must encode {}'.format(annotation_type))]
+    elif enrichment_type == 'syllables':
+        label = config.get('phone_class', 'syllabic')
+        return [Requirement('type_subset', 'phone', label, 'Must encode {}'.format(label))]
+    elif enrichment_type == 'refined_formant_points':
+        label = config.get('phone_class', 'vowel')
+        return [Requirement('type_subset', 'phone', label, 'Must encode {}'.format(label))]
+    elif enrichment_type == 'utterances':
+        return [Requirement('token_subset', 'word', 'pause', 'Must encode pauses')]
+    elif enrichment_type in ('vot', 'pitch', 'formants', 'intensity'):
+        # Acoustic analyses run over utterances
+        return [Requirement('annotation', 'utterance', None, 'Must encode utterances')]
+    elif enrichment_type == 'hierarchical_property':
+        higher_annotation = config.get('higher_annotation')
+        lower_annotation = config.get('lower_annotation')
+        message = 'Must encode {} and {}'.format(higher_annotation, lower_annotation)
+        return [Requirement('annotation', higher_annotation, None, message),
+                Requirement('annotation', lower_annotation, None, message)]
+    elif enrichment_type == 'patterned_stress':
+        return [Requirement('annotation', 'syllable', None, 'Must encode syllables')]
+    elif enrichment_type in ('relativize_pitch', 'relativize_intensity', 'relativize_formants'):
+        measure = enrichment_type.replace('relativize_', '')
+        return [Requirement('acoustic', measure, None, 'Must encode {}'.format(measure))]
+    return []
+
+
+def provides(config):
+    """
+    Get what an enrichment encodes in a corpus, in the same terms as :func:`requirements`
+
+    :param config: dict
+        Enrichment config
+    :return: set of tuple
+    """
+    enrichment_type = config.get('enrichment_type')
+    if enrichment_type == 'subset':
+        return {('type_subset', config.get('annotation_type'), config.get('subset_label'))}
+    elif enrichment_type == 'pauses':
+        return {('token_subset', 'word', 'pause')}
+    elif enrichment_type == 'utterances':
+        return {('annotation', 'utterance', None)}
+    elif enrichment_type == 'syllables':
+        return {('annotation', 'syllable', None)}
+    elif enrichment_type in ('pitch', 'formants', 'intensity'):
+        return {('acoustic', enrichment_type, None)}
+    elif enrichment_type == 'refined_formant_points' and config.get('output_tracks', False):
+        return {('acoustic', 'formants', None)}
+    return set()
+
+
+def is_satisfied(requirement, hierarchy):
+    if requirement.kind == 'annotation':
+        return requirement.annotation_type in hierarchy.annotation_types
+    elif requirement.kind == 'type_subset':
+        return hierarchy.has_type_subset(requirement.annotation_type, requirement.label)
+    elif requirement.kind == 'token_subset':
+        return hierarchy.has_token_subset(requirement.annotation_type, requirement.label)
+    elif requirement.kind == 'acoustic':
+        return requirement.annotation_type in hierarchy.acoustics
+    return True
+
+
+def lane(config):
+    """
+    Get which lane an enrichment runs in, at most one enrichment runs in each lane at a time
+    """
+    if config.get('enrichment_type') in ACOUSTIC_ENRICHMENTS:
+        return 'acoustic'
+    return 'graph'
+
+
+def build_graph(configs):
+    """
+    Work out which enrichments have to finish before each one can run
+
+    :param configs: dict
+        Enrichment configs keyed by enrichment
+    :return: dict
+        Set of enrichments each enrichment depends on
+    :raises ValueError: if the enrichments depend on each other in a cycle
+    """
+    provided = {key: provides(config) for key, config in configs.items()}
+    graph = {}
+    for key, config in configs.items():
+        needed = {tuple(x[:3]) for x in requirements(config)}
+        graph[key] = {other for other, p in provided.items() if other != key and needed & p}
+    order = topological_order(graph)
+    if len(order) != len(graph):
+        raise ValueError('The enrichments depend on each other in a cycle: {}'.format(
+            ', '.join(str(x) for x in graph if x not in order)))
+    return graph
+
+
+def topological_order(graph):
+    """
+    Order the nodes of a dependency graph so that every node comes after its dependencies, leaving out nodes in cycles
+    """
+    remaining = {k: set(v) for k, v in graph.items()}
+    order = []
+    ready = [k for k, v in remaining.items() if not v]
+    while ready:
+        key = ready.pop(0)
+        order.append(key)
+        for other, deps in remaining.items():
+            if key in deps:
+                deps.remove(key)
+                if not deps:
+                    ready.append(other)
+    return order
+
+
+class EnrichmentPipeline(object):
+    """
+    Run a set of enrichments for a corpus in dependency order, with independent graph and acoustic enrichments running
+    at the same time
+
+    An enrichment that fails, or whose requirements are still not met once its dependencies have run, stops the
+    enrichments that depend on it, while unrelated enrichments carry on.
+    """
+
+    def __init__(self, corpus, enrichments, task=None):
+        self.corpus = corpus
+        self.enrichments = {x.pk: x for x in enrichments}
+        self.configs = {pk: x.config for pk, x in self.enrichments.items()}
+        self.graph = build_graph(self.configs)
+        self.order = topological_order(self.graph)
+        self.task = task
+        self.states = {pk: 'pending' for pk in self.enrichments}
+
+    def _unit(self, pk):
+        return '{}: {}'.format(pk, self.enrichments[pk].name)
+
+    def _set_state(self, pk, state, **kwargs):
+        self.states[pk] = state
+        if self.task is not None:
+            self.task.update_progress(self._unit(pk), state, **kwargs)
+
+    def _run(self, pk):
+        enrichment = self.enrichments[pk]
+        try:
+            runnable = enrichment.runnable
+            if runnable != 'runnable':
+                return runnable
+            enrichment.run_enrichment(keep_busy=True)
+            enrichment.refresh_from_db()
+            if not enrichment.completed:
+                return 'The enrichment failed'
+            return None
+        finally:
+            connection.close()
+
+    def ready(self, running_lanes):
+        """
+        Get the pending enrichments whose dependencies are done, at most one per lane not already in use
+        """
+        ready = []
+        for pk in self.order:
+            if self.states[pk] != 'pending':
+                continue
+            deps = self.graph[pk]
+            if any(self.states[x] in ('failed', 'skipped') for x in deps):
+                self._set_state(pk, 'skipped', message='A prerequisite enrichment did not complete')
+                continue
+            if all(self.states[x] == 'done' for x in deps):
+                ready.append(pk)
+        selected = []
+        for pk in ready:
+            pk_lane = lane(self.configs[pk])
+            if pk_lane not in running_lanes:
+                running_lanes.add(pk_lane)
+                selected.append(pk)
+        return selected
+
+    def run(self):
+        """
+        Run the enrichments, returning once all of them have completed, failed or been skipped
+
+        :return: dict
+            Final state of each enrichment
+        """
+        if self.task is not None:
+            self.task.set_progress([self._unit(pk) for pk in self.order])
+        self.corpus.busy = True
+        self.corpus.save()
+        try:
+            self._run_all()
+        finally:
+            self.corpus.refresh_from_db()
+            self.corpus.busy = False
+            self.corpus.save()
+        return self.states
+
+    def _run_all(self):
+        running = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            while True:
+                lanes = {lane(self.configs[pk]) for pk in running.values()}
+                for pk in self.ready(lanes):
+                    self._set_state(pk, 'running')
+                    running[executor.submit(self._run, pk)] = pk
+                if not running:
+                    break
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    pk = running.pop(future)
+                    try:
+                        message = future.result()
+                    except Exception as e:
+                        log.exception('Enrichment {} failed'.format(self._unit(pk)))
+                        message = str(e)
+                    if message is None:
+                        self._set_state(pk, 'done')
+                    else:
+                        self._set_state(pk, 'failed', message=message)
@@ -0,0 +1,365 @@
+import os
+import re
+import json
+import math
+import shutil
+import hashlib
+import logging
+
+import numpy as np
+from django.conf import settings
+from django.utils.http import quote_etag
+
+from .locks import TaskLock
+
+log = logging.getLogger(__name__)
+
+# Each level of a pyramid is this many times coarser in time than the one below it
+LEVEL_FACTOR = 4
+# Coarser waveform levels are added until a level would have fewer buckets than this
+WAVEFORM_MIN_BUCKETS = 512
+# Number of frames in a spectrogram tile
+TILE_FRAMES = 256
+DEFAULT_SPECTROGRAM_TIME_STEP = 0.005
+# Window settings matching PolyglotDB's spectrograms
+SPECTROGRAM_N_FFT = 256
+SPECTROGRAM_WINDOW_LENGTH = 0.005
+# Power range in dB below the loudest frame that is kept when spectrograms are quantized to 8 bits
+SPECTROGRAM_DYNAMIC_RANGE = 70.0
+# Frames processed at once when computing spectrograms
+BLOCK_FRAMES = 4096
+# Bumped whenever the layout or computation of pyramids changes, so that older pyramids get rebuilt
+PYRAMID_FORMAT = 1
+
+
+def waveform_levels(signal):
+    """
+    Build a multi-resolution waveform: the samples themselves, then envelopes of the minimum and maximum amplitude
+    over buckets of LEVEL_FACTOR ** level samples
+
+    :param signal: :class:`numpy.ndarray`
+    :return: list of :class:`numpy.ndarray`
+        float16 samples for level 0, then float16 arrays of shape (buckets, 2) with the minimum and maximum
+    """
+    levels = [signal.astype(np.float16)]
+    minima = maxima = signal.astype(np.float32)
+    while len(minima) // LEVEL_FACTOR >= WAVEFORM_MIN_BUCKETS:
+        remainder = len(minima) % LEVEL_FACTOR
+        if remainder:
+            padding = LEVEL_FACTOR - remainder
+            minima = np.concatenate([minima, np.repeat(minima[-1:], padding)])
+            maxima = np.concatenate([maxima, np.repeat(maxima[-1:], padding)])
+        minima = minima.reshape(-1, LEVEL_FACTOR).min(axis=1)
+        maxima = maxima.reshape(-1, LEVEL_FACTOR).max(axis=1)
+        levels.append(np.stack([minima, maxima], axis=1).astype(np.float16))
+    return levels
+
+
+def gaussian_window(length, std):
+    n = np.arange(length) - (length - 1) / 2
+    return np.exp(-0.5 * (n / std) ** 2)
+
+
+def spectrogram_blocks(signal, sr, time_step):
+    """
+    Compute the power spectrum in dB of frames centred every time_step seconds, with the same window as PolyglotDB's
+    spectrograms, a block of frames at a time
+
+    :return: tuple
+        Generator of float32 arrays of shape (frames, frequency bins), the number of frames and frequency bins, and
+        the frequency step in Hz
+    """
+    win_len = int(SPECTROGRAM_WINDOW_LENGTH * sr)
+    n_fft = max(SPECTROGRAM_N_FFT, win_len)
+    hop = max(int(round(time_step * sr)), 1)
+    window = np.zeros(n_fft)
+    start = (n_fft - win_len) // 2
+    window[start:start + win_len] = gaussian_window(win_len, 0.45 * win_len / 2)
+    padded = np.pad(signal.astype(np.float32), n_fft // 2)
+    num_frames = 1 + len(signal) // hop
+
+    def blocks():
+        frames = np.lib.stride_tricks.sliding_window_view(padded, n_fft)[::hop][:num_frames]
+        for i in range(0, len(frames), BLOCK_FRAMES):
+            power = np.abs(np.fft.rfft(frames[i:i + BLOCK_FRAMES] * window, axis=1))
+            yield (20 * np.log10(np.maximum(power, 1e-10))).astype(np.float32)
+
+    return blocks(), num_frames, n_fft // 2 + 1, sr / n_fft
+
+
+def quantize(db, ceiling):
+    floor = ceiling - SPECTROGRAM_DYNAMIC_RANGE
+    return np.clip(np.round((db - floor) / SPECTROGRAM_DYNAMIC_RANGE * 255), 0, 255).astype(np.uint8)
+
+
+def source_stamp(path):
+    stat = os.stat(path)
+    return {'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def spectrogram_time_step():
+    return getattr(settings, 'POLYGLOT_SPECTROGRAM_TIME_STEP', DEFAULT_SPECTROGRAM_TIME_STEP)
+
+
+def pyramid_key(waveform_path, spectrogram_path):
+    """
+    Identify the sources and settings a pyramid is built from, so that it is rebuilt if any of them change
+    """
+    data = {'format': PYRAMID_FORMAT, 'waveform': source_stamp(waveform_path),
+            'spectrogram': source_stamp(spectrogram_path), 'time_step': spectrogram_time_step()}
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf8')).hexdigest()
+
+
+class DiscoursePyramid(object):
+    """
+    Precomputed waveform envelopes and spectrogram tiles for a discourse, stored as memory-mapped arrays so that any
+    time range can be served without decoding audio or computing spectra
+
+    Waveforms are built from the discourse's low frequency audio and kept as float16, spectrograms from its consonant
+    audio, quantized to uint8 over the top SPECTROGRAM_DYNAMIC_RANGE dB.  Level 0 is the finest resolution, and each
+    level above is LEVEL_FACTOR times coarser (minimum and maximum amplitude for waveforms, maximum power for
+    spectrograms).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(self.meta_path(directory), 'r') as f:
+            self.meta = json.load(f)
+        self._arrays = {}
+
+    @staticmethod
+    def meta_path(directory):
+        return os.path.join(directory, 'meta.json')
+
+    @classmethod
+    def is_current(cls, directory, key):
+        try:
+            with open(cls.meta_path(directory), 'r') as f:
+                return json.load(f).get('key') == key
+        except (OSError, ValueError):
+            return False
+
+    @classmethod
+    def build(cls, directory, waveform_path, spectrogram_path, time_step=None):
+        """
+        Build the pyramid for a discourse's audio files, replacing any existing one
+
+        :param directory: str
+        :param waveform_path: str
+            Low frequency audio file
+        :param spectrogram_path: str
+            Consonant audio file
+        :param time_step: float, optional
+            Time between spectrogram frames at level 0, defaults to POLYGLOT_SPECTROGRAM_TIME_STEP
+        :return: :class:`DiscoursePyramid`
+        """
+        from polyglotdb.acoustics.utils import load_waveform
+        if time_step is None:
+            time_step = spectrogram_time_step()
+        key = pyramid_key(waveform_path, spectrogram_path)
+        temp_directory = directory + '.tmp'
+        shutil.rmtree(temp_directory, ignore_errors=True)
+        os.makedirs(temp_directory)
+
+        signal, sr = load_waveform(waveform_path)
+        waveform = waveform_levels(signal)
+        for level, values in enumerate(waveform):
+            np.save(os.path.join(temp_directory, 'waveform_{}.npy'.format(level)), values)
+        meta = {'key': key, 'waveform': {'sr': int(sr), 'levels': len(waveform), 'num_samples': len(signal)}}
+        del signal, waveform
+
+        signal, sr = load_waveform(spectrogram_path)
+        blocks, num_frames, num_bins, freq_step = spectrogram_blocks(signal, sr, time_step)
+        # Spectra are kept unquantized on disk until the loudest frame is known
+        unquantized_path = os.path.join(temp_directory, 'unquantized.npy')
+        unquantized = np.lib.format.open_memmap(unquantized_path, mode='w+', dtype=np.float16,
+                                                shape=(num_frames, num_bins))
+        ceiling = -np.inf
+        position = 0
+        for block in blocks:
+            ceiling = max(ceiling, float(block.max()))
+            unquantized[position:position + len(block)] = block
+            position += len(block)
+        del signal
+        path = os.path.join(temp_directory, 'spectrogram_0.npy')
+        level = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(num_frames, num_bins))
+        for position in range(0, num_frames, BLOCK_FRAMES):
+            block = unquantized[position:position + BLOCK_FRAMES].astype(np.float32)
+            level[position:position + len(block)] = quantize(block, ceiling)
+        del unquantized
+        os.remove(unquantized_path)
+        level.flush()
+        levels = 1
+        while len(level) > TILE_FRAMES:
+            coarser = np.asarray(level)
+            remainder = len(coarser) % LEVEL_FACTOR
+            if remainder:
+                coarser = np.concatenate([coarser, np.repeat(coarser[-1:], LEVEL_FACTOR - remainder, axis=0)])
+            level = coarser.reshape(-1, LEVEL_FACTOR, num_bins).max(axis=1)
+            np.save(os.path.join(temp_directory, 'spectrogram_{}.npy'.format(levels)), level)
+            levels += 1
+        del level
+        meta['spectrogram'] = {'time_step': time_step, 'freq_step': freq_step, 'levels': levels,
+                               'num_frames': num_frames, 'num_freq_bins': num_bins, 'tile_frames': TILE_FRAMES,
+                               'ceiling': ceiling, 'dynamic_range': SPECTROGRAM_DYNAMIC_RANGE}
+        with open(cls.meta_path(temp_directory), 'w') as f:
+            json.dump(meta, f)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(temp_directory, directory)
+        return cls(directory)
+
+    @property
+    def etag(self):
+        return quote_etag(self.meta['key'])
+
+    def _array(self, name, level):
+        key = (name, level)
+        if key not in self._arrays:
+            path = os.path.join(self.directory, '{}_{}.npy'.format(name, level))
+            self._arrays[key] = np.load(path, mmap_mode='r')
+        return self._arrays[key]
+
+    def waveform_level(self, begin, end, max_points=None):
+        """
+        Get the finest waveform level that has at most max_points values between begin and end
+        """
+        meta = self.meta['waveform']
+        if not max_points:
+            return 0
+        duration = max(end - begin, 0)
+        for level in range(meta['levels']):
+            if duration * meta['sr'] / LEVEL_FACTOR ** level <= max_points:
+                return level
+        return meta['levels'] - 1
+
+    def waveform(self, begin, end, max_points=None, level=None):
+        """
+        Get the waveform between two times
+
+        :param begin: float
+        :param end: float
+        :param max_points: int, optional
+            Use the finest level that has no more values than this over the range
+        :param level: int, optional
+            Level to use instead of working it out from max_points
+        :return: dict
+            Level, time of the first value, time step between values and the values, either samples or rows of minimum
+            and maximum amplitude
+        """
+        meta = self.meta['waveform']
+        if level is None:
+            level = self.waveform_level(begin, end, max_points)
+        level = min(max(int(level), 0), meta['levels'] - 1)
+        time_step = LEVEL_FACTOR ** level / meta['sr']
+        values = self._array('waveform', level)
+        first = max(int(math.floor(begin / time_step)), 0)
+        last = len(values) if math.isinf(end) else min(int(math.ceil(end / time_step)), len(values))
+        return {'level': level, 'begin': first * time_step, 'time_step': time_step,
+                'values': np.asarray(values[first:max(last, first)])}
+
+    def spectrogram(self, begin, end, level=0):
+        """
+        Get the spectrogram between two times
+
+        :return: dict
+            Same layout as PolyglotDB's ``spectrogram_fast``, with values as uint8 power indexed by frequency bin then
+            time, along with the level and time of the first frame
+        """
+        meta = self.meta['spectrogram']
+        level = min(max(int(level), 0), meta['levels'] - 1)
+        time_step = meta['time_step'] * LEVEL_FACTOR ** level
+        frames = self._array('spectrogram', level)
+        first = max(int(math.floor(begin / time_step)), 0)
+        last = len(frames) if math.isinf(end) else min(int(math.ceil(end / time_step)) + 1, len(frames))
+        values = np.asarray(frames[first:max(last, first)]).T
+        return {'level': level, 'begin': first * time_step, 'time_step': time_step, 'freq_step': meta['freq_step'],
+                'num_time_bins': values.shape[1], 'num_freq_bins': values.shape[0], 'values': values}
+
+    def spectrogram_tile(self, level, tile):
+        """
+        Get a tile of TILE_FRAMES spectrogram frames, which never changes for a given pyramid
+
+        :raises IndexError: if the tile is outside the spectrogram
+        """
+        meta = self.meta['spectrogram']
+        if not 0 <= level < meta['levels']:
+            raise IndexError(level)
+        time_step = meta['time_step'] * LEVEL_FACTOR ** level
+        tile_duration = time_step * meta['tile_frames']
+        frames = self._array('spectrogram', level)
+        if not 0 <= tile * meta['tile_frames'] < len(frames):
+            raise IndexError(tile)
+        return self.spectrogram(tile * tile_duration, (tile + 1) * tile_duration - time_step, level)
+
+
+def waveform_points(waveform):
+    """
+    Convert waveform samples to the points PolyglotDB's ``waveform`` gives, for clients that plot them directly
+
+    Coarser levels have the minimum and maximum amplitude of each step, which become two points half a step apart, so
+    that the plotted line covers the envelope of the samples.
+    """
+    begin = waveform['begin']
+    time_step = waveform['time_step']
+    values = waveform['values']
+    if values.ndim == 1:
+        return [{'amplitude': float(v), 'time': begin + i * time_step} for i, v in enumerate(values)]
+    points = []
+    for i, (minimum, maximum) in enumerate(values):
+        time = begin + i * time_step
+        points.append({'amplitude': float(minimum), 'time': time})
+        points.append({'amplitude': float(maximum), 'time': time + time_step / 2})
+    return points
+
+
+def pyramid_directory(corpus, discourse):
+    name = re.sub(r'[^\w.-]', '_', discourse)
+    digest = hashlib.sha1(discourse.encode('utf8')).hexdigest()[:8]
+    return os.path.join(corpus.data_directory, 'pyramids', corpus.name, '{}-{}'.format(name, digest))
+
+
+def discourse_pyramid(corpus, corpus_context, discourse):
+    """
+    Get the pyramid for a discourse, building it first if it is missing or its audio has changed
+
+    :param corpus: :class:`~iscan.models.Corpus`
+    :param corpus_context: :class:`~iscan.connections.CorpusContext`
+    :param discourse: str
+    :return: :class:`DiscoursePyramid`
+    """
+    sound_file = corpus_context.discourse_sound_file(discourse)
+    waveform_path = sound_file['low_freq_file_path']
+    spectrogram_path = sound_file['consonant_file_path']
+    directory = pyramid_directory(corpus, discourse)
+    key = pyramid_key(waveform_path, spectrogram_path)
+    if DiscoursePyramid.is_current(directory, key):
+        return DiscoursePyramid(directory)
+    os.makedirs(os.path.dirname(directory), exist_ok=True)
+    with TaskLock(directory + '.lock'):
+        # Another process may have built it while this one was waiting
+        if DiscoursePyramid.is_current(directory, key):
+            return DiscoursePyramid(directory)
+        log.info('Building waveform and spectrogram pyramid for {}'.format(discourse))
+        return DiscoursePyramid.build(directory, waveform_path, spectrogram_path)
+
+
+def build_pyramids(corpus, corpus_context, task=None):
+    """
+    Build the pyramids for every discourse in a corpus that has audio, i.e. after an import
+
+    :param task: :class:`~iscan.models.BackgroundTask`, optional
+        Task to report each discourse's progress to
+    """
+    discourses = corpus_context.discourses
+    if task is not None:
+        task.set_progress(discourses)
+    for discourse in discourses:
+        try:
+            discourse_pyramid(corpus, corpus_context, discourse)
+        except Exception:
+            log.exception('Could not build the pyramid for {}'.format(discourse))
+            if task is not None:
+                task.update_progress(discourse, 'failed')
+            continue
+        if task is not None:
+            task.update_progress(discourse, 'done')
@@ -0,0 +1,153 @@
+import json
+import math
+import struct
+
+import numpy as np
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+MAGIC = b'ISCN'
+ALIGNMENT = 8
+
+# Types that JavaScript has typed arrays for, other types are converted to the nearest one
+DTYPES = {
+    'uint8': 'uint8', 'bool': 'uint8', 'int8': 'int32', 'int16': 'int32', 'uint16': 'int32', 'int32': 'int32',
+    'float16': 'float32', 'float32': 'float32', 'int64': 'float64', 'uint32': 'float64', 'uint64': 'float64',
+    'float64': 'float64',
+}
+
+# Point properties that are only displayed, which are sent as float32 in columns.  Others keep double precision,
+# since tracks (i.e., pitch) are edited on the client and saved back.
+DISPLAY_ONLY_KEYS = {'amplitude'}
+
+# Lists of points shorter than this aren't worth turning into columns
+MIN_COLUMN_ROWS = 8
+
+
+def _is_number(value):
+    return value is None or (isinstance(value, (int, float, np.number)) and not isinstance(value, (bool, np.bool_)))
+
+
+def _is_point_list(value):
+    """
+    Check whether a list is made of points, i.e. pitch or formant track points or waveform samples, which are dicts
+    with the same keys and only numbers as values
+    """
+    if len(value) < MIN_COLUMN_ROWS or not isinstance(value[0], dict) or not value[0]:
+        return False
+    keys = set(value[0])
+    return all(isinstance(x, dict) and set(x) == keys and all(_is_number(v) for v in x.values()) for x in value)
+
+
+def _pad(length):
+    return -length % ALIGNMENT
+
+
+class ArrayEncoder(object):
+    def __init__(self):
+        self.arrays = []
+        self.buffers = []
+        self.offset = 0
+
+    def add_array(self, array):
+        array = np.asarray(array)
+        dtype = np.dtype(DTYPES.get(array.dtype.name, 'float64')).newbyteorder('<')
+        data = np.ascontiguousarray(array, dtype=dtype).tobytes()
+        self.arrays.append({'dtype': dtype.name, 'shape': list(array.shape), 'offset': self.offset})
+        self.buffers.append(data + b'\0' * _pad(len(data)))
+        self.offset += len(data) + _pad(len(data))
+        return {'__array__': len(self.arrays) - 1}
+
+    def add_columns(self, points):
+        columns = {}
+        for key in points[0]:
+            values = [math.nan if x[key] is None else x[key] for x in points]
+            dtype = np.float32 if key in DISPLAY_ONLY_KEYS else np.float64
+            columns[key] = self.add_array(np.array(values, dtype=dtype))
+        return {'__columns__': columns, 'length': len(points)}
+
+    def convert(self, value):
+        if isinstance(value, np.ndarray):
+            return self.add_array(value)
+        if isinstance(value, (list, tuple)):
+            if _is_point_list(value):
+                return self.add_columns(value)
+            return [self.convert(x) for x in value]
+        if isinstance(value, dict):
+            return {k: self.convert(v) for k, v in value.items()}
+        if isinstance(value, np.generic):
+            return value.item()
+        return value
+
+
+def encode_arrays(data):
+    """
+    Encode data as JSON with its arrays and lists of points sent as binary typed arrays
+
+    The encoding is ``ISCN``, the length of the header as a little-endian uint32, the header, and then the arrays,
+    each starting on an 8 byte boundary relative to the end of the header.  The header is JSON (padded to a multiple
+    of 8 bytes) with the data under ``data`` and a description of each array (dtype, shape and offset) under
+    ``arrays``.  Arrays in the data are replaced by ``{"__array__": index}``, and lists of points by
+    ``{"__columns__": {key: {"__array__": index}}, "length": n}`` with missing values as NaN.
+
+    :param data: object
+    :return: bytes
+    """
+    encoder = ArrayEncoder()
+    converted = encoder.convert(data)
+    header = json.dumps({'data': converted, 'arrays': encoder.arrays}, cls=JSONEncoder,
+                        separators=(',', ':')).encode('utf8')
+    header += b' ' * _pad(len(header))
+    return b''.join([MAGIC, struct.pack('<I', len(header)), header] + encoder.buffers)
+
+
+def decode_arrays(content):
+    """
+    Decode data encoded by :func:`encode_arrays`, with arrays as numpy arrays and lists of points restored
+    """
+    if content[:4] != MAGIC:
+        raise ValueError('Not an array encoding')
+    header_length = struct.unpack('<I', content[4:8])[0]
+    header = json.loads(content[8:8 + header_length].decode('utf8'))
+    base = 8 + header_length
+    arrays = []
+    for a in header['arrays']:
+        dtype = np.dtype(a['dtype']).newbyteorder('<')
+        count = int(np.prod(a['shape']))
+        arrays.append(np.frombuffer(content, dtype=dtype, count=count, offset=base + a['offset']).reshape(a['shape']))
+
+    def restore(value):
+        if isinstance(value, list):
+            return [restore(x) for x in value]
+        if isinstance(value, dict):
+            if '__array__' in value:
+                return arrays[value['__array__']]
+            if '__columns__' in value:
+                columns = {k: arrays[v['__array__']] for k, v in value['__columns__'].items()}
+                return [{k: None if math.isnan(v[i]) else float(v[i]) for k, v in columns.items()}
+                        for i in range(value['length'])]
+            return {k: restore(v) for k, v in value.items()}
+        return value
+
+    return restore(header['data'])
+
+
+class TypedArrayRenderer(BaseRenderer):
+    """
+    Renders responses with waveforms, spectrograms and tracks as binary typed arrays (see :func:`encode_arrays`) for
+    clients that ask for them in their Accept header, so that numbers don't have to be formatted and parsed as text
+    """
+    media_type = 'application/vnd.iscan.arrays'
+    format = 'arrays'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return encode_arrays(data)
+
+
+# Renderers for endpoints that send acoustic data
+ACOUSTIC_RENDERERS = list(api_settings.DEFAULT_RENDERER_CLASSES) + [TypedArrayRenderer]
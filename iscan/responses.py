@@ -0,0 +1,199 @@
+import os
+import re
+import zlib
+
+from django.http import StreamingHttpResponse
+from django.http.response import FileResponse, HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, quote_etag, parse_etags, parse_http_date_safe
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header, size):
+    """
+    Parse a single byte range from a Range header
+
+    :param header: str
+    :param size: int
+        Size of the file in bytes
+    :return: tuple or None
+        Inclusive start and end of the range, or None if the header is missing or not a single byte range, in which
+        case the whole file should be sent
+    :raises ValueError: if the range cannot be satisfied
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # Suffix range, i.e. the last N bytes
+        length = int(end)
+        if not length:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = int(end) if end else size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, min(end, size - 1)
+
+
+def file_etag(stat):
+    return quote_etag('{:x}-{:x}'.format(int(stat.st_mtime * 1000000), stat.st_size))
+
+
+def read_chunks(f, length, chunk_size=CHUNK_SIZE):
+    """
+    Read up to length bytes from an open file in chunks, closing it at the end
+    """
+    try:
+        while length > 0:
+            data = f.read(min(chunk_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        f.close()
+
+
+def file_chunks(path, chunk_size=CHUNK_SIZE):
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            yield data
+
+
+def gzip_chunks(chunks, level=6):
+    """
+    Compress a stream of chunks of text or bytes on the fly into a gzip stream
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf8')
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _strip_weak(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def etag_matches(request, etag):
+    """
+    Check whether the client's If-None-Match header has the current ETag, i.e. its copy is still valid.  Tags are
+    compared weakly, as specified for If-None-Match.
+    """
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return '*' in etags or _strip_weak(etag) in {_strip_weak(x) for x in etags}
+
+
+def not_modified(etag):
+    response = HttpResponse(status=304)
+    response['ETag'] = etag
+    return response
+
+
+def revalidate(response, etag):
+    """
+    Mark a response as cacheable by the client as long as it checks with the server before reusing it
+    """
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def cacheable(response, etag, max_age):
+    """
+    Mark a response as reusable by the client for max_age seconds without checking with the server
+    """
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, max-age={}'.format(max_age)
+    # The same URL can be rendered as JSON or as typed arrays
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
+def attachment(response, filename):
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+    return response
+
+
+def ranged_file_response(request, path, content_type, filename=None):
+    """
+    Send a file from disk in chunks, supporting single byte range requests so that interrupted downloads can be resumed
+
+    :param request: request
+    :param path: str
+    :param content_type: str
+    :param filename: str, optional
+        Send the file as an attachment with this name
+    :return: response
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = file_etag(stat)
+    last_modified = http_date(stat.st_mtime)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    # Only resume if the file has not changed since the part the client already has
+    if not if_range or if_range == etag or parse_http_date_safe(if_range) == int(stat.st_mtime):
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(size)
+            return response
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        response['Content-Length'] = size
+    else:
+        start, end = byte_range
+        f = open(path, 'rb')
+        f.seek(start)
+        response = StreamingHttpResponse(read_chunks(f, end - start + 1), status=206, content_type=content_type)
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+        response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    if filename is not None:
+        attachment(response, filename)
+    return response
+
+
+def streaming_csv_response(chunks, filename, compress=False):
+    """
+    Stream a CSV as it is generated, optionally gzipped, as an attachment.  The size is not known ahead of time, so
+    ranges are not supported.
+
+    :param chunks: iterable of str or bytes
+    :param filename: str
+    :param compress: bool
+    :return: response
+    """
+    if compress:
+        response = StreamingHttpResponse(gzip_chunks(chunks), content_type='application/gzip')
+        filename += '.gz'
+    else:
+        response = StreamingHttpResponse((x.encode('utf8') if isinstance(x, str) else x for x in chunks),
+                                         content_type='text/csv')
+    response['Accept-Ranges'] = 'none'
+    return attachment(response, filename)
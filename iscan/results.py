@@ -0,0 +1,771 @@
+import os
+import json
+import mmap
+import time
+import uuid
+import shutil
+import hashlib
+
+import numpy as np
+
+from django.conf import settings
+
+OFFSET_DTYPE = np.dtype('<i8')
+NUMBER_DTYPE = np.dtype('<f8')
+
+# Kinds of column values, for choosing how to sort a column
+EMPTY = 'empty'
+NUMBER = 'number'
+TEXT = 'text'
+OTHER = 'other'
+
+# Placeholder for rows without a value in a column
+MISSING = object()
+
+
+class InvalidOrdering(ValueError):
+    pass
+
+
+def flatten_row(row, prefix=()):
+    """
+    Flatten a serialized result row into (path, value) pairs.  Nested dictionaries are descended into, anything else
+    (scalars, lists of subannotations or track points, None) is a leaf value.
+
+    :param row: dict
+    :param prefix: tuple
+    :return: generator of (tuple, object)
+    """
+    for k, v in row.items():
+        path = prefix + (k,)
+        if isinstance(v, dict) and v:
+            yield from flatten_row(v, path)
+        else:
+            yield path, v
+
+
+def value_kind(value):
+    """
+    Classify a leaf value as a number, text or something else (i.e., a list of subannotations), or None if it has no
+    value
+    """
+    if value is None:
+        return None
+    if isinstance(value, (bool, int, float)):
+        return NUMBER
+    if isinstance(value, str):
+        return TEXT
+    return OTHER
+
+
+def merge_kinds(kind, other):
+    if other is None or kind == other:
+        return kind
+    if kind == EMPTY:
+        return other
+    return OTHER
+
+
+def link_tree(source, target, exclude=None):
+    """
+    Populate target with hard links to the files in source, falling back to copies where hard links are not supported
+    """
+    os.makedirs(target, exist_ok=True)
+    for f in os.listdir(source):
+        if exclude is not None and f in exclude:
+            continue
+        source_path = os.path.join(source, f)
+        target_path = os.path.join(target, f)
+        try:
+            os.link(source_path, target_path)
+        except OSError:
+            shutil.copy2(source_path, target_path)
+
+
+def unshare_file(path):
+    """
+    Replace a file that is hard linked elsewhere with a private copy, so it can be modified in place
+    """
+    if os.path.exists(path) and os.stat(path).st_nlink > 1:
+        temp_path = path + '.tmp'
+        shutil.copy2(path, temp_path)
+        os.replace(temp_path, path)
+
+
+def set_path(row, path, value):
+    item = row
+    for k in path[:-1]:
+        item = item.setdefault(k, {})
+    item[path[-1]] = value
+
+
+def resolve_path(value, path):
+    """
+    Descend into a leaf value that stores more than the requested path, taking the first element of any list along
+    the way (i.e., ordering by the first subannotation).
+
+    :param value: object
+    :param path: tuple
+    :return: object
+    """
+    for k in path:
+        if isinstance(value, list):
+            if not len(value):
+                return None
+            value = value[0]
+        if not isinstance(value, dict):
+            return None
+        value = value.get(k, None)
+        if value is None:
+            return None
+    return value
+
+
+class QueryResultStore(object):
+    """
+    Columnar on-disk storage for serialized query results.
+
+    Each leaf of the serialized rows (i.e., ``phone.current.label``) is stored as its own column, consisting of a data
+    file with the JSON-encoded values for every row concatenated together and an offsets file with the byte offset
+    of every row into the data file.  Both are memory-mapped when reading, so fetching a page of results only
+    decodes the requested rows and columns rather than the entire result set.  Rows that have no value for a
+    column (i.e., no previous phone) have a zero-length entry.
+
+    Every column also has a numbers file with each row's value as a float (NaN if it isn't a number), and the
+    metadata records whether a column's values are all numbers, all text or neither, so that sorting on a column of
+    numbers doesn't need to decode it.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._meta = None
+        self._offsets = {}
+        self._data = {}
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.directory, 'meta.json')
+
+    @property
+    def exists(self):
+        return os.path.exists(self.meta_path)
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            if self.exists:
+                with open(self.meta_path, 'r') as f:
+                    self._meta = json.load(f)
+            else:
+                self._meta = {'columns': [], 'count': 0}
+        return self._meta
+
+    @property
+    def columns(self):
+        return [tuple(x) for x in self.meta['columns']]
+
+    @property
+    def count(self):
+        return self.meta['count']
+
+    def refresh(self):
+        """
+        Drop any cached metadata and memory maps so that rows written by another process become visible
+        """
+        self.close()
+        self._meta = None
+
+    def close(self):
+        for m in self._data.values():
+            if m is not None:
+                m.close()
+        self._data = {}
+        self._offsets = {}
+
+    def reset(self):
+        """
+        Remove all stored results
+        """
+        self.refresh()
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _data_path(self, column_index):
+        return os.path.join(self.directory, '{}.data'.format(column_index))
+
+    def _offsets_path(self, column_index):
+        return os.path.join(self.directory, '{}.offsets'.format(column_index))
+
+    def _numbers_path(self, column_index):
+        return os.path.join(self.directory, '{}.numbers'.format(column_index))
+
+    def _kinds(self, meta):
+        kinds = meta.get('kinds', None)
+        if kinds is None:
+            # Written before kinds were recorded, so none of the columns can be sorted without decoding them
+            kinds = [OTHER] * len(meta['columns']) if meta['count'] else []
+        return list(kinds)
+
+    def _save_meta(self, meta):
+        temp_path = self.meta_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(temp_path, self.meta_path)
+        self._meta = meta
+
+    def append(self, rows):
+        """
+        Append serialized rows to the store.  The metadata is written last, so concurrent readers only ever see fully
+        written rows.
+
+        :param rows: list of dict
+        """
+        self.close()
+        self.clear_permutations()
+        os.makedirs(self.directory, exist_ok=True)
+        meta = dict(self.meta)
+        columns = self.columns
+        column_lookup = {c: i for i, c in enumerate(columns)}
+        kinds = self._kinds(meta)
+        count = meta['count']
+        ends = {}
+        for i in range(len(columns)):
+            ends[i] = os.path.getsize(self._data_path(i))
+        buffers = {i: bytearray() for i in range(len(columns))}
+        offsets = {i: [] for i in range(len(columns))}
+        numbers = {i: [] for i in range(len(columns))}
+        new_columns = []
+        for row_index, row in enumerate(rows):
+            row_numbers = {}
+            for path, value in flatten_row(row):
+                i = column_lookup.get(path, None)
+                if i is None:
+                    i = len(columns)
+                    columns.append(path)
+                    column_lookup[path] = i
+                    kinds.append(EMPTY)
+                    new_columns.append(i)
+                    ends[i] = 0
+                    buffers[i] = bytearray()
+                    # Rows written before this column existed have no value for it
+                    offsets[i] = [0] * (count + row_index + 1)
+                    numbers[i] = [np.nan] * (count + row_index)
+                encoded = json.dumps(value).encode('utf8')
+                buffers[i].extend(encoded)
+                ends[i] += len(encoded)
+                kind = value_kind(value)
+                kinds[i] = merge_kinds(kinds[i], kind)
+                if kind == NUMBER:
+                    row_numbers[i] = value
+            for i in range(len(columns)):
+                offsets[i].append(ends[i])
+                numbers[i].append(row_numbers.get(i, np.nan))
+        for i in range(len(columns)):
+            mode = 'wb' if i in new_columns else 'ab'
+            if mode == 'ab':
+                # Stores restored from the result cache share their files with the cache entry
+                unshare_file(self._data_path(i))
+                unshare_file(self._offsets_path(i))
+                unshare_file(self._numbers_path(i))
+            with open(self._data_path(i), mode) as f:
+                f.write(buffers[i])
+            with open(self._offsets_path(i), mode) as f:
+                f.write(np.array(offsets[i], dtype=OFFSET_DTYPE).tobytes())
+            with open(self._numbers_path(i), mode) as f:
+                f.write(np.array(numbers[i], dtype=NUMBER_DTYPE).tobytes())
+        meta['columns'] = [list(c) for c in columns]
+        meta['kinds'] = kinds
+        meta['count'] = count + len(rows)
+        self._save_meta(meta)
+
+    def update_meta(self, **kwargs):
+        """
+        Save additional information about the results (i.e., the query configuration they were generated from)
+        """
+        meta = dict(self.meta)
+        meta.update(kwargs)
+        self._save_meta(meta)
+
+    def set_columns(self, paths, rows):
+        """
+        Add columns, or replace existing ones, for all rows in a single pass
+
+        :param paths: list of tuple
+        :param rows: iterable
+            One tuple of values per row, in the same order as paths, with :data:`MISSING` for no value
+        """
+        if not paths:
+            return
+        self.close()
+        self.clear_permutations()
+        paths = [tuple(x) for x in paths]
+        meta = dict(self.meta)
+        columns = self.columns
+        kinds = self._kinds(meta)
+        indices = []
+        for path in paths:
+            if path not in columns:
+                columns.append(path)
+                kinds.append(EMPTY)
+            indices.append(columns.index(path))
+        offsets = [[0] for _ in paths]
+        ends = [0 for _ in paths]
+        numbers = [[] for _ in paths]
+        column_kinds = [EMPTY for _ in paths]
+        # Written to new files, so that stores restored from the cache never modify the cached files
+        files = [open(self._data_path(i) + '.tmp', 'wb') for i in indices]
+        try:
+            for row in rows:
+                for j, value in enumerate(row):
+                    number = np.nan
+                    if value is not MISSING:
+                        encoded = json.dumps(value).encode('utf8')
+                        files[j].write(encoded)
+                        ends[j] += len(encoded)
+                        kind = value_kind(value)
+                        column_kinds[j] = merge_kinds(column_kinds[j], kind)
+                        if kind == NUMBER:
+                            number = value
+                    offsets[j].append(ends[j])
+                    numbers[j].append(number)
+        finally:
+            for f in files:
+                f.close()
+        if len(offsets[0]) != meta['count'] + 1:
+            for i in indices:
+                os.remove(self._data_path(i) + '.tmp')
+            raise ValueError('Expected {} rows, got {}'.format(meta['count'], len(offsets[0]) - 1))
+        for j, i in enumerate(indices):
+            with open(self._offsets_path(i) + '.tmp', 'wb') as f:
+                f.write(np.array(offsets[j], dtype=OFFSET_DTYPE).tobytes())
+            with open(self._numbers_path(i) + '.tmp', 'wb') as f:
+                f.write(np.array(numbers[j], dtype=NUMBER_DTYPE).tobytes())
+            os.replace(self._data_path(i) + '.tmp', self._data_path(i))
+            os.replace(self._offsets_path(i) + '.tmp', self._offsets_path(i))
+            os.replace(self._numbers_path(i) + '.tmp', self._numbers_path(i))
+            kinds[i] = column_kinds[j]
+        meta['columns'] = [list(c) for c in columns]
+        meta['kinds'] = kinds
+        self._save_meta(meta)
+
+    def set_column(self, path, values):
+        """
+        Add a column, or replace an existing one, for all rows at once
+
+        :param path: tuple
+        :param values: iterable
+            One value per row, with :data:`MISSING` for rows that have no value
+        """
+        self.set_columns([path], ((x,) for x in values))
+
+    def remove_columns(self, prefix):
+        """
+        Remove all columns beginning with a path
+
+        :param prefix: tuple
+        """
+        self.close()
+        self.clear_permutations()
+        prefix = tuple(prefix)
+        meta = dict(self.meta)
+        columns = self.columns
+        kept = [i for i, c in enumerate(columns) if c[:len(prefix)] != prefix]
+        if len(kept) == len(columns):
+            return
+        kinds = self._kinds(meta)
+        for i in range(len(columns)):
+            if i not in kept:
+                os.remove(self._data_path(i))
+                os.remove(self._offsets_path(i))
+                if os.path.exists(self._numbers_path(i)):
+                    os.remove(self._numbers_path(i))
+        for new_index, old_index in enumerate(kept):
+            if new_index != old_index:
+                os.replace(self._data_path(old_index), self._data_path(new_index))
+                os.replace(self._offsets_path(old_index), self._offsets_path(new_index))
+                if os.path.exists(self._numbers_path(old_index)):
+                    os.replace(self._numbers_path(old_index), self._numbers_path(new_index))
+        meta['columns'] = [list(columns[i]) for i in kept]
+        if 'kinds' in meta:
+            meta['kinds'] = [kinds[i] for i in kept]
+        self._save_meta(meta)
+
+    def write(self, rows):
+        """
+        Replace the contents of the store with the given rows
+
+        :param rows: list of dict
+        """
+        self.reset()
+        self.append(rows)
+
+    def _column_offsets(self, column_index):
+        if column_index not in self._offsets:
+            self._offsets[column_index] = np.memmap(self._offsets_path(column_index), dtype=OFFSET_DTYPE, mode='r')
+        return self._offsets[column_index]
+
+    def _column_data(self, column_index):
+        if column_index not in self._data:
+            with open(self._data_path(column_index), 'rb') as f:
+                if os.fstat(f.fileno()).st_size:
+                    self._data[column_index] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    self._data[column_index] = None
+        return self._data[column_index]
+
+    def _select_columns(self, columns=None):
+        if columns is None:
+            return list(range(len(self.columns)))
+        prefixes = [tuple(x.split('.')) if isinstance(x, str) else tuple(x) for x in columns]
+        selected = []
+        for i, c in enumerate(self.columns):
+            for p in prefixes:
+                if c[:len(p)] == p or p[:len(c)] == c:
+                    selected.append(i)
+                    break
+        return selected
+
+    def _value(self, column_index, row_index):
+        offsets = self._column_offsets(column_index)
+        begin, end = int(offsets[row_index]), int(offsets[row_index + 1])
+        if begin == end:
+            raise KeyError(row_index)
+        return json.loads(self._column_data(column_index)[begin:end].decode('utf8'))
+
+    def _decode_column(self, column_index):
+        """
+        Decode the values of a column for every row at once, as a single JSON array, with None for rows that have no
+        value
+        """
+        offsets = np.array(self._column_offsets(column_index), dtype=OFFSET_DTYPE)
+        data = self._column_data(column_index)
+        if data is None:
+            return [None] * (len(offsets) - 1)
+        encoded = np.frombuffer(data[:int(offsets[-1])], dtype=np.uint8)
+        # Separate the rows with commas, and fill in the rows without a value with nulls
+        separator_rows = np.arange(1, len(offsets) - 1)
+        missing_rows = np.repeat(np.flatnonzero(offsets[1:] == offsets[:-1]), 4)
+        rows = np.concatenate([separator_rows, missing_rows])
+        values = np.concatenate([np.full(len(separator_rows), ord(','), dtype=np.uint8),
+                                 np.tile(np.frombuffer(b'null', dtype=np.uint8), len(missing_rows) // 4)])
+        # Insertions at the same position go in row order, with a row's comma before its null
+        order = np.lexsort((np.arange(len(rows)), rows))
+        encoded = np.insert(encoded, offsets[rows[order]], values[order])
+        return json.loads(b'[' + encoded.tobytes() + b']')
+
+    def get_rows(self, indices, columns=None):
+        """
+        Reconstruct the serialized rows at the given indices
+
+        :param indices: iterable of int
+        :param columns: list of str or tuple, optional
+            Only reconstruct columns beginning with these paths, i.e. ``['phone', 'speaker.name']``
+        :return: list of dict
+        """
+        all_columns = self.columns
+        column_indices = self._select_columns(columns)
+        count = self.count
+        rows = []
+        for row_index in indices:
+            row_index = int(row_index)
+            if row_index < 0 or row_index >= count:
+                raise IndexError(row_index)
+            row = {}
+            for i in column_indices:
+                try:
+                    value = self._value(i, row_index)
+                except KeyError:
+                    continue
+                set_path(row, all_columns[i], value)
+            rows.append(row)
+        return rows
+
+    def get_slice(self, offset, limit=None):
+        """
+        Reconstruct a page of rows in stored order
+
+        :param offset: int
+        :param limit: int, optional
+        :return: list of dict
+        """
+        end = self.count
+        if limit:
+            end = min(end, offset + limit)
+        return self.get_rows(range(offset, end))
+
+    def column_values(self, path):
+        """
+        Get the value of a (possibly nested) property for every row, for use in sorting.
+
+        :param path: str or tuple
+            For example, ``'phone.current.label'`` or ``'phone.current.burst.begin'`` for a subannotation property
+        :return: list
+        """
+        if isinstance(path, str):
+            path = tuple(path.split('.'))
+        candidates = []
+        for i, c in enumerate(self.columns):
+            if c == path:
+                candidates.insert(0, (i, ()))
+            elif path[:len(c)] == c:
+                candidates.append((i, path[len(c):]))
+        if len(candidates) == 1 and not candidates[0][1]:
+            return [x[0] if isinstance(x, list) and len(x) else (None if isinstance(x, list) else x)
+                    for x in self._decode_column(candidates[0][0])]
+        values = []
+        for row_index in range(self.count):
+            value = None
+            for i, remaining in candidates:
+                try:
+                    value = self._value(i, row_index)
+                except KeyError:
+                    continue
+                if remaining:
+                    value = resolve_path(value, remaining)
+                elif isinstance(value, list):
+                    value = value[0] if len(value) else None
+                break
+            values.append(value)
+        return values
+
+    def is_sortable(self, path):
+        """
+        Check whether a property path is a column, or a property of the values in one (i.e., of subannotations)
+
+        :param path: str or tuple
+        :return: bool
+        """
+        if isinstance(path, str):
+            path = tuple(path.split('.'))
+        return any(path[:len(c)] == c for c in self.columns)
+
+    def _permutation_path(self, path):
+        return os.path.join(self.directory, 'sort.{}.npy'.format(hashlib.sha1(path.encode('utf8')).hexdigest()))
+
+    def clear_permutations(self):
+        """
+        Remove any cached sort permutations, which are no longer valid once rows are added
+        """
+        if not os.path.exists(self.directory):
+            return
+        for f in os.listdir(self.directory):
+            if f.startswith('sort.') and f.endswith('.npy'):
+                os.remove(os.path.join(self.directory, f))
+
+    def _typed_column(self, path):
+        """
+        Get the index and kind of the column for a path, if the column's values are all numbers or all text and no
+        other column holds values for the path
+        """
+        path = tuple(path.split('.'))
+        kinds = self.meta.get('kinds', None)
+        columns = self.columns
+        if kinds is None or len(kinds) != len(columns) or path not in columns:
+            return None, None
+        for i, c in enumerate(columns):
+            if c != path and path[:len(c)] == c and kinds[i] != EMPTY:
+                return None, None
+        column_index = columns.index(path)
+        return column_index, kinds[column_index]
+
+    def _compute_permutation(self, path):
+        column_index, kind = self._typed_column(path)
+        if kind == EMPTY:
+            return np.arange(self.count, dtype=OFFSET_DTYPE)
+        if kind == NUMBER:
+            numbers = np.fromfile(self._numbers_path(column_index), dtype=NUMBER_DTYPE)
+            if numbers.shape[0] == self.count:
+                # Missing values sort as zero
+                return np.argsort(np.nan_to_num(numbers, nan=0.0), kind='stable').astype(OFFSET_DTYPE)
+        elif kind == TEXT:
+            values = np.array(self._decode_column(column_index), dtype=object)
+            values[values == None] = ''  # noqa: E711
+            return np.argsort(values.astype(str), kind='stable').astype(OFFSET_DTYPE)
+        return self._compute_decoded_permutation(path)
+
+    def _compute_decoded_permutation(self, path):
+        raw = self.column_values(path)
+        default = None
+        for v in raw:
+            if v is not None:
+                default = type(v)()
+                break
+        if default is None:
+            return np.arange(len(raw), dtype=OFFSET_DTYPE)
+        values = [default if v is None else v for v in raw]
+        if isinstance(default, str):
+            values = np.array(values, dtype=str)
+        else:
+            try:
+                values = np.array(values, dtype=float)
+            except (TypeError, ValueError):
+                values = None
+            if values is None or values.ndim != 1:
+                # Values that aren't all numbers (i.e., lists or dicts, or a mix of types) are sorted by their text
+                values = np.array(['' if v is None else str(v) for v in raw], dtype=str)
+        return np.argsort(values, kind='stable').astype(OFFSET_DTYPE)
+
+    def permutation(self, ordering):
+        """
+        Get the row indices in the order specified, where ordering is a property path optionally prefixed with ``-``
+        for descending order.  Missing values sort as the default value of the column's type.
+
+        The ascending permutation for each property is computed once and saved next to the results, so later
+        requests only read the slice of the (memory-mapped) permutation needed for a page.
+
+        :param ordering: str
+        :return: :class:`numpy.ndarray`
+        :raises InvalidOrdering: if the property isn't one of the results' columns
+        """
+        path = ordering.lstrip('-')
+        if not self.is_sortable(path):
+            raise InvalidOrdering('Cannot order results by {}'.format(path))
+        permutation_path = self._permutation_path(path)
+        permutation = None
+        if os.path.exists(permutation_path):
+            permutation = np.load(permutation_path, mmap_mode='r')
+            if permutation.shape[0] != self.count:
+                permutation = None
+        if permutation is None:
+            permutation = self._compute_permutation(path)
+            temp_path = permutation_path + '.tmp'
+            with open(temp_path, 'wb') as f:
+                np.save(f, permutation)
+            os.replace(temp_path, permutation_path)
+        if ordering.startswith('-'):
+            permutation = permutation[::-1]
+        return permutation
+
+
+class ResultCache(object):
+    """
+    Content-addressed cache of materialized query results, so that queries with the same configuration on the same
+    version of a corpus can reuse results instead of re-running them.
+
+    Each entry is a copy of a :class:`QueryResultStore` directory (hard linked where possible) named by its key.  The
+    least recently used entries are evicted once there are more than ``max_entries`` of them or they take up more
+    than ``max_size`` bytes.
+    """
+    info_name = 'cache.json'
+
+    def __init__(self, directory, max_entries=100, max_size=None):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_size = max_size
+
+    def _entry_directory(self, key):
+        return os.path.join(self.directory, key)
+
+    def _info_path(self, key):
+        return os.path.join(self._entry_directory(key), self.info_name)
+
+    def __contains__(self, key):
+        return os.path.exists(self._info_path(key))
+
+    def restore(self, key, target):
+        """
+        Populate a result store directory from the cache
+
+        :param key: str
+        :param target: str
+            Result store directory
+        :return: bool
+            True if the key was found in the cache
+        """
+        if key not in self:
+            return False
+        shutil.rmtree(target, ignore_errors=True)
+        try:
+            # Track recency of use by the modification time of the entry's info file
+            os.utime(self._info_path(key))
+            link_tree(self._entry_directory(key), target, exclude=[self.info_name])
+        except FileNotFoundError:
+            # Evicted while restoring
+            shutil.rmtree(target, ignore_errors=True)
+            os.makedirs(target, exist_ok=True)
+            return False
+        return True
+
+    def add(self, key, source, corpus_pk):
+        """
+        Add a result store directory to the cache
+
+        :param key: str
+        :param source: str
+            Result store directory
+        :param corpus_pk: int
+            Corpus that the results are from, for invalidation
+        """
+        if key in self:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        temp_directory = os.path.join(self.directory, '.{}-{}'.format(key, uuid.uuid4().hex))
+        link_tree(source, temp_directory)
+        size = sum(os.path.getsize(os.path.join(temp_directory, f)) for f in os.listdir(temp_directory))
+        with open(os.path.join(temp_directory, self.info_name), 'w') as f:
+            json.dump({'corpus': corpus_pk, 'size': size, 'created_at': time.time()}, f)
+        try:
+            os.rename(temp_directory, self._entry_directory(key))
+        except OSError:
+            # Added concurrently by another query
+            shutil.rmtree(temp_directory, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        """
+        Get information about the cache entries, least recently used first
+
+        :return: list of (str, dict)
+        """
+        entries = []
+        if not os.path.exists(self.directory):
+            return entries
+        for key in os.listdir(self.directory):
+            if key.startswith('.'):
+                continue
+            try:
+                with open(self._info_path(key), 'r') as f:
+                    info = json.load(f)
+                info['last_used'] = os.path.getmtime(self._info_path(key))
+            except (OSError, ValueError):
+                continue
+            entries.append((key, info))
+        entries.sort(key=lambda x: x[1]['last_used'])
+        return entries
+
+    def remove(self, key):
+        shutil.rmtree(self._entry_directory(key), ignore_errors=True)
+
+    def evict(self):
+        entries = self.entries()
+        total_size = sum(info['size'] for key, info in entries)
+        while entries:
+            over_entries = self.max_entries is not None and len(entries) > self.max_entries
+            over_size = self.max_size is not None and total_size > self.max_size
+            if not over_entries and not over_size:
+                break
+            key, info = entries.pop(0)
+            self.remove(key)
+            total_size -= info['size']
+
+    def invalidate(self, corpus_pk):
+        """
+        Remove all entries for a corpus, i.e. after its data has been changed by an enrichment
+        """
+        for key, info in self.entries():
+            if info['corpus'] == corpus_pk:
+                self.remove(key)
+
+
+def get_result_cache():
+    """
+    Get the result cache configured in the settings, or None if caching is disabled (POLYGLOT_QUERY_CACHE_ENTRIES = 0)
+    """
+    max_entries = getattr(settings, 'POLYGLOT_QUERY_CACHE_ENTRIES', 100)
+    if not max_entries:
+        return None
+    directory = getattr(settings, 'POLYGLOT_QUERY_CACHE_DIRECTORY', None)
+    if directory is None:
+        directory = os.path.join(settings.POLYGLOT_QUERY_DIRECTORY, 'cache')
+    return ResultCache(directory, max_entries=max_entries,
+                       max_size=getattr(settings, 'POLYGLOT_QUERY_CACHE_SIZE', 5 * 1024 ** 3))
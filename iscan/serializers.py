@@ -1,6 +1,10 @@
+import collections
+
 from rest_framework import serializers
+from rest_framework.fields import is_simple_callable
 from django.contrib.auth.models import Group, User
 from . import models
+from .utils import hierarchy_fingerprint
 
 from polyglotdb.exceptions import GraphQueryError
 
@@ -341,6 +345,180 @@ def serializer_factory(hierarchy, a_type, positions=None, exclude=None, acoustic
     return type(base)(class_name, (base,), attrs)
 
 
+COMPILED_SERIALIZER_CACHE_SIZE = 128
+
+# Fields that acoustic tracks are serialized to
+ACOUSTIC_TRACK_FIELDS = {'pitch': 'pitch_track', 'formants': 'formant_track'}
+
+_compiled_serializers = collections.OrderedDict()
+
+
+def _to_boolean(value):
+    if value in serializers.BooleanField.TRUE_VALUES:
+        return True
+    elif value in serializers.BooleanField.FALSE_VALUES:
+        return False
+    return bool(value)
+
+
+def _to_list(value):
+    return list(value)
+
+
+def _to_dict(value):
+    return {str(k): v for k, v in value.items()}
+
+
+_scalar_converters = {str: str, float: float, int: int, bool: _to_boolean}
+
+
+def _scalar_fields(properties, exclude=None):
+    fields = []
+    for prop, t in properties:
+        if exclude is not None and prop in exclude:
+            continue
+        fields.append((prop, _scalar_converters.get(t, None)))
+    return fields
+
+
+def _object_serializer(fields):
+    """
+    Create a function serializing an object's attributes, where fields is a list of attribute names and functions
+    converting non-null values (or None to pass values through unchanged)
+    """
+    fields = tuple(fields)
+
+    def serialize(instance):
+        ret = {}
+        for name, convert in fields:
+            value = getattr(instance, name)
+            if callable(value) and is_simple_callable(value):
+                value = value()
+            if value is None:
+                ret[name] = None
+            elif convert is None:
+                ret[name] = value
+            else:
+                ret[name] = convert(value)
+        return ret
+
+    return serialize
+
+
+def _many_serializer(serialize):
+    def serialize_many(values):
+        return [serialize(x) for x in values]
+
+    return serialize_many
+
+
+_pitch_point_serializer = _many_serializer(_object_serializer(
+    [('time', float), ('F0', float), ('F0_relativized', float)]))
+
+_formant_point_serializer = _many_serializer(_object_serializer(
+    [('time', float), ('F1', float), ('F2', float), ('F3', float)]))
+
+
+def _compile_serializer(hierarchy, version, a_type, positions=None, exclude=None, acoustic_columns=None,
+                        with_waveform=False, with_spectrogram=False, with_higher_annotations=False,
+                        with_lower_annotations=False, top_level=False, detail=False, with_subannotations=False):
+    key = (version, a_type,
+           None if positions is None else tuple((k, tuple(v)) for k, v in sorted(positions.items())),
+           None if exclude is None else tuple(exclude),
+           None if acoustic_columns is None else tuple(acoustic_columns),
+           with_waveform, with_spectrogram, with_higher_annotations, with_lower_annotations, top_level, detail,
+           with_subannotations)
+    if key in _compiled_serializers:
+        _compiled_serializers.move_to_end(key)
+        return _compiled_serializers[key]
+    if acoustic_columns is None:
+        acoustic_columns = []
+    if exclude is None:
+        exclude = []
+    if a_type == 'discourse':
+        fields = _scalar_fields([x for x in hierarchy.discourse_properties if 'file_path' not in x[0]], exclude)
+    elif a_type == 'speaker':
+        fields = _scalar_fields(hierarchy.speaker_properties, exclude)
+    else:
+        a_fields = _scalar_fields(hierarchy.type_properties[a_type], exclude)
+        a_fields += _scalar_fields(hierarchy.token_properties[a_type], exclude)
+        a_fields = [x for x in a_fields if x[0] != 'id']
+        a_fields.append(('id', str))
+        for a_column in acoustic_columns:
+            if a_column == 'pitch':
+                a_fields.append((ACOUSTIC_TRACK_FIELDS[a_column], _pitch_point_serializer))
+            elif a_column == 'formants':
+                a_fields.append((ACOUSTIC_TRACK_FIELDS[a_column], _formant_point_serializer))
+        if with_waveform:
+            a_fields.append(('waveform', _to_list))
+        if with_spectrogram:
+            a_fields.append(('spectrogram', _to_dict))
+        if with_subannotations and a_type in hierarchy.subannotations:
+            for s in hierarchy.subannotations[a_type]:
+                s_fields = _scalar_fields(hierarchy.subannotation_properties[s])
+                s_fields = [x for x in s_fields if x[0] != 'id']
+                s_fields.append(('id', str))
+                a_fields.append((s, _many_serializer(_object_serializer(s_fields))))
+        fields = []
+        if top_level:
+            if detail:
+                fields = a_fields
+            else:
+                if positions is not None:
+                    s = _object_serializer(a_fields)
+                    fields.append((a_type, _object_serializer([(p, s) for p in positions[a_type]])))
+                else:
+                    fields.append((a_type, _object_serializer(a_fields)))
+            fields.append(('speaker', _compile_serializer(hierarchy, version, 'speaker')))
+            fields.append(('discourse', _compile_serializer(hierarchy, version, 'discourse',
+                                                            exclude=['duration', "vowel_file_path", "file_path",
+                                                                     "consonant_file_path",
+                                                                     "low_freq_file_path"])))
+        else:
+            if positions is not None:
+                s = _object_serializer(a_fields)
+                fields = [(p, s) for p in positions[a_type]]
+            else:
+                fields = a_fields
+        if with_higher_annotations:
+            supertype = hierarchy[a_type]
+            while supertype is not None:
+                fields.append((supertype, _compile_serializer(hierarchy, version, supertype, positions=positions,
+                                                              with_subannotations=with_subannotations)))
+                supertype = hierarchy[supertype]
+        if with_lower_annotations:
+            subs = hierarchy.get_lower_types(a_type)
+            for s in subs:
+                fields.append((s, _many_serializer(_compile_serializer(hierarchy, version, s,
+                                                                       with_subannotations=with_subannotations))))
+    # Later fields replace earlier ones with the same name, as with the attributes of the generated classes
+    deduplicated = collections.OrderedDict()
+    for name, convert in fields:
+        deduplicated.pop(name, None)
+        deduplicated[name] = convert
+    serialize = _object_serializer(deduplicated.items())
+    _compiled_serializers[key] = serialize
+    while len(_compiled_serializers) > COMPILED_SERIALIZER_CACHE_SIZE:
+        _compiled_serializers.popitem(last=False)
+    return serialize
+
+
+def compile_serializer(hierarchy, a_type, **kwargs):
+    """
+    Compiled equivalent of :func:`serializer_factory`, taking the same arguments.
+
+    Rather than generating DRF serializer classes, this returns a plain function converting an annotation to the same
+    dictionary that ``serializer_factory(hierarchy, a_type, **kwargs)(annotation).data`` produces, without the per-field
+    overhead of DRF serializers.  Compiled functions are cached by the state of the hierarchy and the arguments, so
+    repeated calls for the same query are cheap.
+
+    :param hierarchy: :class:`~polyglotdb.structure.Hierarchy`
+    :param a_type: str
+    :return: callable
+    """
+    return _compile_serializer(hierarchy, hierarchy_fingerprint(hierarchy), a_type, **kwargs)
+
+
 class EnrichmentSerializer(serializers.ModelSerializer):
     enrichment_type = serializers.SerializerMethodField()
     runnable = serializers.SerializerMethodField()
@@ -368,12 +546,14 @@ class QuerySerializer(serializers.ModelSerializer):
     ordering = serializers.SerializerMethodField()
     positions = serializers.SerializerMethodField()
     export_available = serializers.SerializerMethodField()
+    export_format = serializers.SerializerMethodField()
 
     class Meta:
         model = models.Query
-        fields = ('id', 'name', 'user', 'corpus', 'annotation_type', 'result_count', 'running', 'filters',
+        fields = ('id', 'name', 'user', 'corpus', 'annotation_type', 'result_count', 'estimated_count', 'running',
+                  'filters',
                   'positions',
-                  'columns', 'column_names', 'acoustic_columns', 'ordering', 'export_available')
+                  'columns', 'column_names', 'acoustic_columns', 'ordering', 'export_available', 'export_format')
 
     def get_annotation_type(self, obj):
         return obj.get_annotation_type_display()
@@ -398,3 +578,6 @@ class QuerySerializer(serializers.ModelSerializer):
 
     def get_export_available(self, obj):
         return obj.config.get('export_available', False)
+
+    def get_export_format(self, obj):
+        return obj.config.get('export_format', 'csv')
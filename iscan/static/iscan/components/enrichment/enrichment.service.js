@@ -12,6 +12,10 @@ angular.module('iscan.enrichment')
             return $http.post(base_url + corpus_id + '/enrichment/' + id + '/run/', {});
         };
 
+        Enrichment.run_pipeline = function(corpus_id, ids) {
+            return $http.post(base_url + corpus_id + '/enrichment/run_pipeline/', {enrichments: ids});
+        };
+
         Enrichment.reset = function(corpus_id, id) {
             return $http.post(base_url + corpus_id + '/enrichment/' + id + '/reset/', {});
         };
@@ -850,10 +850,12 @@ angular.module('iscan.query').filter('secondsToDateTime', [function () {
                 const visible_end = xt.invert(width);
                 const xGridSize = xt(scope.data.time_step) - xt(0) + 2;
                 const yGridSize = y(scope.data.freq_step) - y(0) - 2;
+                // Frames start on a multiple of the time step, which can be before the utterance begins
+                const first_frame = scope.data.begin !== undefined ? scope.data.begin : scope.begin;
                 scope.data.values.forEach((row, i) => {
                     row.forEach((power,j) => {
                         //drawRect
-                        time = j * scope.data.time_step + scope.begin;
+                        time = j * scope.data.time_step + first_frame;
                         if (time >= visible_begin - 0.01 && time <= visible_end + 0.01) {
                             freq = i * scope.data.freq_step;
                             specgram_context.fillStyle = z(power);
@@ -915,7 +917,7 @@ angular.module('iscan.query').filter('secondsToDateTime', [function () {
                 if (!newVal) return;
 
                 y.domain([0, (newVal.num_freq_bins+1)*newVal.freq_step]);
-                z.domain(d3.extent(newVal.values.flat()));
+                z.domain([d3.min(newVal.values, row => d3.min(row)), d3.max(newVal.values, row => d3.max(row))]);
                 specgram_context = specgram_canvas.node().getContext("2d");
 
                 specgram_svg.select('.xaxis').call(xaxis.scale(xt));
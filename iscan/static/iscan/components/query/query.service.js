@@ -7,9 +7,73 @@ angular.module('iscan.query')
     results: $resource(base_url + ':corpus_id/query/:id/results/')
   };
 }])
-    .service('Query', function ($http, $location, __env) {
+    .service('Query', function ($http, $q, $location, __env) {
         var base_url = __env.apiUrl + 'corpora/';
         var Query = {};
+        var ARRAYS_TYPE = 'application/vnd.iscan.arrays';
+        var TYPED_ARRAYS = {
+            uint8: Uint8Array,
+            int32: Int32Array,
+            float32: Float32Array,
+            float64: Float64Array
+        };
+
+        // Decode a response sent as typed arrays (see iscan/renderers.py), falling back to JSON for other responses
+        function decodeArrays(buffer, headersGetter) {
+            if (!buffer || !buffer.byteLength) return null;
+            if ((headersGetter('Content-Type') || '').indexOf(ARRAYS_TYPE) !== 0) {
+                return JSON.parse(new TextDecoder('utf-8').decode(buffer));
+            }
+            var view = new DataView(buffer);
+            var headerLength = view.getUint32(4, true);
+            var header = JSON.parse(new TextDecoder('utf-8').decode(new Uint8Array(buffer, 8, headerLength)));
+            var base = 8 + headerLength;
+            var arrays = header.arrays.map(function (a) {
+                var length = a.shape.reduce(function (x, y) {return x * y;}, 1);
+                var values = new TYPED_ARRAYS[a.dtype](buffer, base + a.offset, length);
+                if (a.shape.length < 2) return values;
+                // Matrices (i.e., spectrograms) become arrays of rows
+                var rows = [];
+                for (var i = 0; i < a.shape[0]; i++) {
+                    rows.push(values.subarray(i * a.shape[1], (i + 1) * a.shape[1]));
+                }
+                return rows;
+            });
+
+            function restore(value) {
+                if (Array.isArray(value)) return value.map(restore);
+                if (value === null || typeof value !== 'object') return value;
+                if ('__array__' in value) return arrays[value.__array__];
+                if ('__columns__' in value) {
+                    // Points (i.e., pitch tracks) are edited in place, so they go back to being objects
+                    var keys = Object.keys(value.__columns__);
+                    var columns = keys.map(function (k) {return arrays[value.__columns__[k].__array__];});
+                    var points = [];
+                    for (var i = 0; i < value.length; i++) {
+                        var point = {};
+                        keys.forEach(function (k, j) {
+                            point[k] = isNaN(columns[j][i]) ? null : columns[j][i];
+                        });
+                        points.push(point);
+                    }
+                    return points;
+                }
+                var restored = {};
+                Object.keys(value).forEach(function (k) {restored[k] = restore(value[k]);});
+                return restored;
+            }
+
+            return restore(header.data);
+        }
+
+        function binaryConfig(params) {
+            return {
+                params: params,
+                responseType: 'arraybuffer',
+                headers: {Accept: ARRAYS_TYPE + ', application/json;q=0.9'},
+                transformResponse: decodeArrays
+            };
+        }
         Query.paginateParams = {
                 id: 0,
                 page: 1,
@@ -72,42 +136,100 @@ angular.module('iscan.query')
         };
 
         Query.oneAnnotation = function (corpus_id, query_id, index, ordering, with_pitch) {
-            return $http.get(base_url + corpus_id + '/query/' + query_id + '/result/', {
-                params: {
+            return $http.get(base_url + corpus_id + '/query/' + query_id + '/result/', binaryConfig({
                     index: index,
                     ordering: ordering,
                     with_pitch: with_pitch,
-                }
-            });
+            }));
         };
 
         Query.oneWaveform = function (corpus_id, query_id, index, ordering) {
-            return $http.get(base_url + corpus_id + '/query/' + query_id + '/get_waveform/', {
-                params: {
+            return $http.get(base_url + corpus_id + '/query/' + query_id + '/get_waveform/', binaryConfig({
                     index: index,
                     ordering: ordering,
-                }
-            });
+            }));
         };
 
         Query.oneSpectrogram= function (corpus_id, query_id, index, ordering) {
-            return $http.get(base_url + corpus_id + '/query/' + query_id + '/get_spectrogram/', {
-                params: {
+            return $http.get(base_url + corpus_id + '/query/' + query_id + '/get_spectrogram/', binaryConfig({
                     index: index,
                     ordering: ordering,
-                }
+            }));
+        };
+
+        // Results after the current one that should already be loaded, otherwise the window around it is fetched
+        var DETAIL_LOOKAHEAD = 3;
+
+        // Details of the results around the one being viewed, so that stepping through them doesn't wait on the server
+        Query.clearDetails = function () {
+            Query.detailCache = {key: null, count: null, entries: {}};
+        };
+        Query.clearDetails();
+
+        Query.details = function (corpus_id, query_id, index, ordering) {
+            return $http.get(base_url + corpus_id + '/query/' + query_id + '/details/', binaryConfig({
+                    index: index,
+                    ordering: ordering,
+            }));
+        };
+
+        Query.discourseWaveform = function (corpus_id, media) {
+            return $http.get(base_url + corpus_id + '/discourses/waveform/', binaryConfig(media)).then(function (res) {
+                var waveform = res.data;
+                return Array.from(waveform.values, function (amplitude, i) {
+                    return {amplitude: amplitude, time: waveform.begin + i * waveform.time_step};
+                });
+            });
+        };
+
+        Query.discourseSpectrogram = function (corpus_id, media) {
+            return $http.get(base_url + corpus_id + '/discourses/spectrogram/', binaryConfig(media)).then(function (res) {
+                return res.data;
             });
         };
 
+        // Get the detail of one result (result row, utterance and media reference) from the cached window around it
+        Query.detail = function (corpus_id, query_id, index, ordering) {
+            var key = [corpus_id, query_id, ordering].join(':');
+            if (Query.detailCache.key !== key) {
+                Query.clearDetails();
+                Query.detailCache.key = key;
+            }
+            var cache = Query.detailCache;
+            var lookahead = index + DETAIL_LOOKAHEAD;
+            if (cache.count !== null) lookahead = Math.min(lookahead, cache.count - 1);
+            var request = null;
+            if (!(index in cache.entries) || !(lookahead in cache.entries)) {
+                request = Query.details(corpus_id, query_id, index, ordering).then(function (res) {
+                    if (!res.data) return null;
+                    cache.count = res.data.count;
+                    res.data.window.forEach(function (x) {
+                        cache.entries[x.index] = x;
+                        // Get the browser to cache the waveforms and spectrograms of the results coming up
+                        if (x.index > index && x.media) {
+                            Query.discourseWaveform(corpus_id, x.media).catch(angular.noop);
+                            Query.discourseSpectrogram(corpus_id, x.media).catch(angular.noop);
+                        }
+                    });
+                    return cache.entries[index];
+                });
+            }
+            // Utterances are modified by the detail view, so it gets its own copy
+            if (index in cache.entries) {
+                if (request !== null) request.catch(angular.noop);
+                return $q.resolve(angular.copy(cache.entries[index]));
+            }
+            return request.then(angular.copy);
+        };
+
         Query.generate_pitch_track = function (corpus_id, id, newPitchSetings) {
             newPitchSetings.utterance_id = id;
-            return $http.get(base_url + corpus_id + '/utterance_pitch_track/', {
-                params: newPitchSetings
-            });
+            return $http.get(base_url + corpus_id + '/utterance_pitch_track/', binaryConfig(newPitchSetings));
         };
 
         Query.save_pitch_track = function (corpus_id, id, new_track) {
             var data = {id: id, track:new_track};
+            Query.clearDetails();
             return $http.post(__env.apiUrl + 'corpora/' + corpus_id + '/save_utterance_pitch_track/', data);
 
         };
@@ -131,7 +253,13 @@ angular.module('iscan.query')
             return $http.get(base_url + corpus_id + '/query/' + id + '/get_export_csv/');
         };
 
+        Query.save_export_parquet = function (corpus_id, id) {
+
+            return $http.get(base_url + corpus_id + '/query/' + id + '/get_export_parquet/', {responseType: 'arraybuffer'});
+        };
+
         Query.commit_subannotation_changes = function (corpus_id, id,  subannotations){
+            Query.clearDetails();
             return $http.post(base_url + corpus_id + '/query/' + id + '/commit_subannotation_changes/', subannotations);
         };
 
@@ -3,7 +3,7 @@ angular.module('databaseList', [
     'iscan.corpora',
     'iscan.errors'
 ])
-    .controller('DatabaseListCtrl', function ($scope, Databases, Corpora, Errors, $state, $location, djangoAuth, Users, $mdDialog, $mdToast) {
+    .controller('DatabaseListCtrl', function ($scope, Databases, Corpora, Errors, $state, $location, djangoAuth, Users, $mdDialog, $mdToast, $timeout) {
         $scope.refresh_button_text = 'Refresh';
 
         $scope.refreshDatabaseList = function () {
@@ -20,6 +20,18 @@ angular.module('databaseList', [
             });
 
         };
+        // Starting and stopping happen in the background, so poll until the database leaves the transitional status
+        $scope.waitForStatus = function (db, transitional, delay) {
+            return Databases.one(db.id).then(function (res) {
+                if (res.data.status !== transitional) {
+                    return res.data;
+                }
+                return $timeout(function () {
+                    return $scope.waitForStatus(db, transitional, Math.min(delay * 2, 5000));
+                }, delay);
+            });
+        };
+
         $scope.startDatabase = function (db, ev) {
             db.busy = true;
             $mdToast.show(
@@ -29,14 +41,21 @@ angular.module('databaseList', [
                     .position("bottom right"));
 
             Databases.start(db.id).then(function (res) {
-
-                $mdToast.show(
-                    $mdToast.simple()
-                        .textContent('Database "' + db.name + '" successfully started!')
-                        .position("bottom right")
-                        .hideDelay(3000)
-                        .highlightAction(true));
-                $scope.refreshDatabases();
+                var task_id = res.headers("task");
+                return $scope.waitForStatus(db, 'Starting', 500).then(function (updated) {
+                    $scope.refreshDatabases();
+                    if (updated.status !== 'Running') {
+                        db.busy = false;
+                        if (task_id) Errors.checkForErrors(task_id);
+                        return;
+                    }
+                    $mdToast.show(
+                        $mdToast.simple()
+                            .textContent('Database "' + db.name + '" successfully started!')
+                            .position("bottom right")
+                            .hideDelay(3000)
+                            .highlightAction(true));
+                });
             }).catch(function (res) {
                 db.busy = false;
                 Errors.popUp("There was an error starting the database.", res);
@@ -53,14 +72,21 @@ angular.module('databaseList', [
                     .position("bottom right"));
 
             Databases.stop(db.id).then(function (res) {
-
-                $mdToast.show(
-                    $mdToast.simple()
-                        .textContent('Database "' + db.name + '" successfully stopped!')
-                        .position("bottom right")
-                        .hideDelay(3000)
-                        .highlightAction(true));
-                $scope.refreshDatabases();
+                var task_id = res.headers("task");
+                return $scope.waitForStatus(db, 'Stopping', 500).then(function (updated) {
+                    $scope.refreshDatabases();
+                    if (updated.status !== 'Stopped') {
+                        db.busy = false;
+                        if (task_id) Errors.checkForErrors(task_id);
+                        return;
+                    }
+                    $mdToast.show(
+                        $mdToast.simple()
+                            .textContent('Database "' + db.name + '" successfully stopped!')
+                            .position("bottom right")
+                            .hideDelay(3000)
+                            .highlightAction(true));
+                });
             }).catch(function (res) {
                 db.busy = false;
                 Errors.popUp("There was an error stopping the database.", res);
@@ -161,20 +161,21 @@ angular.module('queryDetail', [
 
 
     $scope.runQuery = function () {
-        Query.oneWaveform($stateParams.corpus_id, $stateParams.query_id, $scope.detail_index, $scope.paginateParams.ordering).then(function (res){
-            $scope.waveform = res.data.waveform;
-        })
-
-        Query.oneSpectrogram($stateParams.corpus_id, $stateParams.query_id, $scope.detail_index, $scope.paginateParams.ordering).then(function (res){
-            $scope.spectrogram = res.data.spectrogram;
-        })
-
-        Query.oneAnnotation($stateParams.corpus_id, $stateParams.query_id, $scope.detail_index, $scope.paginateParams.ordering, true).then(function (res) {
+        Query.detail($stateParams.corpus_id, $stateParams.query_id, $scope.detail_index, $scope.paginateParams.ordering).then(function (detail) {
+            if (!detail) return;
+            if (detail.media) {
+                Query.discourseWaveform($stateParams.corpus_id, detail.media).then(function (waveform) {
+                    $scope.waveform = waveform;
+                });
+                Query.discourseSpectrogram($stateParams.corpus_id, detail.media).then(function (spectrogram) {
+                    $scope.spectrogram = spectrogram;
+                });
+            }
             //List of subannotations where subannotations are a 3-array of annotation, subannotation and whether it is visible.
             $scope.subannotations = Object.keys($scope.hierarchy.subannotations)
                 .map(x => $scope.hierarchy.subannotations[x].map(y => [x, y, true]))
                 .flat(1);
-            $scope.utterance = res.data.utterance;
+            $scope.utterance = detail.utterance;
             $scope.utterance.viewableSubannotations = [];
             $scope.utterance.subannotations = $scope.subannotations;
             $scope.utterance.subannotation_list = {}
@@ -187,12 +188,12 @@ angular.module('queryDetail', [
                 const subannotation = x[1];
                 $scope.utterance.subannotation_list[annotation_type][subannotation] = [];
             });
-            $scope.selectedResult = res.data.result;
+            $scope.selectedResult = detail.result;
             $scope.speaker = $scope.selectedResult.speaker;
             $scope.discourse = $scope.selectedResult.discourse;
             $scope.utterance_id = $scope.utterance.id;
             if ($scope.selectedType == 'utterance'){
-                $scope.selectedAnnotation = res.data.utterance;
+                $scope.selectedAnnotation = detail.utterance;
             }
             else{
                 $scope.selectedAnnotation = $scope.selectedResult[$scope.selectedType].current;
@@ -551,9 +551,20 @@ angular.module('query', [
         $scope.save_export = function () {
             $scope.exporting = true;
             console.log($scope.query)
-            Query.save_export($stateParams.corpus_id, $stateParams.query_id).then(function (res) {
-                var data = new Blob([res.data], {type: 'text/plain;charset=utf-8'});
-                FileSaver.saveAs(data, $scope.query.name + ' export.csv');
+            var request;
+            if ($scope.query.export_format == 'parquet') {
+                request = Query.save_export_parquet($stateParams.corpus_id, $stateParams.query_id).then(function (res) {
+                    var data = new Blob([res.data], {type: 'application/vnd.apache.parquet'});
+                    FileSaver.saveAs(data, $scope.query.name + ' export.parquet');
+                });
+            }
+            else {
+                request = Query.save_export($stateParams.corpus_id, $stateParams.query_id).then(function (res) {
+                    var data = new Blob([res.data], {type: 'text/plain;charset=utf-8'});
+                    FileSaver.saveAs(data, $scope.query.name + ' export.csv');
+                });
+            }
+            request.then(function () {
                 $scope.exporting = false;
             }).catch(function (res) {
                 Errors.popUp("There was an error saving the export", res);
@@ -777,6 +788,10 @@ angular.module('query', [
                             cancelNextLoad();
                             return
                         }
+                        else if ($scope.query.running && $scope.query.result_count) {
+                            // Show the rows found so far while the rest of the query runs
+                            $scope.paginatorCallback();
+                        }
 
                     }
 
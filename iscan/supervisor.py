@@ -0,0 +1,315 @@
+import os
+import sys
+import json
+import time
+import errno
+import signal
+import socket
+import struct
+import logging
+import subprocess
+import urllib.request
+
+log = logging.getLogger(__name__)
+
+DEFAULT_START_TIMEOUT = 120
+DEFAULT_STOP_TIMEOUT = 60
+
+# Bolt handshake: the magic preamble followed by the four protocol versions the client supports
+BOLT_MAGIC = b'\x60\x60\xb0\x17'
+BOLT_VERSIONS = (4, 3, 2, 1)
+
+IS_WINDOWS = sys.platform.startswith('win')
+
+
+class SupervisorError(Exception):
+    pass
+
+
+def backoff_wait(probe, timeout, initial_delay=0.1, max_delay=5.0, factor=2.0):
+    """
+    Call a probe until it succeeds, sleeping between calls for exponentially longer up to max_delay
+
+    :param probe: callable
+        Returns True once the condition being waited on holds, and can raise to stop waiting early
+    :param timeout: float
+        Seconds to wait before giving up
+    :return: bool
+        Whether the probe succeeded before the timeout
+    """
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while True:
+        if probe():
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * factor, max_delay)
+
+
+def pid_alive(pid):
+    """
+    Check whether a process exists, reaping it first if it is an exited child of this process
+    """
+    if IS_WINDOWS:
+        from .utils import get_pids
+        return pid in get_pids()
+    try:
+        if os.waitpid(pid, os.WNOHANG)[0] == pid:
+            return False
+    except ChildProcessError:
+        pass
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def process_start_time(pid):
+    """
+    Get when a process started, in clock ticks since boot, or None where /proc isn't available.  Recorded along with
+    PIDs, so that a pidfile left behind by a crash or reboot isn't trusted once its PID has been reused.
+    """
+    try:
+        with open('/proc/{}/stat'.format(pid), 'r') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name can contain spaces, so fields are counted from after it
+    return int(stat[stat.rindex(')') + 2:].split()[19])
+
+
+def read_pidfile(path):
+    """
+    :return: dict or None
+        The PID and start time of the process, or None if there is no pidfile
+    """
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_pidfile(path, pid):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({'pid': pid, 'started': process_start_time(pid)}, f)
+    os.replace(temp_path, path)
+
+
+def remove_pidfile(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def bolt_ready(host, port, timeout=2.0):
+    """
+    Check whether Neo4j accepts Bolt connections, by doing the protocol handshake rather than only opening a socket
+    """
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as s:
+            s.sendall(BOLT_MAGIC + struct.pack('>IIII', *BOLT_VERSIONS))
+            version = s.recv(4)
+    except OSError:
+        return False
+    return len(version) == 4 and version != b'\x00\x00\x00\x00'
+
+
+def influxdb_ready(host, port, timeout=2.0):
+    """
+    Check whether InfluxDB answers its HTTP ping endpoint
+    """
+    try:
+        with urllib.request.urlopen('http://{}:{}/ping'.format(host, port), timeout=timeout) as response:
+            return response.status == 204
+    except (OSError, ValueError):
+        return False
+
+
+def port_in_use(host, port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        return s.connect_ex((host, port)) == 0
+
+
+class DatabaseSupervisor(object):
+    """
+    Starts and stops the Neo4j and InfluxDB processes of a :class:`~iscan.models.Database` directly
+
+    Both run in the foreground in their own session, so their PIDs are known from the start and they outlive the worker
+    that started them.  PIDs are kept in pidfiles in the database's directory, so that any process can stop them, and
+    readiness is established by probing the Bolt and HTTP ports with exponential backoff.
+    """
+    HOST = 'localhost'
+    SERVICES = ('neo4j', 'influxdb')
+
+    def __init__(self, database):
+        self.database = database
+
+    @property
+    def run_directory(self):
+        return os.path.join(self.database.directory, 'run')
+
+    def pidfile_path(self, service):
+        return os.path.join(self.run_directory, '{}.pid'.format(service))
+
+    def command(self, service):
+        if service == 'neo4j':
+            return [self.database.neo4j_exe_path, 'console']
+        return [self.database.influxdb_exe_path, '-config', self.database.influxdb_conf_path]
+
+    def log_path(self, service):
+        if service == 'neo4j':
+            return self.database.neo4j_log_path
+        return self.database.influxdb_log_path
+
+    def ports(self, service):
+        if service == 'neo4j':
+            return [self.database.neo4j_http_port, self.database.neo4j_bolt_port]
+        return [self.database.influxdb_http_port]
+
+    def ready(self, service):
+        if service == 'neo4j':
+            return bolt_ready(self.HOST, self.database.neo4j_bolt_port)
+        return influxdb_ready(self.HOST, self.database.influxdb_http_port)
+
+    def pid(self, service):
+        """
+        Get the PID of a running service, cleaning up its pidfile if the process is gone
+
+        :return: int or None
+        """
+        path = self.pidfile_path(service)
+        info = read_pidfile(path)
+        if info is None:
+            return None
+        started = info.get('started')
+        if not pid_alive(info['pid']) or (started is not None and process_start_time(info['pid']) != started):
+            remove_pidfile(path)
+            return None
+        return info['pid']
+
+    def pids(self):
+        return {service: self.pid(service) for service in self.SERVICES}
+
+    def _spawn(self, service):
+        for port in self.ports(service):
+            if port_in_use(self.HOST, port):
+                raise SupervisorError('The port {} is currently in use on this machine.  Please stop any other process'
+                                      ' using it so that the specified database can be run.'.format(port))
+        command = self.command(service)
+        kwargs = {}
+        if IS_WINDOWS:
+            kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs['start_new_session'] = True
+            kwargs['restore_signals'] = False
+        with open(self.log_path(service), 'a') as logf:
+            proc = subprocess.Popen(command, stdout=logf, stderr=logf, stdin=subprocess.DEVNULL, **kwargs)
+        write_pidfile(self.pidfile_path(service), proc.pid)
+        log.info('Started {} for {} with PID {}'.format(service, self.database.name, proc.pid))
+        return proc.pid
+
+    def start(self, timeout=DEFAULT_START_TIMEOUT):
+        """
+        Start whichever of Neo4j and InfluxDB aren't already running, and wait until both accept connections
+
+        :param timeout: float
+        :return: dict
+            PIDs of the services
+        :raises SupervisorError: if a service can't be started, exits, or isn't ready in time, in which case both are
+            stopped again
+        """
+        pids = {}
+        try:
+            for service in self.SERVICES:
+                pids[service] = self.pid(service) or self._spawn(service)
+
+            def probe():
+                for service, pid in pids.items():
+                    if not pid_alive(pid):
+                        raise SupervisorError('{} exited while starting, see {}'.format(service,
+                                                                                        self.log_path(service)))
+                return all(self.ready(service) for service in self.SERVICES)
+
+            if not backoff_wait(probe, timeout):
+                raise SupervisorError('The databases did not accept connections within {} seconds'.format(timeout))
+        except Exception:
+            self.stop()
+            raise
+        return pids
+
+    def _signal(self, pid, sig, group=True):
+        try:
+            if IS_WINDOWS:
+                os.kill(pid, signal.SIGTERM)
+            elif group:
+                # Each service is the leader of its own process group, which includes anything it started
+                os.killpg(pid, sig)
+            else:
+                os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+
+    def _stop_unsupervised(self, service, pid):
+        """
+        Ask a service that wasn't started by the supervisor to shut down, i.e. one started with ``neo4j start`` before
+        pidfiles were kept, which isn't the leader of its own process group
+        """
+        if service == 'neo4j' and os.path.exists(self.database.neo4j_exe_path):
+            with open(self.log_path(service), 'a') as logf:
+                subprocess.call([self.database.neo4j_exe_path, 'stop'], stdout=logf, stderr=logf,
+                                stdin=subprocess.DEVNULL)
+        else:
+            self._signal(pid, signal.SIGTERM if service == 'neo4j' else signal.SIGINT, group=False)
+
+    def stop(self, timeout=DEFAULT_STOP_TIMEOUT, fallback_pids=None):
+        """
+        Ask Neo4j and InfluxDB to shut down, killing them if they haven't exited after the timeout
+
+        :param timeout: float
+        :param fallback_pids: dict, optional
+            PIDs recorded elsewhere for services that have no pidfile, i.e. the ones stored on the database for
+            services started before pidfiles were kept
+        """
+        pids = {}
+        groups = {}
+        for service in self.SERVICES:
+            if os.path.exists(self.pidfile_path(service)):
+                pid = self.pid(service)
+                if pid is not None:
+                    pids[service] = pid
+                    groups[service] = True
+                    # Neo4j shuts down cleanly on SIGTERM, InfluxDB on an interrupt
+                    self._signal(pid, signal.SIGTERM if service == 'neo4j' else signal.SIGINT)
+                continue
+            pid = (fallback_pids or {}).get(service)
+            if pid is not None and pid_alive(pid):
+                log.info('Stopping {} for {} with PID {}, which has no pidfile'.format(service, self.database.name,
+                                                                                      pid))
+                pids[service] = pid
+                groups[service] = False
+                self._stop_unsupervised(service, pid)
+
+        def probe():
+            return not any(pid_alive(pid) for pid in pids.values())
+
+        if not backoff_wait(probe, timeout):
+            log.warning('Killing the databases for {}, which did not stop within {} seconds'.format(
+                self.database.name, timeout))
+            for service, pid in pids.items():
+                self._signal(pid, getattr(signal, 'SIGKILL', signal.SIGTERM), group=groups[service])
+            backoff_wait(probe, 10)
+        for service in self.SERVICES:
+            remove_pidfile(self.pidfile_path(service))
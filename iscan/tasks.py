@@ -1,7 +1,8 @@
 from celery import shared_task, current_task
 from celery.app.task import Task
 from django.utils import timezone
-from .models import Corpus, Query, Enrichment, BackgroundTask, SpadeScript
+from .models import Database, Corpus, Query, Enrichment, BackgroundTask, SpadeScript
+from .pipeline import EnrichmentPipeline
 from .utils import run_spade_script
 
 import logging
@@ -19,7 +20,7 @@ class LoggingTask(Task):
         task.save()
         if log.isEnabledFor(logging.INFO):
             kwargs['exc_info'] = exc
-        log.error('Task % failed to execute', task_id, **kwargs)
+        log.error('Task %s failed to execute', task_id, **kwargs)
         super().on_failure(exc, task_id, args, kwargs, einfo)
 
     def on_success(self, retval, task_id, args, kwargs):
@@ -30,6 +31,24 @@ class LoggingTask(Task):
         task.save()
         super().on_success(retval, task_id, args, kwargs)
 
+@shared_task(base=LoggingTask)
+def start_database_task(database_pk):
+    database = Database.objects.get(pk=database_pk)
+    task = BackgroundTask.objects.create(task_id=current_task.request.id,
+        name = "Start database {}".format(database.name)
+        )
+    database.start()
+
+
+@shared_task(base=LoggingTask)
+def stop_database_task(database_pk):
+    database = Database.objects.get(pk=database_pk)
+    task = BackgroundTask.objects.create(task_id=current_task.request.id,
+        name = "Stop database {}".format(database.name)
+        )
+    database.stop()
+
+
 @shared_task
 def import_corpus_task(corpus_pk):
     corpus = Corpus.objects.get(pk=corpus_pk)
@@ -38,35 +57,64 @@ def import_corpus_task(corpus_pk):
         name = "Import corpus {}".format(corpus.name)
         )
     corpus.import_corpus()
+    corpus.refresh_from_db()
+    if corpus.imported:
+        build_pyramids_task.delay(corpus.pk)
 
 
-@shared_task
+@shared_task(base=LoggingTask)
+def build_pyramids_task(corpus_pk):
+    corpus = Corpus.objects.get(pk=corpus_pk)
+    task = BackgroundTask.objects.create(task_id=current_task.request.id,
+        corpus = corpus,
+        name = "Build waveforms and spectrograms for {}".format(corpus.name)
+        )
+    corpus.build_pyramids(task)
+
+
+@shared_task(base=LoggingTask)
 def run_query_task(query_id):
     query = Query.objects.get(pk=query_id)
     task = BackgroundTask.objects.create(task_id=current_task.request.id,
         corpus = query.corpus,
         name = "Run query {}".format(query.name)
         )
-    query.run_query()
+    query.run_query(task)
+
+
+@shared_task(base=LoggingTask)
+def update_query_tracks_task(query_id):
+    query = Query.objects.get(pk=query_id)
+    task = BackgroundTask.objects.create(task_id=current_task.request.id,
+        corpus = query.corpus,
+        name = "Update query {} tracks".format(query.name)
+        )
+    query.update_tracks(task)
 
 
 @shared_task
+def prefetch_detail_task(query_id, index, ordering, with_subannotations):
+    query = Query.objects.get(pk=query_id)
+    query.prefetch_detail(index, ordering, with_subannotations)
+
+
+@shared_task(base=LoggingTask)
 def run_query_export_task(query_id):
     query = Query.objects.get(pk=query_id)
     task = BackgroundTask.objects.create(task_id=current_task.request.id,
         corpus = query.corpus,
         name = "Export query {}".format(query.name)
         )
-    query.export_query()
+    query.export_query(task)
 
-@shared_task
+@shared_task(base=LoggingTask)
 def run_query_generate_subset_task(query_id):
     query = Query.objects.get(pk=query_id)
     task = BackgroundTask.objects.create(task_id=current_task.request.id,
         corpus = query.corpus,
         name = "Generate query {} subset".format(query.name)
         )
-    query.generate_subset()
+    query.generate_subset(task)
 
 @shared_task
 def run_enrichment_task(enrichment_id):
@@ -75,7 +123,18 @@ def run_enrichment_task(enrichment_id):
         corpus = enrichment.corpus,
         name = "Run enrichment {}".format(enrichment.name)
         )
-    enrichment.run_enrichment()
+    enrichment.run_enrichment(task)
+
+
+@shared_task(base=LoggingTask)
+def run_enrichment_pipeline_task(corpus_id, enrichment_ids):
+    corpus = Corpus.objects.get(pk=corpus_id)
+    enrichments = Enrichment.objects.filter(corpus=corpus, pk__in=enrichment_ids).all()
+    task = BackgroundTask.objects.create(task_id=current_task.request.id,
+        corpus = corpus,
+        name = "Run enrichment pipeline for {}".format(corpus.name)
+        )
+    EnrichmentPipeline(corpus, enrichments, task).run()
 
 
 @shared_task
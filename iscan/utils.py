@@ -128,3 +128,17 @@ def run_spade_script(script, target, reset=False, log=None):
 
     if results.returncode != 0:
         raise Exception("The script did not finish successfully")
+
+
+def hierarchy_fingerprint(hierarchy):
+    """
+    Get a short hash identifying the current state of a corpus hierarchy, which changes whenever annotation types,
+    properties, subannotations or subsets are added or removed
+
+    :param hierarchy: :class:`~polyglotdb.structure.Hierarchy`
+    :return: str
+    """
+    import json
+    import hashlib
+    data = json.dumps(hierarchy.to_json(), sort_keys=True, default=str)
+    return hashlib.sha1(data.encode('utf8')).hexdigest()
@@ -14,9 +14,10 @@ from django.conf import settings
 from django.views.generic import TemplateView
 
 from .models import Database, Corpus
+from . import columnar
+from .connections import CorpusContext
 
 
-from polyglotdb import CorpusContext
 from .serializers import UserSerializer
 from rest_framework.response import Response
 from rest_framework import generics, status
@@ -69,6 +70,7 @@ def save_pitch_track(request, corpus, utterance_id):
     data = json.loads(request.body)
     with CorpusContext(corpus.config) as c:
         c.update_utterance_pitch_track(utterance_id, data)
+    corpus.bump_data_version()
     return JsonResponse(data={'success': True})
 
 
@@ -148,6 +150,16 @@ def export_pitch_tracks(request, corpus):
         props = c.query_metadata(c.speaker).factors() + c.query_metadata(c.speaker).numerics()
         for p in props:
             q = q.columns(getattr(c.word.speaker, p).column_name('speaker_' + p))
+        if request.GET.get('format', 'csv') == 'parquet':
+            # One row per word with the track as list columns, rather than one row per pitch point
+            try:
+                columnar.check_available()
+            except columnar.ColumnarExportError as e:
+                return HttpResponse(str(e), status=400)
+            response = HttpResponse(content_type=columnar.PARQUET_CONTENT_TYPE)
+            response['Content-Disposition'] = 'attachment; filename="F0_tracks.parquet"'
+            response.write(columnar.parquet_bytes([q.all()]))
+            return response
         response = HttpResponse(content_type='text/csv')
         response['Content-Disposition'] = 'attachment; filename="F0_tracks.csv"'
 
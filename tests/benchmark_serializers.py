@@ -0,0 +1,41 @@
+"""
+Compare the generated DRF serializers with compiled serializers on synthetic query results.
+
+Run with ``python -m pytest -s tests/benchmark_serializers.py``.
+"""
+import time
+
+from iscan.serializers import serializer_factory, compile_serializer
+
+from .test_serializers import make_hierarchy, query_kwargs
+
+
+def time_function(function, repeats=3):
+    best = None
+    for i in range(repeats):
+        begin = time.perf_counter()
+        function()
+        duration = time.perf_counter() - begin
+        if best is None or duration < best:
+            best = duration
+    return best
+
+
+def test_benchmark_serializers(synthetic_phones):
+    hierarchy = make_hierarchy()
+    phones = synthetic_phones(num_utterances=250)
+
+    def factory():
+        return serializer_factory(hierarchy, 'phone', **query_kwargs)(phones, many=True).data
+
+    def compiled():
+        serialize = compile_serializer(hierarchy, 'phone', **query_kwargs)
+        return [serialize(x) for x in phones]
+
+    assert compiled() == factory()
+    factory_time = time_function(factory)
+    compiled_time = time_function(compiled)
+    print()
+    print('Serializing {} rows'.format(len(phones)))
+    print('serializer_factory: {:.3f}s'.format(factory_time))
+    print('compile_serializer: {:.3f}s ({:.1f}x faster)'.format(compiled_time, factory_time / compiled_time))
@@ -1,11 +1,14 @@
 import os
 import sys
+import random
 import pytest
 import selenium
 
 import django
 from django.core import management
 
+from polyglotdb.acoustics.classes import Track, TimePoint
+
 
 def pytest_configure(config):
     test_dir = os.path.dirname(os.path.abspath(__file__))
@@ -194,4 +197,177 @@ def pytest_runtest_setup(item):
     if "incremental" in item.keywords:
         previousfailed = getattr(item.parent, "_previousfailed", None)
         if previousfailed is not None:
-            pytest.xfail("previous test failed (%s)" % previousfailed.name)
\ No newline at end of file
+            pytest.xfail("previous test failed (%s)" % previousfailed.name)
+
+
+class SyntheticAnnotation(object):
+    """
+    Stand-in for PolyglotDB annotations that resolves attributes the same way, returning None for anything unknown
+    """
+
+    def __init__(self, a_type, **properties):
+        self._type = a_type
+        self._properties = properties
+        self._links = {}
+
+    def __getattr__(self, key):
+        if key.startswith('_'):
+            raise AttributeError(key)
+        if key in ('current', self._type):
+            return self
+        if key in self._links:
+            return self._links[key]
+        return self._properties.get(key, None)
+
+
+def make_phones(num_utterances=10, words_per_utterance=5, phones_per_word=4, seed=1234):
+    rng = random.Random(seed)
+    speakers = [SyntheticAnnotation('speaker', name='speaker_{}'.format(i), age=20 + i) for i in range(3)]
+    discourse = SyntheticAnnotation('discourse', name='discourse', duration=100.0, file_path='/fake.wav')
+    phones = []
+    time = 0
+    for i in range(num_utterances):
+        utterance = SyntheticAnnotation('utterance', id='u{}'.format(i), begin=time)
+        speaker = speakers[i % len(speakers)]
+        utterance_words = []
+        previous_phone = None
+        for j in range(words_per_utterance):
+            word = SyntheticAnnotation('word', id='u{}w{}'.format(i, j), label='word{}'.format(rng.randint(0, 50)),
+                                       transcription='a.b', begin=time, num_phones=phones_per_word)
+            word_phones = []
+            for k in range(phones_per_word):
+                phone = SyntheticAnnotation('phone', id='u{}w{}p{}'.format(i, j, k), label=rng.choice('aeiou'),
+                                            begin=time, end=time + 0.05, stressed=rng.random() > 0.5)
+                track = []
+                for t in range(5):
+                    point = TimePoint(time + t * 0.01)
+                    point.add_value('F0', 100 + rng.random() * 50)
+                    track.append(point)
+                bursts = [SyntheticAnnotation('burst', id='b{}'.format(len(phones)), begin=time, end=time + 0.01)]
+                phone._links.update({'word': word, 'utterance': utterance, 'speaker': speaker,
+                                     'discourse': discourse, 'pitch_track': track,
+                                     'burst': bursts if k == 0 else [], 'previous': previous_phone})
+                if previous_phone is not None:
+                    previous_phone._links['following'] = phone
+                previous_phone = phone
+                word_phones.append(phone)
+                phones.append(phone)
+                time += 0.05
+            word._links.update({'utterance': utterance, 'speaker': speaker, 'discourse': discourse,
+                                'phone': word_phones})
+            utterance_words.append(word)
+        utterance._properties['end'] = time
+        utterance._links.update({'speaker': speaker, 'discourse': discourse, 'word': utterance_words,
+                                 'phone': [p for w in utterance_words for p in w.phone]})
+    return phones
+
+
+@pytest.fixture
+def synthetic_phones():
+    """
+    Factory for phones of synthetic utterances, linked to their words, utterances, speakers and discourse the way
+    PolyglotDB query results are
+    """
+    return make_phones
+
+
+class SyntheticRecord(object):
+    def __init__(self, values, points=()):
+        self.values = values
+        self.track = Track()
+        for time, value in points:
+            point = TimePoint(time)
+            point.add_value('F0', value)
+            self.track.add(point)
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+
+class SyntheticResults(object):
+    """
+    Stands in for PolyglotDB query results, with the same columns and track layout
+    """
+
+    def __init__(self, records, track_columns=()):
+        self.records = records
+        self.track_columns = list(track_columns)
+        self.columns = ['word', 'begin', 'speaker'] + self.track_columns
+
+    def __iter__(self):
+        return iter(self.records)
+
+
+@pytest.fixture
+def synthetic_batches():
+    """
+    Two batches of query results with pitch tracks, including rows without a speaker, a track or a pitch value
+    """
+    first = SyntheticResults([
+        SyntheticRecord({'word': 'cat', 'begin': 0.5, 'speaker': 'one'}, [(0.51, 100.0), (0.52, 102.0)]),
+        SyntheticRecord({'word': 'cat', 'begin': 1, 'speaker': None}, []),
+    ], track_columns=['F0'])
+    second = SyntheticResults([
+        SyntheticRecord({'word': 'dog', 'begin': 2.25, 'speaker': 'two'}, [(2.3, None)]),
+    ], track_columns=['F0'])
+    return [first, second]
+
+
+class SyntheticCorpus(object):
+    """
+    Stands in for a :class:`~iscan.models.Corpus`, with its data directory laid out the same way
+    """
+
+    def __init__(self, data_directory, data_version=1):
+        self.pk = 1
+        self.name = 'acoustic'
+        self.data_directory = data_directory
+        self.data_version = data_version
+
+    @property
+    def hierarchy_snapshot_path(self):
+        return os.path.join(self.data_directory, 'hierarchy', '{}.json'.format(self.name))
+
+    @property
+    def catalog_path(self):
+        return os.path.join(self.data_directory, 'catalog', '{}.json'.format(self.name))
+
+
+@pytest.fixture
+def synthetic_corpus(tmpdir):
+    return SyntheticCorpus(str(tmpdir.join('data')))
+
+
+class SyntheticQuery(object):
+    """
+    Stands in for a :class:`~iscan.models.Query` with two results in each utterance
+    """
+
+    def __init__(self, directory, corpus, count):
+        self.directory = directory
+        self.corpus = corpus
+        self.count = count
+
+    def get_results(self, ordering, limit, offset):
+        return [{'index': i, 'utterance': {'current': {'id': 'u{}'.format(i // 2)}}}
+                for i in range(offset, min(offset + limit, self.count))]
+
+
+@pytest.fixture
+def synthetic_query(tmpdir, synthetic_corpus):
+    return SyntheticQuery(str(tmpdir.join('query')), synthetic_corpus, 40)
+
+
+class SyntheticDatabase(object):
+    """
+    Stands in for a :class:`~iscan.models.Database`, with its files kept under a temporary directory
+    """
+
+    def __init__(self, directory):
+        self.name = 'test'
+        self.directory = directory
+
+
+@pytest.fixture
+def synthetic_database(tmpdir):
+    return SyntheticDatabase(str(tmpdir))
@@ -6,11 +6,25 @@ from iscan.api import DatabaseViewSet
 from rest_framework.test import APIClient, APIRequestFactory
 from django.test import TestCase, override_settings
 from django.contrib.auth.models import Group, User
+import time
+
 import pytest
 
 factory = APIRequestFactory()
 
 
+def wait_for_status(name, transition, timeout=120):
+    """
+    Wait for a database to finish starting or stopping in its background task, and get its status
+    """
+    begin = time.time()
+    d = Database.objects.get(name=name)
+    while d.status == transition and time.time() - begin < timeout:
+        time.sleep(0.5)
+        d = Database.objects.get(name=name)
+    return d.status
+
+
 class CreateDatabaseTest(APILiveServerTestCase):
     def setUp(self):
         from rest_framework.authtoken.models import Token
@@ -98,16 +112,16 @@ class StartStopDatabaseTest(APILiveServerTestCase):
         response = self.csrf_client.post(reverse('iscan:databases-start', args=[self.database.id]),
                                          format='json')
         print(response, response.data)
-        assert response.status_code == status.HTTP_200_OK
-        d = Database.objects.get(name='test_database')
-        assert d.status == 'R'
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response['task']
+        assert wait_for_status('test_database', Database.STARTING) == Database.RUNNING
 
         response = self.csrf_client.post(reverse('iscan:databases-stop', args=[self.database.id]),
                                          format='json')
         print(response, response.data)
-        assert response.status_code == status.HTTP_200_OK
-        d = Database.objects.get(name='test_database')
-        assert d.status == 'S'
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response['task']
+        assert wait_for_status('test_database', Database.STOPPING) == Database.STOPPED
 
     def testGuestDatabaseStartStop(self):
         response = self.guest_csrf_client.post(reverse('iscan:databases-start', args=[self.database.id]),
@@ -128,16 +142,16 @@ class StartStopDatabaseTest(APILiveServerTestCase):
         response = self.allowed_csrf_client.post(reverse('iscan:databases-start', args=[self.database.id]),
                                          format='json')
         print(response, response.data)
-        assert response.status_code == status.HTTP_200_OK
-        d = Database.objects.get(name='test_database')
-        assert d.status == 'R'
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response['task']
+        assert wait_for_status('test_database', Database.STARTING) == Database.RUNNING
 
         response = self.allowed_csrf_client.post(reverse('iscan:databases-stop', args=[self.database.id]),
                                          format='json')
         print(response, response.data)
-        assert response.status_code == status.HTTP_200_OK
-        d = Database.objects.get(name='test_database')
-        assert d.status == 'S'
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response['task']
+        assert wait_for_status('test_database', Database.STOPPING) == Database.STOPPED
 
 
 class DeleteDatabaseTest(APILiveServerTestCase):
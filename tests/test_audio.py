@@ -0,0 +1,57 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from iscan.audio import AudioSegmentCache, available_codecs, LOCK_STRIPES
+
+sf = pytest.importorskip('soundfile')
+
+
+def cut(tmpdir, name, seconds=1, sr=16000):
+    path = str(tmpdir.join(name))
+    sf.write(path, np.sin(2 * np.pi * 200 * np.arange(sr * seconds) / sr) * 0.5, sr)
+    return path
+
+
+def test_cache_eviction(tmpdir):
+    size = os.path.getsize(cut(tmpdir, 'probe.wav'))
+    cache = AudioSegmentCache(str(tmpdir.join('cache')), max_size=int(size * 2.5))
+    first = cache.add(1, 'utt-1', 'consonant', 'wav', cut(tmpdir, 'a.wav'))
+    assert not os.path.exists(str(tmpdir.join('a.wav')))
+    cache.add(1, 'utt-2', 'consonant', 'wav', cut(tmpdir, 'b.wav'))
+    modified = os.path.getmtime(first)
+    # Use the first segment again, so the second one is evicted next
+    time.sleep(0.01)
+    assert cache.get(1, 'utt-1', 'consonant', 'wav') == first
+    assert os.path.getmtime(first) == modified
+    cache.add(2, 'utt-3', 'consonant', 'wav', cut(tmpdir, 'c.wav'))
+    assert cache.get(1, 'utt-2', 'consonant', 'wav') is None
+    assert cache.get(1, 'utt-1', 'consonant', 'wav') is not None
+    assert cache.get(2, 'utt-3', 'consonant', 'wav') is not None
+    cache.invalidate(2)
+    assert cache.get(2, 'utt-3', 'consonant', 'wav') is None
+    for i in range(200):
+        with cache.lock(1, 'utt-{}'.format(i), 'consonant', 'wav'):
+            pass
+    # Locks are shared between segments and kept apart from them
+    assert os.listdir(str(tmpdir.join('cache', '1'))) == ['utt-1_consonant.wav']
+    assert len(os.listdir(str(tmpdir.join('cache', '.locks')))) <= LOCK_STRIPES
+    assert [x[0] for x in cache.entries()] == [first]
+    with pytest.raises(ValueError):
+        cache.get(1, '../utt-1', 'consonant', 'wav')
+
+
+def test_compressed_segment(tmpdir):
+    if 'flac' not in available_codecs():
+        pytest.skip('FLAC is not supported by libsndfile')
+    cache = AudioSegmentCache(str(tmpdir.join('cache')))
+    source = cut(tmpdir, 'a.wav')
+    wav_size = os.path.getsize(source)
+    path = cache.add(1, 'utt-1', 'consonant', 'flac', source)
+    assert path.endswith('.flac')
+    assert os.path.getsize(path) < wav_size
+    data, sr = sf.read(path)
+    assert sr == 16000
+    assert len(data) == 16000
@@ -0,0 +1,17 @@
+from iscan.autocomplete import PrefixIndex
+
+
+def test_prefix_index():
+    index = PrefixIndex(['cat', 'Cats', 'catalog', 'dog', 'cat', None, 5, 'Ça'])
+    assert len(index) == 5
+    assert index.lookup('cat') == ['cat', 'catalog', 'Cats']
+    assert index.lookup('CAT', limit=1) == ['cat']
+    assert index.lookup('ça') == ['Ça']
+    assert index.lookup('x') == []
+    # Repeated lookups come from the result cache
+    assert index.lookup('cat') is index.lookup('Cat')
+
+
+def test_prefix_index_large():
+    index = PrefixIndex(['w{:06d}'.format(i) for i in range(100000)])
+    assert index.lookup('w0999') == ['w0999{:02d}'.format(i) for i in range(10)]
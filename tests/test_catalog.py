@@ -0,0 +1,19 @@
+from iscan.catalog import CorpusCatalog, catalog_value, invalidate_catalog
+
+
+def test_catalog_version(tmpdir):
+    path = str(tmpdir.join('catalog', 'acoustic.json'))
+    catalog = CorpusCatalog(path, 2, {'speakers': ['one', 'two']})
+    catalog.save()
+    assert CorpusCatalog.load(path, 2).entries == {'speakers': ['one', 'two']}
+    assert CorpusCatalog.load(path, 3).entries == {}
+
+
+def test_catalog_value(synthetic_corpus):
+    corpus = synthetic_corpus
+    corpus.data_version = 2
+    path = corpus.catalog_path
+    CorpusCatalog(path, 2, {'phone_set': ['aa', 'b']}).save()
+    assert catalog_value(corpus, 'phone_set') == ['aa', 'b']
+    invalidate_catalog(corpus)
+    assert CorpusCatalog.load(path, 2).entries == {}
@@ -0,0 +1,22 @@
+from iscan.checkpoints import EnrichmentCheckpoint
+
+
+def test_checkpoint(tmpdir):
+    path = str(tmpdir.join('checkpoint.json'))
+    config = {'enrichment_type': 'pitch', 'source': 'praat'}
+    checkpoint = EnrichmentCheckpoint(path, config)
+    checkpoint.complete('speaker_one')
+    checkpoint.start('speaker_two')
+
+    resumed = EnrichmentCheckpoint(path, config)
+    assert resumed.is_completed('speaker_one')
+    assert not resumed.is_completed('speaker_two')
+    assert resumed.started == 'speaker_two'
+
+    # A different config starts over
+    changed = EnrichmentCheckpoint(path, dict(config, source='reaper'))
+    assert not changed.is_completed('speaker_one')
+    assert changed.started is None
+
+    resumed.clear()
+    assert not EnrichmentCheckpoint(path, config).is_completed('speaker_one')
@@ -0,0 +1,35 @@
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+
+from iscan.columnar import results_to_table, write_parquet, merge_parquet
+
+
+def test_results_to_table(synthetic_batches):
+    table = results_to_table(synthetic_batches[0])
+    assert table.column_names == ['word', 'begin', 'speaker', 'time', 'F0']
+    assert pa.types.is_dictionary(table.schema.field('word').type)
+    assert table.column('time').to_pylist() == [[0.51, 0.52], []]
+    assert table.column('F0').to_pylist() == [[100.0, 102.0], []]
+
+
+def test_write_parquet(tmpdir, synthetic_batches):
+    path = str(tmpdir.join('export.parquet'))
+    assert write_parquet(synthetic_batches, path) == 3
+    table = pq.read_table(path)
+    assert table.column('word').to_pylist() == ['cat', 'cat', 'dog']
+    assert table.column('begin').to_pylist() == [0.5, 1.0, 2.25]
+    assert table.column('speaker').to_pylist() == ['one', None, 'two']
+    assert table.column('F0').to_pylist() == [[100.0, 102.0], [], [None]]
+
+
+def test_merge_parquet(tmpdir, synthetic_batches):
+    first, second = synthetic_batches
+    paths = [str(tmpdir.join('{}.parquet'.format(i))) for i in range(3)]
+    write_parquet([first], paths[0])
+    write_parquet([], paths[1])
+    write_parquet([second], paths[2])
+    merged = str(tmpdir.join('merged.parquet'))
+    assert merge_parquet(paths, merged) == 3
+    assert pq.read_table(merged).column('word').to_pylist() == ['cat', 'cat', 'dog']
@@ -0,0 +1,37 @@
+import polyglotdb
+from polyglotdb.config import CorpusConfig
+
+from iscan.connections import ConnectionManager, CorpusContext, connections
+
+
+def test_graph_driver_reused():
+    manager = ConnectionManager()
+    driver = manager.graph_driver('localhost', 7400)
+    assert manager.graph_driver('localhost', 7400) is driver
+    assert manager.graph_driver('localhost', 7401) is not driver
+    manager.close('localhost', 7400, 8400)
+    assert ('graph', 'localhost', 7400) not in manager.graph_drivers
+    assert ('graph', 'localhost', 7401) in manager.graph_drivers
+    manager.close('localhost', 7401, 8401)
+
+
+def test_pools_not_shared_after_fork():
+    manager = ConnectionManager()
+    driver = manager.graph_driver('localhost', 7400)
+    # As seen from a forked worker process
+    manager.pid = -1
+    assert manager.graph_driver('localhost', 7400) is not driver
+    driver.close()
+    manager.close('localhost', 7400, 8400)
+
+
+def test_corpus_context_uses_pooled_driver():
+    config = CorpusConfig('test', graph_bolt_port=7402)
+    context = CorpusContext(config)
+    assert context.graph_driver is connections.graph_driver(config.host, 7402)
+    assert context.corpus_name == 'test'
+    # Contexts that aren't pooled still open a driver of their own
+    other = polyglotdb.CorpusContext(config)
+    assert other.graph_driver is not context.graph_driver
+    other.graph_driver.close()
+    connections.close(config.host, 7402, config.acoustic_http_port)
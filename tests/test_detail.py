@@ -0,0 +1,42 @@
+import os
+
+from iscan.detail import UtteranceDetailCache, media_reference, claim_prefetch
+
+
+def make_detail(utterance_id):
+    return {'id': utterance_id, 'begin': 1.5, 'end': 2.25, 'discourse': {'name': 'cained'},
+            'pitch_track': [{'time': 1.5, 'F0': 110.0}]}
+
+
+def test_detail_cache(synthetic_corpus):
+    corpus = synthetic_corpus
+    corpus.data_version = 3
+    cache = UtteranceDetailCache(corpus)
+    cache.max_entries = 2
+    assert cache.get(['a']) == {}
+    cache.add({'a': make_detail('a')})
+    cache.add({'b': make_detail('b'), 'c': make_detail('c')})
+    found = cache.get(['a', 'b', 'c'])
+    assert len(found) == 2
+    assert found['c'] == make_detail('c')
+    assert media_reference(found['c']) == {'discourse': 'cained', 'begin': 1.5, 'end': 2.25}
+
+    # Details for a newer version of the data replace the old ones
+    corpus.data_version = 4
+    newer = UtteranceDetailCache(corpus)
+    assert newer.get(['c']) == {}
+    newer.add({'c': make_detail('c')})
+    assert os.listdir(os.path.join(corpus.data_directory, 'detail', 'acoustic')) == ['4']
+
+
+def test_claim_prefetch(synthetic_query):
+    query = synthetic_query
+    assert claim_prefetch(query, 0)
+    # Already queued
+    assert not claim_prefetch(query, 0)
+    assert claim_prefetch(query, 0, ordering='-phone.label')
+    assert claim_prefetch(query, 0, max_age=-1)
+    # Nothing left to prefetch once the next window's utterances are cached
+    UtteranceDetailCache(query.corpus).add({'u{}'.format(i): make_detail('u{}'.format(i)) for i in range(20)})
+    assert not claim_prefetch(query, 1)
+    assert not claim_prefetch(query, 40)
@@ -0,0 +1,40 @@
+from polyglotdb.structure import Hierarchy
+
+from iscan.hierarchy import load_snapshot, save_snapshot, corpus_hierarchy, invalidate_hierarchy
+
+
+def make_hierarchy():
+    hierarchy = Hierarchy({'phone': 'word', 'word': 'utterance', 'utterance': None}, corpus_name='acoustic')
+    hierarchy.subset_types['phone'] = {'syllabic'}
+    hierarchy.acoustic_properties['pitch'] = {('F0', float)}
+    return hierarchy
+
+
+def test_snapshot_round_trip(tmpdir):
+    path = str(tmpdir.join('hierarchy', 'acoustic.json'))
+    save_snapshot(path, 3, make_hierarchy())
+    hierarchy = load_snapshot(path, 3)
+    assert hierarchy.corpus_name == 'acoustic'
+    assert 'utterance' in hierarchy.annotation_types
+    assert hierarchy.has_type_subset('phone', 'syllabic')
+    assert 'pitch' in hierarchy.acoustics
+
+
+def test_snapshot_version(tmpdir):
+    path = str(tmpdir.join('acoustic.json'))
+    assert load_snapshot(path, 0) is None
+    save_snapshot(path, 3, make_hierarchy())
+    assert load_snapshot(path, 4) is None
+
+
+def test_corpus_hierarchy(synthetic_corpus):
+    corpus = synthetic_corpus
+    corpus.data_version = 3
+    path = corpus.hierarchy_snapshot_path
+    save_snapshot(path, 3, make_hierarchy())
+    hierarchy = corpus_hierarchy(corpus)
+    assert hierarchy.has_type_subset('phone', 'syllabic')
+    # Later reads come from memory
+    assert corpus_hierarchy(corpus) is hierarchy
+    invalidate_hierarchy(corpus)
+    assert load_snapshot(path, 3) is None
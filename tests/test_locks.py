@@ -0,0 +1,88 @@
+import os
+import sys
+import json
+import socket
+import threading
+import subprocess
+import time
+
+import pytest
+
+from iscan import locks
+from iscan.locks import TaskLock, LockTimeout
+
+
+def test_lock_timeout(tmpdir):
+    path = str(tmpdir.join('lockfile'))
+    holder = TaskLock(path)
+    assert holder.acquire()
+    with open(holder.owner_path) as f:
+        assert json.load(f)['pid'] == os.getpid()
+    with pytest.raises(LockTimeout):
+        TaskLock(path, timeout=0.2).acquire()
+    holder.release()
+    assert not os.path.exists(holder.owner_path)
+    with TaskLock(path, timeout=0.2) as lock:
+        assert lock.locked
+    assert not lock.locked
+
+
+def test_held_lock_is_not_broken(tmpdir):
+    path = str(tmpdir.join('lockfile'))
+    holder = TaskLock(path)
+    holder.acquire()
+    # An owner that looks dead doesn't matter while its flock is held
+    with open(holder.owner_path, 'w') as f:
+        json.dump({'task_id': None, 'host': socket.gethostname(), 'pid': 2 ** 22 + 1}, f)
+    with pytest.raises(LockTimeout):
+        TaskLock(path, timeout=0.3).acquire()
+    assert os.path.exists(path)
+    holder.release()
+
+
+def test_lock_of_dead_process_is_released(tmpdir):
+    path = str(tmpdir.join('lockfile'))
+    code = 'import os; from iscan.locks import TaskLock; TaskLock({!r}).acquire(); os._exit(0)'.format(path)
+    subprocess.check_call([sys.executable, '-c', code])
+    with TaskLock(path, timeout=1) as lock:
+        assert lock.locked
+
+
+def test_stale_lock_is_broken_without_flock(tmpdir, monkeypatch):
+    monkeypatch.setattr(locks, 'fcntl', None)
+    path = str(tmpdir.join('lockfile'))
+    with open(path, 'w') as f:
+        json.dump({'task_id': None, 'token': 'dead', 'host': socket.gethostname(), 'pid': 2 ** 22 + 1}, f)
+    waiter = TaskLock(path, timeout=1)
+    assert waiter.acquire()
+    assert waiter.read_owner()['token'] == waiter.token
+    with pytest.raises(LockTimeout):
+        TaskLock(path, timeout=0.3).acquire()
+    waiter.release()
+    assert not os.path.exists(path)
+
+
+def test_queued_runs_are_coalesced(tmpdir):
+    path = str(tmpdir.join('lockfile'))
+    queue_path = str(tmpdir.join('run.queue'))
+    holder = TaskLock(path, queue_path=queue_path)
+    assert holder.acquire()
+    results = {}
+
+    def run(name):
+        lock = TaskLock(path, task_id=name, queue_path=queue_path, timeout=5)
+        results[name] = lock.acquire()
+        if results[name]:
+            lock.release()
+
+    first = threading.Thread(target=run, args=('first',))
+    first.start()
+    time.sleep(0.1)
+    second = threading.Thread(target=run, args=('second',))
+    second.start()
+    time.sleep(0.1)
+    assert holder.has_pending()
+    holder.release()
+    first.join()
+    second.join()
+    assert results == {'first': False, 'second': True}
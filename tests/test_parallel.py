@@ -0,0 +1,59 @@
+import threading
+
+from django.test import override_settings
+
+import conch.main
+
+from iscan import parallel
+
+
+@override_settings(POLYGLOT_ENRICHMENT_JOBS=16, CELERY_WORKER_CONCURRENCY=4, POLYGLOT_ENRICHMENT_JOB_MEMORY=1)
+def test_enrichment_jobs():
+    # The server's jobs are shared between worker processes
+    assert parallel.enrichment_jobs() == 4
+    assert parallel.enrichment_jobs(2) == 2
+    assert parallel.enrichment_jobs(100) == 4
+    assert parallel.enrichment_jobs('') == 4
+
+
+@override_settings(POLYGLOT_ENRICHMENT_JOBS=16, POLYGLOT_ENRICHMENT_JOB_MEMORY=1)
+def test_enrichment_jobs_default_concurrency(monkeypatch):
+    # Without a configured concurrency, Celery starts a worker process per core
+    monkeypatch.setattr(parallel.os, 'cpu_count', lambda: 8)
+    assert parallel.worker_concurrency() == 8
+    assert parallel.enrichment_jobs() == 2
+
+
+@override_settings(POLYGLOT_ENRICHMENT_JOBS=16, POLYGLOT_ENRICHMENT_JOB_MEMORY=2 ** 50)
+def test_enrichment_jobs_memory():
+    assert parallel.enrichment_jobs() == 1
+    assert not parallel.use_multiprocessing(1)
+
+
+def test_limit_jobs():
+    original = conch.main.cpu_count
+    for jobs in range(1, 40):
+        with parallel.limit_jobs(jobs):
+            assert int((3 * conch.main.cpu_count()) / 4) == jobs
+    assert conch.main.cpu_count is original
+
+
+def test_limit_jobs_per_thread():
+    original = conch.main.cpu_count
+    inside = threading.Barrier(2)
+    seen = {}
+
+    def run(jobs):
+        with parallel.limit_jobs(jobs):
+            # Both threads hold their limits at the same time
+            inside.wait(timeout=5)
+            seen[jobs] = int((3 * conch.main.cpu_count()) / 4)
+            inside.wait(timeout=5)
+
+    threads = [threading.Thread(target=run, args=(jobs,)) for jobs in (2, 6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert seen == {2: 2, 6: 6}
+    assert conch.main.cpu_count is original
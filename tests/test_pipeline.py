@@ -0,0 +1,86 @@
+import threading
+
+import conch.main
+
+from iscan.parallel import limit_jobs
+from iscan.pipeline import build_graph, topological_order, requirements, lane, EnrichmentPipeline
+
+
+def test_requirements_match_runnable_messages():
+    assert [x.message for x in requirements({'enrichment_type': 'utterances'})] == ['Must encode pauses']
+    assert [x.message for x in requirements({'enrichment_type': 'syllables'})] == ['Must encode syllabic']
+    assert [x.message for x in requirements({'enrichment_type': 'vot'})] == ['Must encode utterances']
+    assert requirements({'enrichment_type': 'pauses'}) == []
+
+
+def test_build_graph():
+    configs = {
+        'pauses': {'enrichment_type': 'pauses'},
+        'utterances': {'enrichment_type': 'utterances'},
+        'syllabics': {'enrichment_type': 'subset', 'annotation_type': 'phone', 'subset_label': 'syllabic'},
+        'syllables': {'enrichment_type': 'syllables', 'phone_class': 'syllabic'},
+        'pitch': {'enrichment_type': 'pitch'},
+        'relativize_pitch': {'enrichment_type': 'relativize_pitch'},
+        'speaker_csv': {'enrichment_type': 'speaker_csv', 'path': 'speakers.csv'},
+    }
+    graph = build_graph(configs)
+    assert graph['pauses'] == set()
+    assert graph['utterances'] == {'pauses'}
+    assert graph['syllables'] == {'syllabics'}
+    assert graph['pitch'] == {'utterances'}
+    assert graph['relativize_pitch'] == {'pitch'}
+    assert graph['speaker_csv'] == set()
+    order = topological_order(graph)
+    assert order.index('pauses') < order.index('utterances') < order.index('pitch') < order.index('relativize_pitch')
+    assert lane(configs['pitch']) == 'acoustic'
+    assert lane(configs['syllables']) == 'graph'
+
+
+def test_topological_order_cycle():
+    assert topological_order({'a': {'b'}, 'b': {'a'}, 'c': set()}) == ['c']
+
+
+class FakeCorpus(object):
+    busy = False
+
+    def save(self):
+        pass
+
+    def refresh_from_db(self):
+        pass
+
+
+class FakeEnrichment(object):
+    runnable = 'runnable'
+    completed = False
+
+    def __init__(self, pk, config, work):
+        self.pk = pk
+        self.name = config['enrichment_type']
+        self.config = config
+        self.work = work
+
+    def run_enrichment(self, keep_busy=False):
+        self.work(self)
+        self.completed = True
+
+    def refresh_from_db(self):
+        pass
+
+
+def test_pipeline_runs_lanes_concurrently():
+    # Each enrichment waits until the other one is running, so they only complete if the lanes overlap, including
+    # while both hold a limit on their analysis jobs
+    both_running = threading.Barrier(2)
+    seen = {}
+
+    def step(enrichment):
+        with limit_jobs(enrichment.pk):
+            both_running.wait(timeout=5)
+            seen[enrichment.pk] = int((3 * conch.main.cpu_count()) / 4)
+
+    enrichments = [FakeEnrichment(1, {'enrichment_type': 'speaker_csv', 'path': 'speakers.csv'}, step),
+                   FakeEnrichment(2, {'enrichment_type': 'relativize_pitch'}, step)]
+    pipeline = EnrichmentPipeline(FakeCorpus(), enrichments)
+    assert pipeline.run() == {1: 'done', 2: 'done'}
+    assert seen == {1: 1, 2: 2}
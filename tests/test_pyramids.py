@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from iscan.pyramids import waveform_levels, spectrogram_blocks, waveform_points, DiscoursePyramid, LEVEL_FACTOR
+
+sf = pytest.importorskip('soundfile')
+
+
+def test_waveform_levels():
+    signal = np.sin(np.linspace(0, 100, 10001))
+    levels = waveform_levels(signal)
+    assert levels[0].dtype == np.float16
+    assert len(levels[0]) == 10001
+    assert levels[1].shape == (2501, 2)
+    assert len(levels[-1]) >= 512
+    assert np.all(levels[1][:, 0] <= levels[1][:, 1])
+    np.testing.assert_allclose(levels[1][0], [signal[:4].min(), signal[:4].max()], atol=1e-3)
+
+
+def test_spectrogram_blocks():
+    sr = 16000
+    signal = np.sin(2 * np.pi * 1000 * np.arange(sr) / sr)
+    blocks, num_frames, num_bins, freq_step = spectrogram_blocks(signal, sr, 0.005)
+    frames = np.concatenate(list(blocks))
+    assert frames.shape == (num_frames, num_bins) == (201, 129)
+    # Most of the power is at 1000 Hz
+    assert abs(np.argmax(frames[100]) * freq_step - 1000) <= freq_step
+
+
+def test_build(tmpdir):
+    low_freq_path = str(tmpdir.join('low_freq.wav'))
+    consonant_path = str(tmpdir.join('consonant.wav'))
+    sf.write(low_freq_path, np.sin(2 * np.pi * 100 * np.arange(2000 * 10) / 2000) * 0.5, 2000)
+    sf.write(consonant_path, np.sin(2 * np.pi * 1000 * np.arange(16000 * 10) / 16000) * 0.5, 16000)
+    directory = str(tmpdir.join('pyramid'))
+    pyramid = DiscoursePyramid.build(directory, low_freq_path, consonant_path, time_step=0.005)
+
+    waveform = pyramid.waveform(1.0, 1.5)
+    assert waveform['level'] == 0
+    assert waveform['begin'] == pytest.approx(1.0)
+    assert len(waveform['values']) == 1000
+    points = waveform_points(waveform)
+    assert len(points) == 1000
+    assert points[1]['time'] - points[0]['time'] == pytest.approx(waveform['time_step'])
+    waveform = pyramid.waveform(0, 10, max_points=2000)
+    assert waveform['level'] == 2
+    assert waveform['values'].shape == (int(np.ceil(20000 / LEVEL_FACTOR ** 2)), 2)
+    # Coarser levels become a minimum and a maximum point per step
+    points = waveform_points(waveform)
+    assert len(points) == 2 * len(waveform['values'])
+    assert points[2]['time'] == pytest.approx(waveform['time_step'])
+    assert points[0]['amplitude'] <= points[1]['amplitude']
+
+    spectrogram = pyramid.spectrogram(1.0, 1.5)
+    assert spectrogram['values'].dtype == np.uint8
+    assert spectrogram['num_freq_bins'] == 129
+    assert spectrogram['num_time_bins'] == 101
+    assert spectrogram['values'].max() == 255
+
+    tile = pyramid.spectrogram_tile(0, 1)
+    assert tile['num_time_bins'] == 256
+    assert tile['begin'] == pytest.approx(256 * 0.005)
+    with pytest.raises(IndexError):
+        pyramid.spectrogram_tile(0, 100)
+    assert DiscoursePyramid.is_current(directory, pyramid.meta['key'])
+    assert len(pyramid.waveform(9.5, float('inf'))['values']) == 1000
@@ -0,0 +1,45 @@
+import json
+import struct
+
+import numpy as np
+
+from iscan.renderers import encode_arrays, decode_arrays
+
+
+def test_round_trip():
+    track = [{'time': 1.0 + i * 0.01, 'F0': 100.0 + i} for i in range(10)]
+    track[3]['F0'] = None
+    data = {'result': {'label': 'cat', 'begin': 1.0},
+            'pitch_track': track,
+            'spectrogram': {'values': np.arange(12, dtype=np.uint8).reshape(3, 4), 'time_step': 0.005},
+            'waveform': np.array([0.5, -0.25], dtype=np.float16)}
+    content = encode_arrays(data)
+    decoded = decode_arrays(content)
+    assert decoded['result'] == {'label': 'cat', 'begin': 1.0}
+    assert decoded['pitch_track'][3]['F0'] is None
+    assert decoded['pitch_track'][9]['time'] == track[9]['time']
+    assert decoded['pitch_track'][9]['F0'] == 109.0
+    assert decoded['spectrogram']['values'].dtype == np.uint8
+    np.testing.assert_array_equal(decoded['spectrogram']['values'], data['spectrogram']['values'])
+    assert decoded['waveform'].dtype == np.float32
+    np.testing.assert_array_equal(decoded['waveform'], [0.5, -0.25])
+
+
+def test_editable_tracks_keep_precision():
+    track = [{'time': 1.0 + i * 0.01, 'F0': 100.123456789 + i, 'F1': 512.987654321} for i in range(10)]
+    assert decode_arrays(encode_arrays({'pitch_track': track}))['pitch_track'] == track
+    # Waveform amplitudes are only displayed, so they are sent in single precision
+    waveform = [{'time': 1.0 + i * 0.01, 'amplitude': 0.1 * i} for i in range(10)]
+    content = encode_arrays(waveform)
+    header = json.loads(content[8:8 + struct.unpack('<I', content[4:8])[0]])
+    assert [x['dtype'] for x in header['arrays']] == ['float64', 'float32']
+
+
+def test_small_and_mixed_lists():
+    data = [{'time': 1.0, 'F0': 100.0}, {'label': 'a', 'begin': 0.5}]
+    assert decode_arrays(encode_arrays(data)) == data
+
+
+def test_smaller_than_json():
+    track = [{'time': 1.0 + i * 0.01, 'F0': 100.123456 + i} for i in range(1000)]
+    assert len(encode_arrays(track)) * 2 < len(json.dumps(track))
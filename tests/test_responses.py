@@ -0,0 +1,72 @@
+import gzip
+
+import pytest
+from django.test import RequestFactory
+
+from iscan.responses import parse_range, gzip_chunks, ranged_file_response, streaming_csv_response, etag_matches
+
+
+def test_parse_range():
+    assert parse_range(None, 100) is None
+    assert parse_range('bytes=0-9', 100) == (0, 9)
+    assert parse_range('bytes=90-', 100) == (90, 99)
+    assert parse_range('bytes=-10', 100) == (90, 99)
+    assert parse_range('bytes=50-500', 100) == (50, 99)
+    # Multiple ranges are answered with the whole file
+    assert parse_range('bytes=0-1,5-6', 100) is None
+    with pytest.raises(ValueError):
+        parse_range('bytes=100-', 100)
+
+
+def test_gzip_chunks():
+    chunks = ['label,begin\n', b'aa,0.5\n']
+    assert gzip.decompress(b''.join(gzip_chunks(chunks))) == b'label,begin\naa,0.5\n'
+
+
+def test_ranged_file_response(tmpdir):
+    path = str(tmpdir.join('export.csv'))
+    with open(path, 'wb') as f:
+        f.write(b'0123456789')
+    factory = RequestFactory()
+
+    response = ranged_file_response(factory.get('/'), path, 'text/csv', filename='export.csv')
+    assert response.status_code == 200
+    assert b''.join(response.streaming_content) == b'0123456789'
+    assert response['Accept-Ranges'] == 'bytes'
+    assert response['Content-Disposition'] == 'attachment; filename="export.csv"'
+    etag = response['ETag']
+
+    response = ranged_file_response(factory.get('/', HTTP_RANGE='bytes=4-', HTTP_IF_RANGE=etag), path, 'text/csv')
+    assert response.status_code == 206
+    assert response['Content-Range'] == 'bytes 4-9/10'
+    assert b''.join(response.streaming_content) == b'456789'
+
+    # A changed file is sent in full rather than resumed
+    response = ranged_file_response(factory.get('/', HTTP_RANGE='bytes=4-', HTTP_IF_RANGE='"old"'), path, 'text/csv')
+    assert response.status_code == 200
+    b''.join(response.streaming_content)
+
+    response = ranged_file_response(factory.get('/', HTTP_RANGE='bytes=20-'), path, 'text/csv')
+    assert response.status_code == 416
+
+    response = ranged_file_response(factory.get('/', HTTP_IF_NONE_MATCH=etag), path, 'text/csv')
+    assert response.status_code == 304
+    for header in ['"old", ' + etag, 'W/' + etag, '*']:
+        response = ranged_file_response(factory.get('/', HTTP_IF_NONE_MATCH=header), path, 'text/csv')
+        assert response.status_code == 304
+        assert response['ETag'] == etag
+
+
+def test_streaming_csv_response():
+    response = streaming_csv_response(iter(['a,b\n', '1,2\n']), 'export.csv', compress=True)
+    assert response['Content-Disposition'] == 'attachment; filename="export.csv.gz"'
+    assert gzip.decompress(b''.join(response.streaming_content)) == b'a,b\n1,2\n'
+
+
+def test_etag_matches():
+    factory = RequestFactory()
+    assert not etag_matches(factory.get('/'), '"hierarchy-1-2"')
+    assert etag_matches(factory.get('/', HTTP_IF_NONE_MATCH='"hierarchy-1-1", "hierarchy-1-2"'), '"hierarchy-1-2"')
+    assert not etag_matches(factory.get('/', HTTP_IF_NONE_MATCH='"hierarchy-1-1"'), '"hierarchy-1-2"')
+    assert etag_matches(factory.get('/', HTTP_IF_NONE_MATCH='W/"hierarchy-1-2"'), '"hierarchy-1-2"')
+    assert etag_matches(factory.get('/', HTTP_IF_NONE_MATCH='*'), '"hierarchy-1-2"')
@@ -0,0 +1,194 @@
+import os
+import json
+
+import pytest
+
+from iscan.results import QueryResultStore, ResultCache, MISSING, InvalidOrdering, flatten_row
+
+
+def make_rows():
+    return [
+        {'phone': {'current': {'id': 'a', 'label': 'aa', 'begin': 0.5, 'burst': [{'begin': 0.6}]},
+                   'previous': None},
+         'speaker': {'name': 'speaker_one'}},
+        {'phone': {'current': {'id': 'b', 'label': 'iy', 'begin': 0.1, 'burst': []},
+                   'previous': {'id': 'a', 'label': 'aa'}},
+         'speaker': {'name': 'speaker_two'}},
+        {'phone': {'current': {'id': 'c', 'label': 'ae', 'begin': None, 'burst': [{'begin': 0.2}]},
+                   'previous': {'id': 'b', 'label': 'iy'}},
+         'speaker': {'name': 'speaker_one'}},
+    ]
+
+
+def test_flatten_row():
+    row = {'phone': {'current': {'label': 'aa', 'pitch_track': [{'F0': 100}]}, 'previous': None}}
+    assert dict(flatten_row(row)) == {('phone', 'current', 'label'): 'aa',
+                                      ('phone', 'current', 'pitch_track'): [{'F0': 100}],
+                                      ('phone', 'previous'): None}
+
+
+def test_round_trip(tmpdir):
+    rows = make_rows()
+    store = QueryResultStore(str(tmpdir.join('results')))
+    store.write(rows)
+    assert store.exists
+    assert store.count == 3
+    assert store.get_rows(range(3)) == rows
+
+    reloaded = QueryResultStore(str(tmpdir.join('results')))
+    assert reloaded.get_slice(1, 1) == rows[1:2]
+    assert reloaded.get_slice(1) == rows[1:]
+    assert reloaded.get_rows([2], columns=['speaker']) == [{'speaker': {'name': 'speaker_one'}}]
+
+
+def test_append_new_columns(tmpdir):
+    rows = make_rows()
+    store = QueryResultStore(str(tmpdir))
+    store.write(rows[:2])
+    extra = {'phone': {'current': {'id': 'd', 'label': 'uw', 'F1': 300.0}, 'previous': None},
+             'speaker': {'name': 'speaker_two'}}
+    store.append([rows[2], extra])
+    assert store.count == 4
+    assert store.get_rows(range(4)) == rows + [extra]
+
+
+def test_permutation(tmpdir):
+    store = QueryResultStore(str(tmpdir))
+    store.write(make_rows())
+    assert list(store.permutation('phone.current.label')) == [0, 2, 1]
+    assert list(store.permutation('-phone.current.label')) == [1, 2, 0]
+    # Missing values sort as the type default
+    assert list(store.permutation('phone.current.begin')) == [2, 1, 0]
+    assert list(store.permutation('phone.previous.label')) == [0, 1, 2]
+    # Subannotation properties sort by the first subannotation
+    assert list(store.permutation('phone.current.burst.begin')) == [1, 2, 0]
+
+
+def test_permutation_typed_columns(tmpdir, monkeypatch):
+    store = QueryResultStore(str(tmpdir))
+    store.write(make_rows()[:2])
+    store.append(make_rows()[2:] + [{'phone': {'current': {'id': 'd', 'label': 'u"w', 'begin': 0.3}}}])
+    store.set_column(('phone', 'current', 'F1'), [300, MISSING, 250.5, None])
+
+    # Columns of numbers and text are sorted without decoding their rows one by one
+    def decode(*args):
+        raise AssertionError('Decoded a single row')
+
+    monkeypatch.setattr(store, '_value', decode)
+    assert list(store.permutation('phone.current.begin')) == [2, 1, 3, 0]
+    assert list(store.permutation('phone.current.F1')) == [1, 3, 2, 0]
+    assert list(store.permutation('phone.current.label')) == [0, 2, 1, 3]
+    assert list(store.permutation('speaker.name')) == [3, 0, 2, 1]
+
+
+def test_permutation_without_kinds(tmpdir):
+    # Stores written before column kinds were recorded are sorted by decoding their values
+    store = QueryResultStore(str(tmpdir))
+    store.write(make_rows())
+    meta = dict(store.meta)
+    del meta['kinds']
+    store._save_meta(meta)
+    store.clear_permutations()
+    assert list(store.permutation('phone.current.begin')) == [2, 1, 0]
+    store.append(make_rows()[:1])
+    assert list(store.permutation('phone.current.begin')) == [2, 1, 0, 3]
+
+
+def test_permutation_invalid_ordering(tmpdir):
+    store = QueryResultStore(str(tmpdir))
+    store.write(make_rows())
+    for ordering in ['phone.current.F1', '../../phone', 'speaker/name', '']:
+        with pytest.raises(InvalidOrdering):
+            store.permutation(ordering)
+    assert not [x for x in os.listdir(str(tmpdir)) if x.startswith('sort.')]
+
+
+def test_permutation_non_scalar_values(tmpdir):
+    rows = [{'phone': {'label': 'aa', 'pitch_track': [{'time': 0.1, 'F0': 120}]}},
+            {'phone': {'label': 'iy', 'pitch_track': [{'time': 0.1, 'F0': 100}]}},
+            {'phone': {'label': 'ae', 'pitch_track': []}}]
+    store = QueryResultStore(str(tmpdir))
+    store.write(rows)
+    # Subannotation-like lists of dicts are sorted by the text of their first value
+    assert list(store.permutation('phone.pitch_track')) == [2, 1, 0]
+
+
+def test_permutation_cache(tmpdir):
+    rows = make_rows()
+    store = QueryResultStore(str(tmpdir))
+    store.write(rows[:2])
+    assert list(store.permutation('-phone.current.label')) == [1, 0]
+    permutation_path = store._permutation_path('phone.current.label')
+    assert os.path.exists(permutation_path)
+    store.append(rows[2:])
+    assert not os.path.exists(permutation_path)
+    assert list(store.permutation('phone.current.label')) == [0, 2, 1]
+    assert store.get_rows(store.permutation('phone.current.label')[1:2]) == [rows[2]]
+
+
+def test_atomic_metadata(tmpdir):
+    store = QueryResultStore(str(tmpdir))
+    store.write(make_rows())
+    with open(store.meta_path) as f:
+        meta = json.load(f)
+    assert meta['count'] == 3
+    assert not os.path.exists(store.meta_path + '.tmp')
+
+
+def test_result_cache(tmpdir):
+    rows = make_rows()
+    store = QueryResultStore(str(tmpdir.join('query_one')))
+    store.write(rows)
+    cache = ResultCache(str(tmpdir.join('cache')), max_entries=2)
+    cache.add('key', store.directory, 1)
+    assert 'key' in cache
+
+    other = QueryResultStore(str(tmpdir.join('query_two')))
+    assert not cache.restore('missing', other.directory)
+    assert cache.restore('key', other.directory)
+    assert other.get_rows(range(3)) == rows
+
+    # Appending to a restored store leaves the cache entry untouched
+    other.append(rows[:1])
+    restored = QueryResultStore(str(tmpdir.join('query_three')))
+    cache.restore('key', restored.directory)
+    assert restored.count == 3
+    assert restored.get_rows(range(3)) == rows
+
+
+def test_result_cache_eviction(tmpdir):
+    store = QueryResultStore(str(tmpdir.join('query')))
+    store.write(make_rows())
+    cache = ResultCache(str(tmpdir.join('cache')), max_entries=2)
+    cache.add('first', store.directory, 1)
+    cache.add('second', store.directory, 2)
+    os.utime(cache._info_path('first'), (0, 0))
+    os.utime(cache._info_path('second'), (1, 1))
+    cache.restore('first', str(tmpdir.join('restored')))
+    cache.add('third', store.directory, 1)
+    assert [key for key, info in cache.entries()] == ['first', 'third']
+    cache.invalidate(1)
+    assert cache.entries() == []
+
+
+def test_set_columns(tmpdir):
+    rows = make_rows()
+    store = QueryResultStore(str(tmpdir))
+    store.write(rows)
+    store.set_columns([('phone', 'current', 'pitch_track'), ('phone', 'previous', 'pitch_track')],
+                      [([{'F0': 100}], MISSING), ([], [{'F0': 90}]), (None, [])])
+    assert store.get_rows([0]) == [{'phone': {'current': dict(rows[0]['phone']['current'], pitch_track=[{'F0': 100}]),
+                                              'previous': None},
+                                    'speaker': {'name': 'speaker_one'}}]
+    assert [r['phone']['previous'] for r in store.get_rows([1, 2], columns=['phone.previous'])] == \
+        [{'id': 'a', 'label': 'aa', 'pitch_track': [{'F0': 90}]}, {'id': 'b', 'label': 'iy', 'pitch_track': []}]
+
+    # Replacing a column keeps the rest of the store intact
+    store.set_column(('phone', 'current', 'pitch_track'), [[], [], []])
+    assert [r['phone']['current']['pitch_track'] for r in store.get_rows(range(3))] == [[], [], []]
+    with pytest.raises(ValueError):
+        store.set_column(('phone', 'current', 'pitch_track'), [[]])
+
+    store.remove_columns(('phone', 'current', 'pitch_track'))
+    store.remove_columns(('phone', 'previous', 'pitch_track'))
+    assert QueryResultStore(str(tmpdir)).get_rows(range(3)) == rows
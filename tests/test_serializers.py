@@ -0,0 +1,54 @@
+from polyglotdb.structure import Hierarchy
+
+from iscan.serializers import serializer_factory, compile_serializer
+
+
+def make_hierarchy():
+    h = Hierarchy({'phone': 'word', 'word': 'utterance', 'utterance': None}, corpus_name='synthetic')
+    h.type_properties = {'phone': {('label', str), ('id', str)},
+                         'word': {('label', str), ('transcription', str), ('id', str)},
+                         'utterance': {('id', str)}}
+    h.token_properties = {'phone': {('begin', float), ('end', float), ('id', str), ('stressed', bool)},
+                          'word': {('begin', float), ('end', float), ('id', str), ('num_phones', int)},
+                          'utterance': {('begin', float), ('end', float), ('id', str)}}
+    h.subannotations = {'phone': {'burst'}}
+    h.subannotation_properties = {'burst': {('begin', float), ('end', float), ('id', str)}}
+    h.speaker_properties = {('name', str), ('age', int)}
+    h.discourse_properties = {('name', str), ('duration', float), ('file_path', str)}
+    return h
+
+
+query_kwargs = {'positions': {'phone': ['current', 'previous', 'following'], 'word': ['current'],
+                              'utterance': ['current']},
+                'top_level': True, 'acoustic_columns': ['pitch'], 'detail': False,
+                'with_higher_annotations': True, 'with_subannotations': True}
+
+
+def test_compiled_matches_factory_for_query_rows(synthetic_phones):
+    hierarchy = make_hierarchy()
+    phones = synthetic_phones(num_utterances=2)
+    expected = serializer_factory(hierarchy, 'phone', **query_kwargs)(phones, many=True).data
+    serialize = compile_serializer(hierarchy, 'phone', **query_kwargs)
+    assert [serialize(x) for x in phones] == expected
+
+
+def test_compiled_matches_factory_for_detail(synthetic_phones):
+    hierarchy = make_hierarchy()
+    utterance = synthetic_phones(num_utterances=1)[0].utterance
+    kwargs = {'acoustic_columns': [], 'top_level': True, 'with_lower_annotations': True, 'detail': True,
+              'with_subannotations': True}
+    expected = serializer_factory(hierarchy, 'utterance', **kwargs)(utterance).data
+    assert compile_serializer(hierarchy, 'utterance', **kwargs)(utterance) == expected
+
+    phone = utterance.phone[0]
+    kwargs = {'top_level': True, 'with_subannotations': True}
+    expected = serializer_factory(hierarchy, 'phone', **kwargs)(phone).data
+    assert compile_serializer(hierarchy, 'phone', **kwargs)(phone) == expected
+
+
+def test_compiled_serializer_cache():
+    hierarchy = make_hierarchy()
+    serialize = compile_serializer(hierarchy, 'phone', **query_kwargs)
+    assert compile_serializer(hierarchy, 'phone', **query_kwargs) is serialize
+    hierarchy.token_properties['phone'].add(('duration', float))
+    assert compile_serializer(hierarchy, 'phone', **query_kwargs) is not serialize
@@ -0,0 +1,84 @@
+import sys
+import time
+import struct
+import socket
+import threading
+import subprocess
+import http.server
+
+from iscan.supervisor import backoff_wait, bolt_ready, influxdb_ready, write_pidfile, pid_alive, \
+    DatabaseSupervisor, BOLT_MAGIC
+
+
+def test_backoff_wait():
+    calls = []
+
+    def probe():
+        calls.append(time.monotonic())
+        return len(calls) == 4
+
+    assert backoff_wait(probe, 5, initial_delay=0.01)
+    gaps = [b - a for a, b in zip(calls, calls[1:])]
+    assert gaps[2] > gaps[0]
+    assert not backoff_wait(lambda: False, 0.05, initial_delay=0.01)
+
+
+def serve_once(handle):
+    server = socket.socket()
+    server.bind(('localhost', 0))
+    server.listen(1)
+
+    def run():
+        connection, _ = server.accept()
+        with connection:
+            handle(connection)
+        server.close()
+
+    threading.Thread(target=run, daemon=True).start()
+    return server.getsockname()[1]
+
+
+def test_bolt_ready():
+    def handshake(connection):
+        assert connection.recv(4) == BOLT_MAGIC
+        connection.recv(16)
+        connection.sendall(struct.pack('>I', 3))
+
+    assert bolt_ready('localhost', serve_once(handshake))
+    # Accepting connections isn't enough, the server has to agree on a version
+    assert not bolt_ready('localhost', serve_once(lambda c: c.sendall(b'\x00\x00\x00\x00')))
+
+
+def test_influxdb_ready():
+    class PingHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(204 if self.path == '/ping' else 404)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.HTTPServer(('localhost', 0), PingHandler)
+    threading.Thread(target=server.handle_request, daemon=True).start()
+    assert influxdb_ready('localhost', server.server_address[1])
+    server.server_close()
+    assert not influxdb_ready('localhost', server.server_address[1])
+
+
+def test_supervisor_stop(synthetic_database):
+    supervisor = DatabaseSupervisor(synthetic_database)
+    proc = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'], start_new_session=True)
+    write_pidfile(supervisor.pidfile_path('influxdb'), proc.pid)
+    assert supervisor.pids() == {'neo4j': None, 'influxdb': proc.pid}
+    supervisor.stop(timeout=10)
+    assert not pid_alive(proc.pid)
+    assert supervisor.pids() == {'neo4j': None, 'influxdb': None}
+
+
+def test_supervisor_stop_without_pidfile(synthetic_database):
+    # A database started before pidfiles were kept is stopped through the PIDs stored on it
+    supervisor = DatabaseSupervisor(synthetic_database)
+    proc = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])
+    assert supervisor.pids() == {'neo4j': None, 'influxdb': None}
+    supervisor.stop(timeout=10, fallback_pids={'neo4j': None, 'influxdb': proc.pid})
+    assert not pid_alive(proc.pid)